@@ -0,0 +1,197 @@
+# coding: utf-8
+"""
+Mosketch client on asyncio, without Qt: for mayapy batch jobs and tools (Python 3.7 or later).
+It runs the same protocol, handshake and scene writes as the QTcpSocket path of mosketch_for_maya:
+    import asyncio
+    import mosketch_asyncio
+    asyncio.run(mosketch_asyncio.run_client("192.168.0.12"))
+
+Three coroutines share the connection. The reader splits the received bytes into frames, the processor
+acts on them (mapping, retarget, scene writes) and the writer sends what the protocol queued. They are
+linked by bounded queues: when the scene is slower than the stream, reading waits instead of buffering
+without limit, and the JointsStreams that piled up meanwhile are coalesced. A fourth one polls the shared
+memory when Mosketch writes the poses there (see mosketch_for_maya.SHARED_MEMORY_MODE).
+Long operations (mapping a big rig...) run one scheduler tick per turn of the loop, so that reading and
+writing go on meanwhile (see mosketch_for_maya.TaskScheduler).
+"""
+import asyncio
+import socket
+import time
+
+import mosketch_for_maya
+
+READ_SIZE = 65536
+# Reads waiting to be processed, and writes waiting to be sent
+QUEUE_SIZE = 64
+
+
+class MosketchAsyncClient(object):
+    """
+    One connection to Mosketch. While it runs it is mosketch_for_maya.CONNECTION, and like the
+    QTcpSocket it has write/flush/close/errorString.
+    """
+    def __init__(self, ip=None, port=None, queue_size=QUEUE_SIZE):
+        self.ip = ip or mosketch_for_maya.IP
+        self.port = port or mosketch_for_maya.PORT
+        self.queue_size = queue_size
+        self.incoming = None # Lists of frames, None once reading is over
+        self.outgoing = None # Bytes, None once processing is over
+        self._stream_reader = None
+        self._stream_writer = None
+        self._processing = False
+        self._overflow = [] # Bytes written while outgoing was full, sent after what was queued before them
+        self._overflow_behind = 0 # Queued writes to send before the overflow
+        self._error = ""
+
+    async def run(self):
+        """
+        Connect, then read, process and write until Mosketch disconnects or close() is called.
+        """
+        # Created here so that they belong to the running loop
+        self.incoming = asyncio.Queue(self.queue_size)
+        self.outgoing = asyncio.Queue(self.queue_size)
+        mosketch_for_maya._reset_session()
+
+        print("Trying to connect to " + self.ip + ":" + str(self.port) + " (asyncio)")
+        try:
+            self._stream_reader, self._stream_writer = await asyncio.open_connection(self.ip, self.port)
+        except OSError as e:
+            self._error = str(e)
+            mosketch_for_maya._print_error("cannot connect to " + self.ip + ":" + str(self.port) + " (" + self._error + ")")
+            return
+        connection_socket = self._stream_writer.get_extra_info("socket")
+        if connection_socket is not None:
+            connection_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        mosketch_for_maya.CONNECTION = self
+        mosketch_for_maya.SCHEDULER_TICKED_BY_CLIENT = True
+        mosketch_for_maya._print_success("connection opened on " + self.ip + ":" + str(self.port))
+
+        try:
+            self._processing = True
+            await asyncio.gather(self._read(), self._process(), self._write(), self._poll_shared_memory())
+        finally:
+            self._stream_writer.close()
+            mosketch_for_maya.SCHEDULER_TICKED_BY_CLIENT = False
+            if mosketch_for_maya.CONNECTION is self:
+                mosketch_for_maya.CONNECTION = None
+                mosketch_for_maya.PROTOCOL.decoder.reset()
+                mosketch_for_maya._close_shared_memory()
+            mosketch_for_maya._print_success("connection closed on " + self.ip + ":" + str(self.port))
+
+    async def _read(self):
+        try:
+            while True:
+                data = await self._stream_reader.read(READ_SIZE)
+                if not data:
+                    break
+                read_start = mosketch_for_maya._clock()
+                frames = mosketch_for_maya.PROTOCOL.decoder.feed(data)
+                mosketch_for_maya._record_latency("read", read_start)
+                capture = mosketch_for_maya.CAPTURE
+                if capture is not None:
+                    capture.write_frames(frames, time.time())
+                if frames:
+                    await self.incoming.put(frames)
+        except OSError as e:
+            self._error = str(e)
+            mosketch_for_maya._print_error(self._error)
+        finally:
+            await self.incoming.put(None)
+
+    async def _process(self):
+        done = False
+        while not done:
+            frames = await self.incoming.get()
+            done = frames is None
+            frames = frames or []
+            # Everything read meanwhile at once, so that only the newest JointsStream is applied
+            while not done and not self.incoming.empty():
+                more_frames = self.incoming.get_nowait()
+                done = more_frames is None
+                frames.extend(more_frames or [])
+            mosketch_for_maya._process_frames(frames) # Runs the first tick
+            await self._send_protocol_data()
+            await self._run_scheduler()
+        self._processing = False
+        await self.outgoing.put(None)
+
+    async def _run_scheduler(self):
+        # What is left of long operations, one tick per turn of the loop
+        while len(mosketch_for_maya.SCHEDULER) > 0:
+            await asyncio.sleep(0)
+            mosketch_for_maya.SCHEDULER.run(mosketch_for_maya.SCHEDULER_BUDGET_MS)
+            await self._send_protocol_data()
+
+    async def _send_protocol_data(self):
+        data = mosketch_for_maya.PROTOCOL.data_to_send()
+        if data is not None and self._processing: # Nobody takes what comes after the final None
+            await self.outgoing.put(data)
+
+    async def _poll_shared_memory(self):
+        while self._processing:
+            await asyncio.sleep(mosketch_for_maya.SHARED_MEMORY_POLL_MS / 1000.0)
+            if mosketch_for_maya.SHARED_MEMORY is not None:
+                mosketch_for_maya._shared_memory_tick() # Runs the first tick
+                await self._run_scheduler()
+
+    async def _write(self):
+        while True:
+            data = await self.outgoing.get()
+            if data is None:
+                # Processing is over: what write() put behind the queue is all that is left
+                if self._overflow:
+                    await self._send(b"".join(self._overflow))
+                    del self._overflow[:]
+                return
+            if self._overflow:
+                self._overflow_behind -= 1
+                if self._overflow_behind <= 0:
+                    data += b"".join(self._overflow)
+                    del self._overflow[:]
+            await self._send(data)
+
+    async def _send(self, data):
+        write_start = mosketch_for_maya._clock()
+        try:
+            self._stream_writer.write(data)
+            await self._stream_writer.drain()
+        except OSError as e:
+            # Keep consuming so that the processor never waits on a full queue
+            self._error = str(e)
+            return
+        mosketch_for_maya._record_latency("ack", write_start)
+
+    def write(self, data):
+        """
+        Called by mosketch_for_maya outside of the processor (UPDATE MOSKETCH, live update...).
+        It cannot wait: data holds acks and commands taken from the protocol, losing them would stall Mosketch.
+        """
+        if not isinstance(data, bytes):
+            data = data.encode("utf-8")
+        if self._overflow or self.outgoing.full():
+            # Behind what is queued, the writer gets to it as it takes those
+            if not self._overflow:
+                self._overflow_behind = self.outgoing.qsize()
+            self._overflow.append(data)
+        else:
+            self.outgoing.put_nowait(data)
+
+    def flush(self):
+        pass # The writer sends as soon as it can
+
+    def close(self):
+        if self._stream_writer is not None:
+            self._stream_writer.close() # Reading stops, then processing and writing
+
+    def errorString(self):
+        return self._error
+
+
+async def run_client(ip=None, port=None, queue_size=QUEUE_SIZE):
+    """
+    Stream from Mosketch (mosketch_for_maya.IP and PORT by default) until it disconnects.
+    Returns the client, for instance to read its errorString().
+    """
+    client = MosketchAsyncClient(ip, port, queue_size)
+    await client.run()
+    return client
@@ -33,11 +33,42 @@ https://support.mokastudio.com/support/solutions/articles/6000198416-streaming-d
 
 import os, sys, locale
 import platform
+import array
+import bisect
+import csv
+import io
+import mmap
 import json
+import hashlib
+import math
+import re
+import select
+import struct
+import tempfile
+import threading
+import time
+import timeit
+import zlib
+from collections import OrderedDict, deque
 import pymel.core as pmc
+import maya.cmds as cmds
 import maya.OpenMayaUI as OpenMayaUI
 import maya.mel as mel
+try:
+    import maya.api.OpenMaya as om2
+    import maya.api.OpenMayaAnim as oma2
+except ImportError: # Maya API 2.0 is not available
+    om2 = None
+    oma2 = None
 import socket
+try:
+    import numpy
+except ImportError: # NumPy is not shipped with every Maya version
+    numpy = None
+try:
+    import Queue as queue
+except ImportError: # Python 3
+    import queue
 
 # Support for Qt4 and Qt5 depending on Maya version
 from Qt import QtCore
@@ -45,6 +76,7 @@ from Qt import QtGui
 from Qt import QtWidgets
 from Qt import __version__
 from Qt import QtNetwork
+from Qt import QtCompat
 
 from Qt import __binding__
 if __binding__ in ('PySide2', 'PyQt5'):
@@ -73,38 +105,155 @@ JSON_KEY_JOINTS = "Joints"
 JSON_KEY_OBJECT = "object"
 JSON_KEY_COMMAND = "command"
 JSON_KEY_PARAMETERS = "parameters"
+JSON_KEY_SEQUENCE = "Seq"
+JSON_KEY_WINDOW = "Window"
+JSON_KEY_MODE = "Mode"
+JSON_KEY_TRANSPORT = "Transport"
 
 # Packet Type
 PACKET_TYPE_COMMAND = "MosketchCommand"
 
-# Maya joints buffers
-JOINTS_BUFFER = {}
-JOINTS_INIT_ORIENT_INV_BUFFER = {}
-JOINTS_ROTATE_AXIS_INV_BUFFER = {}
+# Maya joints bindings (see BindingTable), built for each Hierarchy
+JOINTS_BINDINGS = None
 
-# Maya FK controllers buffers
-CONTROLLERS_BUFFER = {}
-CONTROLLERS_INIT_ORIENT_INV_BUFFER = {}
-CONTROLLERS_ROTATE_AXIS_INV_BUFFER = {}
+# Maya FK controllers bindings
+CONTROLLERS_BINDINGS = None
 
 # We get joints name from Mosketch, we need to associate them to Maya HIK FK controllers
 JOINTS_NAME_TO_CONTROLLERS = {}
 CONTROLLERS_TO_JOINTS_NAME = {}
 
+# HIKCharacterNode to stream to when the scene has several (see set_hik_character()).
+# When None, HumanIK's current character is used, or the first one
+HIK_CHARACTER = None
+
 # Mosketch joints uuids
 JOINTS_UUIDS = {}
+# Joints names in the order of the JointsUuids packet: this is the order of binary JointsStreams
+JOINTS_UUIDS_ORDER = []
+
+# Ask Mosketch for compact binary JointsStreams (it keeps sending Json if it does not support them)
+BINARY_JOINTS_STREAM = True
+BINARY_STREAM_MAGIC = b"MKJS"
+BINARY_STREAM_VERSION = 1
+
+# Ask Mosketch for windowed acknowledgements: one JointsStreamAck per read with the highest sequence applied
+# and how many frames may be in flight, instead of one per frame (see FlowControl)
+WINDOWED_ACKS = True
+ACK_WINDOW_MAX = 8
+# Above that apply time per frame the window shrinks so that Mosketch slows down
+ACK_FRAME_BUDGET_MS = 1000.0 / 60.0
 
 # Utils
 PI = 3.1415926535897932384626433832795
 RAD_2_DEG = 180.0 / PI
 
+# How rotate axis and joint orient are substracted from the received rotations:
+# "numpy" (whole frame at once), "python" (plain tuples) or "pymel" (pmc.datatypes)
+RETARGET_BACKENDS = ["numpy", "python", "pymel"]
+RETARGET_BACKEND = "numpy" if numpy is not None else "python"
+# Below that many bindings NumPy's per call overhead costs more than it saves
+NUMPY_MIN_JOINTS = 64
+
+# How poses are written into the scene: "openmaya" (one MDGModifier per frame) or "pymel" (setRotation per joint)
+APPLY_BACKENDS = ["openmaya", "pymel"]
+APPLY_BACKEND = "openmaya" if om2 is not None else "pymel"
+
+# Joints that moved less than that since their last write are not written again (radians and centimeters).
+# Set SKIP_UNCHANGED_WRITES to False to write every streamed joint on every frame
+SKIP_UNCHANGED_WRITES = True
+ROTATION_WRITE_EPSILON = 0.0001
+TRANSLATION_WRITE_EPSILON = 0.001
+
+# Json libraries by order of preference, the first one available is used (see set_json_backend())
+JSON_BACKENDS = ["orjson", "ujson", "simplejson", "json"]
+JSON_BACKEND = None
+
 # Verbose level (1 for critical informations, 3 to output all packets)
 VERBOSE = 1
 
+# Messages are queued and flushed to the Script Editor and the log panel by the window's timer,
+# never from the stream processing. Oldest ones are dropped when more than LOG_QUEUE_SIZE are waiting
+LOG_QUEUE = deque(maxlen=1000)
+LOG_REFRESH_MS = 250
+LOG_PANEL_LINES = 200
+
 STREAMING_MODE = "Joints"
 
-# Large packets sent over the LAN may be split. So use a buffer to reconstruct them
-SOCKET_DATA_BUFFER = ""
+# Protocol state of the current connection: frame decoder, handshake, acknowledgements and what is
+# waiting to be sent. Everything sent during one event loop turn goes out in a single write (see MosketchProtocol)
+PROTOCOL = None
+
+# When several JointsStream are received at once only the newest one is applied
+COALESCE_JOINTS_STREAM = True
+
+# Read and decode the stream in a background thread: Maya's main thread only applies the latest pose
+NETWORK_THREAD_MODE = False
+NETWORK_THREAD = None
+NETWORK_THREAD_TIMER = None
+NETWORK_THREAD_POLL_MS = 5
+
+# Same machine as Mosketch (IP is a loopback address): poses are read from a memory-mapped ring buffer instead of
+# the socket, which then only carries control messages (see SharedPoseBuffer). Used once Mosketch accepted it
+SHARED_MEMORY_MODE = False
+SHARED_MEMORY = None
+SHARED_MEMORY_TIMER = None
+SHARED_MEMORY_POLL_MS = 5
+SHARED_MEMORY_SLOTS = 4
+SHARED_MEMORY_PATH = None # A file of the temporary directory by default
+SHARED_MEMORY_MAGIC = b"MKSM"
+SHARED_MEMORY_VERSION = 1
+
+# Mapping a hierarchy and applying poses are split into chunks, run by SCHEDULER for at most SCHEDULER_BUDGET_MS
+# per turn of Maya's event loop so that a big rig never freezes the UI (see TaskScheduler and get_scheduler_stats()).
+# None runs them to completion at once, as without a window
+SCHEDULER = None
+SCHEDULER_TIMER = None
+SCHEDULER_BUDGET_MS = 8.0
+SCHEDULER_TICKED_BY_CLIENT = False # Set by mosketch_asyncio: its event loop runs the ticks instead of Maya's
+MAPPING_CHUNK_SIZE = 32 # Joints mapped per chunk
+APPLY_CHUNK_SIZE = 128 # Joints written per chunk
+
+# Latency of each stage of the stream pipeline, over the last LATENCY_SAMPLES frames (see get_latency_stats())
+LATENCY_STATS = True
+LATENCY_STAGES = ["read", "decode", "lookup", "retarget", "write", "ack"]
+LATENCY_SAMPLES = 1024
+STAGE_LATENCIES = None
+
+# Counters about the received stream (see get_stream_stats())
+STREAM_STATS = {
+    "joints_stream_applied": 0,
+    "joints_stream_dropped": 0,
+    "writes_skipped": 0,
+    "writes_skipped_last_frame": 0,
+    "shared_memory_torn_reads": 0,
+}
+
+# Record mode: applied frames are stored by RECORDER then baked into animation curves (see start_recording())
+RECORDING = False
+RECORDER = None
+# Frames preallocated when a recording starts (one minute at 60 fps), the buffer doubles when full
+RECORD_INITIAL_FRAMES = 3600
+
+# Live update: joints changed in Maya are streamed to Mosketch, at most LIVE_UPDATE_RATE times per second
+# (see start_live_update())
+LIVE_UPDATE = None
+LIVE_UPDATE_TIMER = None
+LIVE_UPDATE_RATE = 30
+LIVE_UPDATE_APPLYING = False # Set while a received pose is written, so that it is not sent back
+
+# Capture of the received packets into a file, and replay of such a file (see start_capture() and start_replay())
+CAPTURE = None
+REPLAY = None
+REPLAY_TIMER = None
+
+# Bindings of the last mapped hierarchies, so that reconnecting to the same rig does not map it again.
+# Keyed by a hash of the Hierarchy joints and of the scene nodes identities (see _mapping_cache_key())
+MAPPING_CACHE = OrderedDict()
+MAPPING_CACHE_SIZE = 4
+MAPPING_CACHE_NODE_TYPES = ["joint", "HIKCharacterNode", "HIKControlSetNode"]
+# Scene callbacks clearing it when a scene is opened, created or referenced (see _watch_scene_changes())
+SCENE_CALLBACK_IDS = []
 
 ################################################################################
 ##########          MAIN FUNCTIONS
@@ -162,10 +311,333 @@ def stop():
     """
     if CONNECTION is not None:
         _close_connection()
+    stop_live_update()
+    _unwatch_scene_changes()
 
     _destroy_gui()
 
 
+def run_headless(ip=None, port=None, duration=None, record=False, capture_path=None):
+    """
+    Stream from Mosketch without any window, timer or event loop, for instance in mayapy on a farm node:
+        import maya.standalone
+        maya.standalone.initialize()
+        maya.cmds.file("C:/scenes/mosko.ma", open=True)
+        import mosketch_for_maya
+        mosketch_for_maya.run_headless("192.168.0.12", duration=3600, record=True)
+        maya.cmds.file(save=True)
+    It blocks until Mosketch disconnects, duration seconds are over or Ctrl+C. With record the stream is
+    baked into animation curves at the end, with capture_path it is also captured into that file.
+    Returns get_stream_stats().
+    """
+    global CONNECTION
+    global IP
+    global PORT
+
+    if CONNECTION is not None:
+        _print_error("connection is already opened.")
+        return None
+    IP = ip or IP
+    PORT = port or PORT
+    if _is_valid_ipv4_address(IP) == False:
+        _print_error('IP address looks wrong, please enter a valid IP address')
+        return None
+
+    _reset_session()
+    _print_verbose("Trying to connect to %s", 1, _get_connection_name())
+    try:
+        connection = _BlockingConnection(IP, PORT)
+    except Exception as e:
+        _print_error("cannot connect to " + _get_connection_name() + " (" + str(e) + ")")
+        return None
+    CONNECTION = connection
+    _connected()
+
+    if capture_path is not None:
+        start_capture(capture_path)
+    if record:
+        start_recording()
+    end_time = None if duration is None else time.time() + duration
+    try:
+        # The connection is closed (CONNECTION is None) when the mapping fails
+        while CONNECTION is connection:
+            if end_time is not None and time.time() >= end_time:
+                break
+            if SHARED_MEMORY is not None:
+                _shared_memory_tick()
+                data = connection.read(SHARED_MEMORY_POLL_MS / 1000.0)
+            else:
+                data = connection.read()
+            if data is None:
+                continue
+            if not data:
+                if connection.errorString():
+                    _print_error(connection.errorString())
+                _print_success("connection closed on " + _get_connection_name())
+                break
+            _receive_data(data, _clock())
+    except KeyboardInterrupt:
+        _print_success("interrupted")
+    finally:
+        if record:
+            stop_recording()
+        if capture_path is not None:
+            stop_capture()
+        if CONNECTION is connection:
+            _close_connection()
+    return get_stream_stats()
+
+
+def get_stream_stats():
+    """
+    Returns counters about the received stream, for instance:
+        print mosketch_for_maya.get_stream_stats()
+    """
+    stats = dict(STREAM_STATS)
+    stats["json_backend"] = JSON_BACKEND
+    stats["protocol_state"] = PROTOCOL.state
+    stats["scheduled_tasks"] = len(SCHEDULER)
+    stats["ack_window"] = PROTOCOL.flow_control.window if PROTOCOL.flow_control.enabled else None
+    stats["shared_memory"] = SHARED_MEMORY.path if SHARED_MEMORY is not None else None
+    outbound = PROTOCOL.outbound
+    outbound.update_rates()
+    stats["writes"] = outbound.writes
+    stats["bytes_written"] = outbound.bytes_written
+    stats["writes_per_second"] = outbound.writes_per_second
+    stats["bytes_per_second"] = outbound.bytes_per_second
+    stats["frames_decoded"] = PROTOCOL.decoder.frames_decoded
+    stats["partial_reads"] = PROTOCOL.decoder.partial_reads
+    stats["bytes_buffered"] = PROTOCOL.decoder.bytes_buffered
+    return stats
+
+
+def get_latency_stats():
+    """
+    Returns {stage: (p50, p95, p99)} in milliseconds over the last LATENCY_SAMPLES frames, for instance:
+        print mosketch_for_maya.get_latency_stats()["decode"]
+    """
+    return OrderedDict((stage, ring.percentiles((0.5, 0.95, 0.99))) for stage, ring in STAGE_LATENCIES.items())
+
+
+def get_scheduler_stats():
+    """
+    Returns {operation: {"count", "ticks", "max_ticks", "ms"}} for the operations run by the scheduler
+    ("hierarchy", "joints_stream"...): how many ran, over how many event loop turns the last one and the
+    longest one were spread, and the time spent in the last one. For instance:
+        print mosketch_for_maya.get_scheduler_stats()["hierarchy"]["ticks"]
+    """
+    return dict((operation, dict(stats)) for operation, stats in SCHEDULER.stats.items())
+
+
+def dump_latencies(path):
+    """
+    Write the raw latency samples (stage, sample, milliseconds) into a CSV file.
+    """
+    with io.open(path, "wb" if sys.version_info[0] == 2 else "w") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow([str("stage"), str("sample"), str("milliseconds")])
+        for stage, ring in STAGE_LATENCIES.items():
+            for index, seconds in enumerate(ring.samples()):
+                writer.writerow([str(stage), index, "%.4f" % (seconds * 1000.0)])
+    _print_success("latencies written into " + path)
+
+
+def set_json_backend(name=None):
+    """
+    Select the Json library used to parse and build packets, for instance:
+        mosketch_for_maya.set_json_backend("ujson")
+    Without name, the fastest available one is used (see JSON_BACKENDS).
+    """
+    global JSON_BACKEND
+    global _json_loads
+    global _json_dumps
+
+    names = [name] if name is not None else JSON_BACKENDS
+    for backend_name in names:
+        try:
+            _json_loads, _json_dumps = _load_json_backend(backend_name)
+        except ImportError:
+            continue
+        JSON_BACKEND = backend_name
+        return JSON_BACKEND
+    raise ImportError("Json backend " + str(name) + " is not available")
+
+
+def start_recording():
+    """
+    Record every applied JointsStream until stop_recording() bakes them at the scene frame rate,
+    starting at the current frame.
+    """
+    global RECORDING
+    global RECORDER
+
+    if om2 is None:
+        _print_error("cannot record: Maya API 2.0 is not available")
+        return
+    RECORDER = None # Created on the first frame, once a hierarchy is mapped
+    RECORDING = True
+    _print_success("recording")
+
+
+def stop_recording():
+    """
+    Stop recording and bake the recorded frames into animation curves.
+    """
+    global RECORDING
+    global RECORDER
+
+    RECORDING = False
+    if RECORDER is not None:
+        _bake_recorder(RECORDER)
+        RECORDER = None
+
+
+def start_live_update():
+    """
+    Stream the joints moved in Maya to Mosketch until stop_live_update(): attribute changed callbacks
+    mark them dirty and a timer sends a JointsStream of the dirty joints only, LIVE_UPDATE_RATE times per second.
+    """
+    global LIVE_UPDATE
+    global LIVE_UPDATE_TIMER
+
+    if om2 is None:
+        _print_error("cannot update Mosketch live: Maya API 2.0 is not available")
+        return
+    if LIVE_UPDATE is not None:
+        return
+    LIVE_UPDATE = LiveUpdate() # Callbacks are registered on the first tick, once a hierarchy is mapped
+    LIVE_UPDATE_TIMER = QtCore.QTimer(MAIN_WINDOW)
+    LIVE_UPDATE_TIMER.timeout.connect(_live_update_tick)
+    LIVE_UPDATE_TIMER.start(int(1000 / LIVE_UPDATE_RATE))
+    _print_success("updating Mosketch live")
+
+
+def stop_live_update():
+    """
+    Stop streaming the joints moved in Maya.
+    """
+    global LIVE_UPDATE
+    global LIVE_UPDATE_TIMER
+
+    if LIVE_UPDATE_TIMER is not None:
+        LIVE_UPDATE_TIMER.stop()
+        LIVE_UPDATE_TIMER = None
+    if LIVE_UPDATE is not None:
+        LIVE_UPDATE.unregister()
+        LIVE_UPDATE = None
+
+
+def start_capture(path, compress=False):
+    """
+    Write every received packet with its arrival time into path (and its index into path + ".idx"), for instance:
+        mosketch_for_maya.start_capture("C:/captures/session.mkcap", compress=True)
+    """
+    global CAPTURE
+
+    stop_capture()
+    try:
+        CAPTURE = StreamCapture(path, compress)
+        _print_success("capturing into " + path)
+    except Exception as e:
+        _print_error("cannot start capture (" + type(e).__name__ + ": " + str(e) +")")
+
+
+def stop_capture():
+    global CAPTURE
+
+    if CAPTURE is not None:
+        capture = CAPTURE
+        CAPTURE = None
+        capture.close()
+        _print_success("captured " + str(capture.frames_count) + " packets")
+
+
+def start_replay(path, speed=1.0, start_time=0.0):
+    """
+    Replay a capture into the scene as if Mosketch was connected, for instance:
+        mosketch_for_maya.start_replay("C:/captures/session.mkcap", speed=2.0, start_time=600.0)
+    speed 1.0 is the original speed, None replays as fast as possible and 0 pauses (see replay_step()).
+    """
+    global CONNECTION
+    global PROTOCOL
+    global REPLAY
+
+    if CONNECTION is not None and REPLAY is None:
+        _print_error("cannot replay while Mosketch is connected")
+        return
+    stop_replay()
+    try:
+        REPLAY = CaptureReplay(CaptureReader(path))
+    except Exception as e:
+        _print_error("cannot open capture (" + type(e).__name__ + ": " + str(e) +")")
+        return
+    # Acknowledgements and commands are discarded
+    CONNECTION = _ReplayConnection()
+    PROTOCOL = MosketchProtocol()
+    REPLAY.seek(start_time)
+    set_replay_speed(speed)
+
+
+def set_replay_speed(speed):
+    """
+    Change the speed of the current replay: 1.0 is the original speed, None is as fast as possible, 0 pauses.
+    """
+    if REPLAY is not None:
+        REPLAY.set_speed(speed)
+        _schedule_replay()
+
+
+def replay_step(count=1):
+    """
+    Pause the current replay and process the next count packets.
+    """
+    if REPLAY is not None:
+        set_replay_speed(0)
+        REPLAY.process(count)
+
+
+def replay_seek(timestamp):
+    """
+    Jump to timestamp (in seconds from the beginning of the capture) in the current replay.
+    """
+    if REPLAY is not None:
+        REPLAY.seek(timestamp)
+
+
+def stop_replay():
+    global CONNECTION
+    global REPLAY
+
+    if REPLAY is None:
+        return
+    if REPLAY_TIMER is not None:
+        REPLAY_TIMER.stop()
+    REPLAY.reader.close()
+    REPLAY = None
+    _stop_scheduler()
+    if isinstance(CONNECTION, _ReplayConnection):
+        CONNECTION = None
+
+
+def clear_mapping_cache():
+    """
+    Forget the mapped hierarchies, for instance after editing the rotate axis or joint orients of a rig:
+        mosketch_for_maya.clear_mapping_cache()
+    Opening, creating or referencing a scene clears them already.
+    """
+    MAPPING_CACHE.clear()
+
+
+def set_hik_character(name=None):
+    """
+    Select the HIKCharacterNode driven in Controllers streaming mode when the scene has several, for instance:
+        mosketch_for_maya.set_hik_character("Character1")
+    Without name, HumanIK's current character is used.
+    """
+    global HIK_CHARACTER
+    HIK_CHARACTER = name
+
+
 def load_mosko():
     """
     Load Mosko FBX file
@@ -238,6 +710,14 @@ class UI_MosketchWindow(QtWidgets.QDialog):
         streaming_mode_layout.addWidget(streaming_mode_label)
         streaming_mode_layout.addWidget(streaming_mode_combo)
 
+        network_thread_checkbox = QtWidgets.QCheckBox("Read stream in a background thread", content)
+        network_thread_checkbox.setChecked(NETWORK_THREAD_MODE)
+        network_thread_checkbox.toggled.connect(_network_thread_mode_toggled)
+
+        shared_memory_checkbox = QtWidgets.QCheckBox("Read poses from shared memory (same machine)", content)
+        shared_memory_checkbox.setChecked(SHARED_MEMORY_MODE)
+        shared_memory_checkbox.toggled.connect(_shared_memory_mode_toggled)
+
         connect_button = QtWidgets.QToolButton(content)
         connect_button.setText("CONNECT")
         connect_button.setAutoRaise(True)
@@ -251,10 +731,22 @@ class UI_MosketchWindow(QtWidgets.QDialog):
         update_mosketch_button.setAutoRaise(True)
         update_mosketch_button.setCheckable(False)
         update_mosketch_button.clicked.connect(_update_mosketch)
+        record_button = QtWidgets.QToolButton(content)
+        record_button.setText("RECORD")
+        record_button.setAutoRaise(True)
+        record_button.setCheckable(True)
+        record_button.toggled.connect(_record_toggled)
+        live_update_button = QtWidgets.QToolButton(content)
+        live_update_button.setText("LIVE UPDATE")
+        live_update_button.setAutoRaise(True)
+        live_update_button.setCheckable(True)
+        live_update_button.toggled.connect(_live_update_toggled)
         buttons_layout = QtWidgets.QHBoxLayout()
         buttons_layout.addWidget(connect_button)
         buttons_layout.addWidget(disconnect_button)
         buttons_layout.addWidget(update_mosketch_button)
+        buttons_layout.addWidget(record_button)
+        buttons_layout.addWidget(live_update_button)
 
         spacer = QtWidgets.QSpacerItem(10, 20)
 
@@ -264,19 +756,52 @@ class UI_MosketchWindow(QtWidgets.QDialog):
         self.status_text.setText("NOT CONNECTED")
         self.status_text.setStyleSheet("QLabel { background-color : red;color:white;font-weight: bold;}");
 
-        self.log_text = QtWidgets.QLabel(content)
-        self.log_text.setWordWrap(True)
-        self.log_text.setText("")
+        self.latency_text = QtWidgets.QLabel(content)
+        self.latency_text.setStyleSheet("QLabel { font-family: monospace; }")
+        dump_latencies_button = QtWidgets.QToolButton(content)
+        dump_latencies_button.setText("DUMP CSV")
+        dump_latencies_button.setAutoRaise(True)
+        dump_latencies_button.clicked.connect(self.dump_latencies)
+        status_layout = QtWidgets.QHBoxLayout()
+        status_layout.addWidget(self.status_text)
+        status_layout.addWidget(self.latency_text)
+        status_layout.addWidget(dump_latencies_button)
+
+        self.log_text = QtWidgets.QPlainTextEdit(content)
+        self.log_text.setReadOnly(True)
+        self.log_text.setMaximumBlockCount(LOG_PANEL_LINES)
+
+        self.log_timer = QtCore.QTimer(self)
+        self.log_timer.timeout.connect(_flush_log)
+        self.log_timer.start(LOG_REFRESH_MS)
+
+        # Latencies are refreshed by a timer, never from the stream processing
+        self.latency_timer = QtCore.QTimer(self)
+        self.latency_timer.timeout.connect(self.refresh_latencies)
+        self.latency_timer.start(500)
 
         content.setLayout(main_layout)
         main_layout.addWidget(help_text)
         main_layout.addLayout(ip_layout)
         main_layout.addLayout(streaming_mode_layout)
+        main_layout.addWidget(network_thread_checkbox)
+        main_layout.addWidget(shared_memory_checkbox)
         main_layout.addLayout(buttons_layout)
         main_layout.addSpacerItem(spacer)
-        main_layout.addWidget(self.status_text)
+        main_layout.addLayout(status_layout)
         main_layout.addWidget(self.log_text)
 
+    def refresh_latencies(self):
+        lines = ["%-8s %6s %6s %6s" % ("ms", "p50", "p95", "p99")]
+        for stage, percentiles in get_latency_stats().items():
+            lines.append("%-8s %6.2f %6.2f %6.2f" % ((stage,) + percentiles))
+        self.latency_text.setText("\n".join(lines))
+
+    def dump_latencies(self):
+        path = QtCompat.QFileDialog.getSaveFileName(self, "Dump latencies", "mosketch_latencies.csv", "CSV (*.csv)")[0]
+        if path:
+            dump_latencies(path)
+
     def closeEvent(self, event):
         # Close connection if any is still opened
         if CONNECTION is not None:
@@ -310,7 +835,7 @@ def _get_maya_main_window():
     if ptr is None:
         raise RuntimeError('No Maya window found.')
 
-    window = wrapInstance(long(ptr), QtWidgets.QMainWindow)
+    window = wrapInstance(int(ptr), QtWidgets.QMainWindow) # int() is a long in Python 2 when needed
     assert isinstance(window, QtWidgets.QMainWindow)
     return window
 
@@ -325,6 +850,30 @@ def _streaming_mode_current_text_changed(text):
     STREAMING_MODE = text
 
 
+def _network_thread_mode_toggled(checked):
+    global NETWORK_THREAD_MODE
+    NETWORK_THREAD_MODE = checked
+
+
+def _shared_memory_mode_toggled(checked):
+    global SHARED_MEMORY_MODE
+    SHARED_MEMORY_MODE = checked
+
+
+def _live_update_toggled(checked):
+    if checked:
+        start_live_update()
+    else:
+        stop_live_update()
+
+
+def _record_toggled(checked):
+    if checked:
+        start_recording()
+    else:
+        stop_recording()
+
+
 ################################################################################
 ##########          CONNECTION
 ################################################################################
@@ -335,6 +884,77 @@ def _get_connection_name():
     return IP + ":" + str(PORT)
 
 
+def _reset_stream_stats():
+    for key in STREAM_STATS:
+        STREAM_STATS[key] = 0
+
+
+def _reset_session():
+    """
+    New protocol state and statistics, for a new connection.
+    """
+    global PROTOCOL
+
+    PROTOCOL = MosketchProtocol()
+    _stop_scheduler()
+    _close_shared_memory()
+    _reset_stream_stats()
+    _reset_latencies()
+
+
+class _BlockingConnection(object):
+    """
+    Blocking socket, for run_headless() where the QTcpSocket has no event loop to run in and for the NetworkThread.
+    Raises socket errors if it cannot connect. For sending it behaves like the QTcpSocket
+    (write/flush/close/errorString), write() may be called from any thread.
+    """
+    def __init__(self, ip, port):
+        self._socket = socket.create_connection((ip, port), 5.0)
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._send_lock = threading.Lock()
+        self._error = ""
+
+    def read(self, timeout=0.5):
+        """
+        Returns the received bytes, b"" once Mosketch disconnected or on error (see errorString()), None if nothing
+        came within timeout seconds (so that the caller regularly checks whether it has to stop).
+        """
+        try:
+            if not select.select([self._socket], [], [], timeout)[0]:
+                return None
+            return self._socket.recv(65536)
+        except Exception as e:
+            self._error = str(e)
+            return b""
+
+    def write(self, data):
+        if not isinstance(data, bytes):
+            data = data.encode("utf-8")
+        try:
+            with self._send_lock:
+                self._socket.sendall(data)
+        except Exception as e:
+            self._error = str(e) # Reading fails next
+
+    def flush(self):
+        pass # write() is synchronous
+
+    def shutdown(self):
+        """
+        Wake up a read() waiting in another thread.
+        """
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except Exception:
+            pass # Already closed by the peer
+
+    def close(self):
+        self._socket.close()
+
+    def errorString(self):
+        return self._error
+
+
 def _open_connection():
     global CONNECTION
     global IP
@@ -353,74 +973,75 @@ def _open_connection():
         _print_success('Connecting to ' + IP)
 
     # Try to connect
+    _reset_session()
+
+    if NETWORK_THREAD_MODE is True:
+        _start_network_thread()
+        return
+
     CONNECTION = QtNetwork.QTcpSocket(MAIN_WINDOW)
     CONNECTION.readyRead.connect(_got_data)
     CONNECTION.error.connect(_got_error)
     CONNECTION.connected.connect(_connected)
     CONNECTION.disconnected.connect(_disconnected)
 
-    MAIN_WINDOW.status_text.setText("CONNECTING...")
-    MAIN_WINDOW.status_text.setStyleSheet("QLabel { background-color : orange;;color:white;font-weight: bold;}")
+    _set_status("CONNECTING...", "orange")
 
-    print "Trying to connect to " + _get_connection_name()
+    print("Trying to connect to " + _get_connection_name())
     CONNECTION.connectToHost(IP, PORT)
 
 
 def _close_connection():
     global CONNECTION
-    global SOCKET_DATA_BUFFER
-    global JOINTS_BUFFER
-    global JOINTS_INIT_ORIENT_INV_BUFFER
-    global JOINTS_ROTATE_AXIS_INV_BUFFER
-    global CONTROLLERS_BUFFER
-    global CONTROLLERS_INIT_ORIENT_INV_BUFFER
-    global CONTROLLERS_ROTATE_AXIS_INV_BUFFER
+    global JOINTS_BINDINGS
+    global CONTROLLERS_BINDINGS
 
     if CONNECTION is None:
         _print_error("connection is already closed.")
         return
 
-    SOCKET_DATA_BUFFER = ""
+    _flush_outbound()
     CONNECTION.flush()
     CONNECTION.close()
     CONNECTION = None
+    PROTOCOL.decoder.reset()
+    _stop_network_thread()
+    _stop_scheduler()
+    _close_shared_memory()
 
-    JOINTS_BUFFER = {}
-    JOINTS_INIT_ORIENT_INV_BUFFER = {}
-    JOINTS_ROTATE_AXIS_INV_BUFFER = {}
-
-    CONTROLLERS_BUFFER = {}
-    CONTROLLERS_INIT_ORIENT_INV_BUFFER = {}
-    CONTROLLERS_ROTATE_AXIS_INV_BUFFER = {}
+    JOINTS_BINDINGS = None
+    CONTROLLERS_BINDINGS = None
 
 
 def _connected():
     _print_success("connection opened on " + _get_connection_name())
-    MAIN_WINDOW.status_text.setText("CONNECTED")
-    MAIN_WINDOW.status_text.setStyleSheet("QLabel { background-color : green;color:white;font-weight: bold;}")
+    _set_status("CONNECTED", "green")
+    if isinstance(CONNECTION, QtNetwork.QTcpSocket):
+        # Do not let Nagle's algorithm hold small acks back (the other connections set TCP_NODELAY themselves)
+        CONNECTION.setSocketOption(QtNetwork.QAbstractSocket.LowDelayOption, 1)
 
 def _disconnected():
     global CONNECTION
-    global SOCKET_DATA_BUFFER
 
     _print_success("connection closed on " + _get_connection_name())
-    MAIN_WINDOW.status_text.setText("NOT CONNECTED")
-    MAIN_WINDOW.status_text.setStyleSheet("QLabel { background-color : red;color:white;font-weight: bold;}")
+    _set_status("NOT CONNECTED", "red")
 
 
 # FIXME: should we put that in _close_connection instead???
     if CONNECTION is not None:
-        SOCKET_DATA_BUFFER = ""
         CONNECTION.flush()
         CONNECTION.close() # Just in case
         CONNECTION = None
+        PROTOCOL.decoder.reset()
+    _stop_network_thread()
+    _stop_scheduler()
+    _close_shared_memory()
 
 
 def _got_error(socket_error):
     global CONNECTION
 
-    MAIN_WINDOW.status_text.setText("NOT CONNECTED")
-    MAIN_WINDOW.status_text.setStyleSheet("QLabel { background-color : red;color:white;font-weight: bold;}");
+    _set_status("NOT CONNECTED", "red")
 
     try:
         err_msg = CONNECTION.errorString()
@@ -429,340 +1050,1623 @@ def _got_error(socket_error):
         _print_error("connection is not opened yet.")
 
     CONNECTION = None
+    _stop_network_thread()
+    _stop_scheduler()
+    _close_shared_memory()
 
 
 ################################################################################
-##########          RECEIVE
+##########          LATENCY
 ################################################################################
-def _got_data():
+try:
+    _clock = time.perf_counter
+except AttributeError: # Python 2: the most precise clock of the platform
+    _clock = timeit.default_timer
+
+
+class LatencyRing(object):
     """
-    A packet is ready to read in the socket.
-    Read it and process it.
+    Last size durations (in seconds) of a pipeline stage, in a preallocated array.
     """
-    global SOCKET_DATA_BUFFER
-    try:
-        raw_data = CONNECTION.readLine()
-        
-        if raw_data.isEmpty() is True:
-            _print_verbose("Raw data from CONNECTION is empty", 1)
-            return
-        SOCKET_DATA_BUFFER += raw_data
-        json_data = str(SOCKET_DATA_BUFFER)
-        _process_data(json_data)
+    def __init__(self, size):
+        self._samples = array.array(str("d"), [0.0]) * size
+        self._next = 0
+        self.count = 0
+
+    def add(self, seconds):
+        self._samples[self._next] = seconds
+        self._next = (self._next + 1) % len(self._samples)
+        if self.count < len(self._samples):
+            self.count += 1
+
+    def samples(self):
+        """
+        Samples from the oldest to the newest
+        """
+        if self.count < len(self._samples):
+            return self._samples[:self.count].tolist()
+        return (self._samples[self._next:] + self._samples[:self._next]).tolist()
+
+    def percentiles(self, ratios):
+        """
+        Percentiles in milliseconds, 0.0 without samples
+        """
+        samples = sorted(self.samples())
+        if not samples:
+            return tuple(0.0 for ratio in ratios)
+        return tuple(samples[min(len(samples) - 1, int(ratio * len(samples)))] * 1000.0 for ratio in ratios)
+
+
+def _reset_latencies():
+    global STAGE_LATENCIES
+    STAGE_LATENCIES = OrderedDict((stage, LatencyRing(LATENCY_SAMPLES)) for stage in LATENCY_STAGES)
+
+
+def _record_latency(stage, start):
+    """
+    Record the time elapsed since start (a _clock() value) for stage.
+    """
+    if LATENCY_STATS:
+        STAGE_LATENCIES[stage].add(_clock() - start)
 
-        # Processing went fine, clear socket buffer
-        SOCKET_DATA_BUFFER = ""
 
-    except Exception as e:
-        pass
-        # Packet is just split. Ignore and go on
-        #_print_error("cannot read received data (" + type(e).__name__ + ": " + str(e) +")")
+_reset_latencies()
 
-def _process_data(arg):
+
+################################################################################
+##########          JSON CODEC
+################################################################################
+def _load_json_backend(name):
     """
-    We received a Json object. It may be:
-        - a JointsStream
-        - a Hierarchy
-        - a JointsUuids
+    Returns (loads, dumps) functions of the given Json library. Raises ImportError if it is not available.
     """
-    size = str(sys.getsizeof(arg))
-    _print_verbose("Paquet size:" + size, 2)
-    _print_verbose(arg, 2)
-    
-    try:
-        data = json.loads(arg)
-
-        if data[JSON_KEY_TYPE] == "Hierarchy":
-            # Always map joints as we need them when sending values back to Mosketch
-            _process_hierarchy(data)
-
-            if STREAMING_MODE == "Controllers":
-                _process_hierarchy_HIK(data)
-                # Controllers are zeroed at the beginning => discard initial rotation in bind pose
-                _send_command_orientMode(0) #discard
-                # We cannot tell for sure what is the initial orientation of the controllers
-                # So we ask Mosketch to send delta rotation wrt to parent, expressed in world.
-                # Then we do the maths to compute orientation in correct Maya's controllers frame
-                _send_command_jointSpace("ParentInWorld")
-            else: # set streaming parameters for joints
-                # Send orientation mode
-                _send_command_orientMode(1)
-                # Specify in which space we want to work. Default is in Parent space
-                _send_command_jointSpace("Parent")
-
-            # We are done, send acknowledgement
-            _send_hierarchy_initialized_ack()
-
-        elif data[JSON_KEY_TYPE] == "JointsStream":
-            if (STREAMING_MODE ==  "Controllers"):
-                _process_joints_stream_HIK(data)
-            else:
-                _process_joints_stream(data)
+    if name == "orjson":
+        import orjson
+        return orjson.loads, orjson.dumps
+    if name == "ujson":
+        import ujson
+        return ujson.loads, ujson.dumps
+    if name == "simplejson":
+        import simplejson
+        # Pure Python simplejson is way slower than the standard library
+        from simplejson import _speedups
+        return simplejson.loads, simplejson.dumps
+    if name == "json":
+        return json.loads, json.dumps
+    raise ImportError("unknown Json backend " + name)
+
+
+_json_loads = None
+_json_dumps = None
+set_json_backend()
 
-            _send_ack_jointstream_received()
 
-        elif data[JSON_KEY_TYPE] == "JointsUuids":
-            _process_joints_uuids(data)
-            _send_joint_uuids_received_ack()
-        else:
-            _print_error("Unknown data type received: " + data[JSON_KEY_TYPE])
-    except ValueError:
-        _print_verbose("Received a non-Json object." + sys.exc_info()[0] + sys.exc_info()[1], 1)
-        return
-    except Exception as e:
-        _print_error("cannot process data (" + type(e).__name__ + ": " + str(e) +")")
+################################################################################
+##########          STREAM DECODER
+################################################################################
+# Bytes which may open, close or escape something in a Json document
+_JSON_TOKENS = re.compile(b'["\\\\{}\\[\\]]')
+_BYTE_QUOTE = ord(b'"')
+_BYTE_BACKSLASH = ord(b'\\')
+_BYTES_OPEN = (ord(b'{'), ord(b'['))
+_BYTES_CLOSE = (ord(b'}'), ord(b']'))
+# Beginning of a Json document or of a binary JointsStream
+_FRAME_START = re.compile(b'[{\\[]|' + re.escape(BINARY_STREAM_MAGIC))
+# Binary JointsStream: header then float32 rotations (x, y, z, w), float32 translations (x, y, z)
+# and uint8 anatomic types, ordered as joints in the JointsUuids packet.
+_BINARY_HEADER = struct.Struct(str("<4sHHI")) # magic, version, joints count, sequence
+_BINARY_BYTES_PER_JOINT = 4 * 4 + 3 * 4 + 1
+_FLOAT32 = numpy.dtype(str("<f4")) if numpy is not None else None
+# Cheap lookup of the packet type without decoding the whole document
+_JSON_TYPE_PEEK = re.compile(b'"' + JSON_KEY_TYPE.encode("ascii") + b'"\\s*:\\s*"([^"]*)"')
+
+
+def _binary_frame_size(buf, start):
+    """
+    Returns the size of the binary frame starting at start in buf, None if its header is incomplete.
+    """
+    if len(buf) - start < _BINARY_HEADER.size:
+        return None
+    magic, version, joints_count, sequence = _BINARY_HEADER.unpack_from(buf, start)
+    return _BINARY_HEADER.size + joints_count * _BINARY_BYTES_PER_JOINT
 
 
-def _process_hierarchy_HIK(data):
-    '''
-    We suppose that joints name in Mosketch and Maya are the same name.
-    Find the associated controllers.
-    NOTE: data is not used for the moment
-    '''
-    global CONTROLLERS_BUFFER
-    global CONTROLLERS_TO_JOINTS_NAME
-    global CONTROLLERS_ROTATE_AXIS_INV_BUFFER
-    global CONTROLLERS_INIT_ORIENT_INV_BUFFER
+def _binary_magic_prefix_size(buf):
+    """
+    Returns how many bytes at the end of buf match the beginning of BINARY_STREAM_MAGIC.
+    """
+    for prefix_size in range(len(BINARY_STREAM_MAGIC) - 1, 0, -1):
+        if buf[-prefix_size:] == BINARY_STREAM_MAGIC[:prefix_size]:
+            return prefix_size
+    return 0
 
-    try:
-        # Retrieve HIKCharacterNodes in the scene: it gives HIK => joints mapping
-        hik_characters = pmc.ls(type="HIKCharacterNode")
-        if len(hik_characters) != 1:
-            _print_verbose("We should exactly ONE HIKCharacterNode in the scene", 1)
-
-        # Retrieve HIKControlSetNodes in the scene: it gives HIK => FK Controllers mapping
-        hik_control_sets = pmc.ls(type="HIKControlSetNode")
-        if len(hik_control_sets) != 1:
-            _print_verbose("We should exactly ONE HIKControlSetNode in the scene", 1)
-
-        hik_character = hik_characters[0]
-        hik_control_set = hik_control_sets[0]
-        hik_character_attributes = hik_character.listAttr()
-
-        for self_att in hik_character_attributes:
-            # Get inbound (connected) attribute first
-            inbound_att = self_att.get(silent=True)
-            # Then check type
-            if type(inbound_att) == pmc.nodetypes.Joint:
-                joint_name = inbound_att.name() # Name of the joint
-                self_att_name = self_att.attrName()
-                # getattr() is a Python function that returns the object attribute based on its (string) name.
-                # Not to be confused with Maya's attributes
-                fk_controller = getattr(hik_control_set, self_att_name).get()
-
-                _map_controller(joint_name, fk_controller)
-        
-        # Print nb joints in Maya and nb joints in BUFFER for information purposes
-        _print_success("Buffers size: " + str(len(CONTROLLERS_BUFFER)) + " / " + str(len(CONTROLLERS_ROTATE_AXIS_INV_BUFFER)) + " / " + str(len(CONTROLLERS_INIT_ORIENT_INV_BUFFER)))
-        _print_verbose('Joints buffer = ' + str(len(CONTROLLERS_BUFFER)) + ', controllers buffer = ' + str(len(CONTROLLERS_BUFFER)), 1)
-    except Exception as e:
-        _print_error("cannot process hierarchy data (" + type(e).__name__ + ": " + str(e) +")")
 
+class BinaryJointsStream(object):
+    """
+    Decoded binary JointsStream: flat rotations and translations ordered as names, the joints of the last JointsUuids.
+    The frame starts at offset in buffer. With views, rotations and translations are float32 NumPy arrays sharing
+    the memory of buffer instead of copies (see SharedPoseBuffer).
+    """
+    __slots__ = ("sequence", "names", "rotations", "translations", "anatomic_types")
+
+    def __init__(self, buffer, names, offset=0, views=False):
+        magic, version, joints_count, self.sequence = _BINARY_HEADER.unpack_from(buffer, offset)
+        if version != BINARY_STREAM_VERSION:
+            raise ValueError("unsupported binary JointsStream version " + str(version))
+        if joints_count != len(names):
+            raise ValueError("binary JointsStream has " + str(joints_count) + " joints, expected " + str(len(names)))
+        self.names = names
+        offset += _BINARY_HEADER.size
+        if views:
+            self.rotations = numpy.frombuffer(buffer, _FLOAT32, 4 * joints_count, offset)
+            self.translations = numpy.frombuffer(buffer, _FLOAT32, 3 * joints_count, offset + 16 * joints_count)
+        else:
+            self.rotations = struct.unpack_from(str("<%df") % (4 * joints_count), buffer, offset)
+            self.translations = struct.unpack_from(str("<%df") % (3 * joints_count), buffer, offset + 16 * joints_count)
+        offset += 28 * joints_count
+        self.anatomic_types = struct.unpack_from(str("<%dB") % joints_count, buffer, offset)
 
-def _map_controller(mosketch_name, maya_controller):
-    global CONTROLLERS_BUFFER
-    global CONTROLLERS_TO_JOINTS_NAME
-    global CONTROLLERS_ROTATE_AXIS_INV_BUFFER
-    global CONTROLLERS_INIT_ORIENT_INV_BUFFER
 
-    CONTROLLERS_BUFFER[mosketch_name] = maya_controller
-    CONTROLLERS_TO_JOINTS_NAME[maya_controller] = mosketch_name
+class FrameDecoder(object):
+    """
+    Split the socket byte stream into complete Json documents and binary JointsStreams.
+    Only newly received bytes are scanned for frame boundaries. An incomplete frame
+    stays in the buffer until the next read completes it.
+    """
+    def __init__(self):
+        self._buffer = bytearray()
+        self.frames_decoded = 0
+        self.partial_reads = 0
+        self.bytes_buffered = 0
+        self.reset()
+
+    def reset(self):
+        del self._buffer[:]
+        self._scan_pos = 0 # Where to resume scanning
+        self._skip_until = 0 # Position following an escaped character
+        self._frame_start = 0
+        self._depth = 0
+        self._in_string = False
+        self.bytes_buffered = 0
+
+    def feed(self, data):
+        """
+        Append received bytes and return the list of complete frames now available (as bytes):
+        Json documents or binary JointsStreams.
+        """
+        buf = self._buffer
+        buf.extend(data)
+        size = len(buf)
+        frames = []
+        depth = self._depth
+        in_string = self._in_string
+        frame_start = self._frame_start
+        skip_until = self._skip_until
+        pos = self._scan_pos
+
+        while pos < size:
+            if depth == 0:
+                # Between frames: look for the next Json document or binary frame
+                match = _FRAME_START.search(buf, pos)
+                if match is None:
+                    # Only keep what may be the beginning of a binary header
+                    pos = frame_start = max(size - _binary_magic_prefix_size(buf), pos)
+                    break
+                frame_start = match.start()
+                if buf[frame_start] in _BYTES_OPEN:
+                    depth = 1
+                    pos = frame_start + 1
+                    continue
+                frame_size = _binary_frame_size(buf, frame_start)
+                if frame_size is None or frame_start + frame_size > size:
+                    pos = frame_start # Wait for the rest of the binary frame
+                    break
+                pos = frame_start + frame_size
+                frames.append(bytes(buf[frame_start:pos]))
+                continue
 
-    vRO = maya_controller.getRotateAxis()
-    RO = pmc.datatypes.EulerRotation(vRO[0], vRO[1], vRO[2]).asQuaternion()
-    CONTROLLERS_ROTATE_AXIS_INV_BUFFER[mosketch_name] = RO.inverse()
+            for match in _JSON_TOKENS.finditer(buf, pos):
+                token_pos = match.start()
+                if token_pos < skip_until:
+                    continue
+                byte = buf[token_pos]
+                if in_string:
+                    if byte == _BYTE_BACKSLASH:
+                        skip_until = token_pos + 2
+                    elif byte == _BYTE_QUOTE:
+                        in_string = False
+                elif byte == _BYTE_QUOTE:
+                    in_string = True
+                elif byte in _BYTES_OPEN:
+                    depth += 1
+                elif byte in _BYTES_CLOSE:
+                    depth -= 1
+                    if depth == 0:
+                        pos = token_pos + 1
+                        frames.append(bytes(buf[frame_start:pos]))
+                        break
+            else:
+                # Document is split, wait for next read
+                pos = max(size, skip_until)
+                break
+
+        # Drop everything before the pending frame (or everything if there is none)
+        consumed = frame_start if depth > 0 else min(pos, size)
+        if consumed:
+            del buf[:consumed]
+            pos -= consumed
+            frame_start -= consumed
+            skip_until = max(skip_until - consumed, 0)
+
+        self._depth = depth
+        self._in_string = in_string
+        self._frame_start = frame_start
+        self._skip_until = skip_until
+        self._scan_pos = pos
+
+        self.frames_decoded += len(frames)
+        self.bytes_buffered = len(buf)
+        if buf:
+            self.partial_reads += 1
+        return frames
 
-    JO = maya_controller.getOrientation()
-    CONTROLLERS_INIT_ORIENT_INV_BUFFER[mosketch_name] = JO.inverse()
 
+################################################################################
+##########          PROTOCOL
+################################################################################
+class MosketchProtocol(object):
+    """
+    The Mosketch streaming protocol without any I/O, so that Qt, a plain socket, the network thread or
+    a replay drive it the same way:
+        events = protocol.receive_data(data) # Bytes read from Mosketch
+        # Act on the events, see below
+        data = protocol.data_to_send()       # Bytes to write to Mosketch, None if there are none
+    Events are (name, payload) tuples:
+        ("hierarchy", packet)       map the joints, then call hierarchy_mapped()
+        ("joints_uuids", packet)    store the uuids, then call joints_uuids_stored()
+        ("joints_stream", stream)   Json packet or BinaryJointsStream, call joints_stream_applied() once applied
+        ("dropped", count)          stale JointsStreams that were skipped (and acknowledged)
+        ("ack_mode", windowed)      Mosketch's answer to setStreamingAckMode
+        ("transport", shared)       Mosketch's answer to setStreamingTransport: JointsStreams go to the shared memory
+        ("invalid", message)        not a Json document
+        ("error", message)          packet that cannot be processed
+    The handshake goes through the STATE_* states in order. A Hierarchy starts it again from any state,
+    JointsStreams are delivered in any state (a replay may start in the middle of a stream).
+    """
+    STATE_WAITING_HIERARCHY = "waiting_hierarchy"
+    STATE_MAPPING_HIERARCHY = "mapping_hierarchy"
+    STATE_WAITING_JOINTS_UUIDS = "waiting_joints_uuids"
+    STATE_STORING_JOINTS_UUIDS = "storing_joints_uuids"
+    STATE_STREAMING = "streaming"
+
+    def __init__(self, binary=None, windowed_acks=None, coalesce=None):
+        self.binary = BINARY_JOINTS_STREAM if binary is None else binary
+        self.windowed_acks = WINDOWED_ACKS if windowed_acks is None else windowed_acks
+        self.coalesce = COALESCE_JOINTS_STREAM if coalesce is None else coalesce
+        self.decoder = FrameDecoder()
+        self.flow_control = FlowControl()
+        self.outbound = OutboundQueue()
+        self.state = self.STATE_WAITING_HIERARCHY
+        self.joints_uuids_order = []
+        self._send_lock = threading.Lock() # The network thread and the main thread both send
+
+    def receive_data(self, data):
+        """
+        Returns the events of the bytes received from Mosketch.
+        """
+        return self.receive_frames(self.decoder.feed(data))
+
+    def receive_frames(self, frames):
+        """
+        Returns the events of complete frames, as split by FrameDecoder (or read from a capture).
+        """
+        events = []
+        if self.coalesce:
+            frames = self._coalesce_joints_streams(frames, events)
+        for frame in frames:
+            self._receive_frame(frame, events)
+        return events
+
+    def hierarchy_mapped(self, streaming_mode):
+        """
+        Set the streaming parameters for streaming_mode and acknowledge the Hierarchy.
+        """
+        if streaming_mode == "Controllers":
+            # Controllers are zeroed at the beginning => discard initial rotation in bind pose
+            self._send_command("setStreamingJointOrientMode", {"jointOrientMode": "0"})
+            # We cannot tell for sure what is the initial orientation of the controllers
+            # So we ask Mosketch to send delta rotation wrt to parent, expressed in world.
+            # Then we do the maths to compute orientation in correct Maya's controllers frame
+            self._send_command("setStreamingJointSpace", {"jointSpace": "ParentInWorld"})
+        else:
+            self._send_command("setStreamingJointOrientMode", {"jointOrientMode": "1"})
+            # Specify in which space we want to work. Default is in Parent space
+            self._send_command("setStreamingJointSpace", {"jointSpace": "Parent"})
+        self._send_packet([{JSON_KEY_TYPE: "HierarchyInitializedAck"}])
+        self.state = self.STATE_WAITING_JOINTS_UUIDS
+
+    def joints_uuids_stored(self, shared_memory=None):
+        """
+        Negotiate the streaming format, acknowledgements and transport, then let Mosketch stream.
+        With shared_memory (a SharedPoseBuffer), Mosketch is asked to write the JointsStreams into it
+        rather than sending them: they are then neither sent nor acknowledged over the socket.
+        """
+        if self.binary:
+            # Before the acknowledgement so that the very first JointsStream is already binary
+            self._send_command("setStreamingFormat", {"format": "binary", "version": str(BINARY_STREAM_VERSION)})
+        if self.windowed_acks:
+            self._send_command("setStreamingAckMode", {"mode": "windowed", "window": str(ACK_WINDOW_MAX)})
+        if shared_memory is not None:
+            self._send_command("setStreamingTransport", {"transport": "sharedMemory", "path": shared_memory.path,
+                                                         "version": str(SHARED_MEMORY_VERSION), "slots": str(shared_memory.slots)})
+        self._send_packet([{JSON_KEY_TYPE: "JointsUuidsAck"}])
+        self.state = self.STATE_STREAMING
+
+    def joints_stream_applied(self, joints_stream, apply_time=None):
+        """
+        Acknowledge a JointsStream, right away or with the next windowed ack (see FlowControl).
+        apply_time (seconds) lets the window follow how long frames take to apply.
+        """
+        sequence = _get_joints_stream_sequence(joints_stream)
+        if self.flow_control.enabled and sequence is not None:
+            # The network thread applies frames while the main thread may be building the ack (see data_to_send())
+            with self._send_lock:
+                self.flow_control.frame_applied(sequence, apply_time)
+        else:
+            self._send_packet({JSON_KEY_TYPE: "JointsStreamAck"})
+
+    def send_joints_stream(self, joints_stream):
+        """
+        Queue a JointsStream from Maya, only the newest one is kept until data_to_send().
+        """
+        data = _json_dumps(joints_stream)
+        with self._send_lock:
+            self.outbound.put(data, pose=True)
+
+    def data_to_send(self):
+        """
+        Returns everything queued since the last call as one buffer, None if nothing is.
+        """
+        with self._send_lock:
+            if self.flow_control.ack_pending:
+                self.outbound.put(_json_dumps(self.flow_control.ack_packet()))
+            return self.outbound.take()
+
+    def _send_packet(self, packet):
+        data = _json_dumps(packet)
+        with self._send_lock:
+            self.outbound.put(data)
+
+    def _send_command(self, command, parameters):
+        packet = {}
+        packet[JSON_KEY_TYPE] = PACKET_TYPE_COMMAND
+        packet[JSON_KEY_OBJECT] = 'scene'
+        packet[JSON_KEY_COMMAND] = command
+        packet[JSON_KEY_PARAMETERS] = parameters # we need parameters to be a json object
+        self._send_packet([packet]) # [] specific for commands that could be buffered
+        _print_verbose("%s sent", 1, command)
+
+    def _coalesce_joints_streams(self, frames, events):
+        """
+        Only keep the newest JointsStream of the given frames: older poses would never be seen anyway.
+        Other packets (Hierarchy, JointsUuids, commands) are kept in order.
+        Dropped JointsStreams are still acknowledged (by the ack of the newest one with windowed acks).
+        """
+        streams_indices = [index for index, frame in enumerate(frames) if _peek_packet_type(frame) == b"JointsStream"]
+        if len(streams_indices) < 2:
+            return frames
+
+        dropped_indices = set(streams_indices[:-1])
+        events.append(("dropped", len(dropped_indices)))
+        if not self.flow_control.enabled:
+            for index in dropped_indices:
+                self._send_packet({JSON_KEY_TYPE: "JointsStreamAck"})
+
+        return [frame for index, frame in enumerate(frames) if index not in dropped_indices]
+
+    def _receive_frame(self, frame, events):
+        if VERBOSE >= 2:
+            _print_verbose("Paquet size: %d", 2, len(frame))
+            _print_verbose("%r", 2, frame)
+
+        decode_start = _clock()
+        if frame.startswith(BINARY_STREAM_MAGIC):
+            try:
+                joints_stream = BinaryJointsStream(frame, self.joints_uuids_order)
+            except Exception as e:
+                # Malformed binary frame, not to be reported as a non-Json one
+                events.append(("error", "cannot decode binary JointsStream (" + type(e).__name__ + ": " + str(e) +")"))
+                return
+            _record_latency("decode", decode_start)
+            events.append(("joints_stream", joints_stream))
+            return
 
-def _process_hierarchy(hierarchy_data):
-    global JOINTS_BUFFER
-    global JOINTS_INIT_ORIENT_INV_BUFFER
-    global JOINTS_ROTATE_AXIS_INV_BUFFER
+        try:
+            packet = _json_loads(frame)
+            _record_latency("decode", decode_start)
+
+            packet_type = packet[JSON_KEY_TYPE]
+            if packet_type == "JointsStream":
+                events.append(("joints_stream", packet))
+            elif packet_type == "Hierarchy":
+                self.state = self.STATE_MAPPING_HIERARCHY
+                events.append(("hierarchy", packet))
+            elif packet_type == "JointsUuids":
+                self.joints_uuids_order = [name for joint_data in packet[JSON_KEY_JOINTS] for name in joint_data]
+                self.state = self.STATE_STORING_JOINTS_UUIDS
+                events.append(("joints_uuids", packet))
+            elif packet_type == "JointsStreamAckMode":
+                # Mosketch's answer to setStreamingAckMode
+                self.flow_control.enabled = packet.get(JSON_KEY_MODE) == "windowed"
+                events.append(("ack_mode", self.flow_control.enabled))
+            elif packet_type == "JointsStreamTransport":
+                # Mosketch's answer to setStreamingTransport
+                events.append(("transport", packet.get(JSON_KEY_TRANSPORT) == "sharedMemory"))
+            else:
+                events.append(("error", "Unknown data type received: " + packet_type))
+        except ValueError:
+            events.append(("invalid", "Received a non-Json object: " + str(sys.exc_info()[1])))
+        except Exception as e:
+            events.append(("error", "cannot process data (" + type(e).__name__ + ": " + str(e) +")"))
 
-    try:
-        JOINTS_BUFFER = {}
-        JOINTS_INIT_ORIENT_INV_BUFFER = {}
-        JOINTS_ROTATE_AXIS_INV_BUFFER = {}
 
-        # Retrieve all joints from Maya and Transforms (we may be streaming to controllers too)
-        all_maya_joints = pmc.ls(type="joint")
-        all_maya_transform = pmc.ls(type="transform")
+def _get_joints_stream_sequence(joints_stream_data):
+    """
+    Sequence number of a JointsStream, None if Mosketch did not send any.
+    """
+    if isinstance(joints_stream_data, BinaryJointsStream):
+        return joints_stream_data.sequence
+    return joints_stream_data.get(JSON_KEY_SEQUENCE)
 
-        # Then from all joints in the hierarchy, lookup in maya joints
-        joints_name = hierarchy_data[JSON_KEY_JOINTS]
 
-        for joint_name in joints_name:
-            # We store joints in any cases
-            maya_joints = [maya_joint for maya_joint in all_maya_joints if maya_joint.name() == joint_name]
-            if maya_joints:
-                # We should have one Maya joint mapped anyways
-                if len(maya_joints) != 1:
-                    _print_error("We should have 1 Maya joint mapped only. Taking the first one only.")
+class FlowControl(object):
+    """
+    Windowed acknowledgements, once Mosketch accepted them (see MosketchProtocol.joints_uuids_stored()).
+    Instead of one JointsStreamAck per frame, one ack per read carries the highest sequence applied and
+    the window: how many frames Mosketch may send past it without waiting. The window grows by one while
+    frames are applied within ACK_FRAME_BUDGET_MS and is halved when they are not.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.enabled = False
+        self.window = 1
+        self.highest_sequence = None
+        self.ack_pending = False
+        self.apply_time = 0.0 # Moving average, in seconds
+
+    def frame_applied(self, sequence, apply_time=None):
+        # Frames come in order: the newest one has the highest sequence, even if Mosketch restarted its count
+        self.highest_sequence = sequence
+        if apply_time is not None:
+            self.add_apply_time(apply_time)
+        self.ack_pending = True
+
+    def add_apply_time(self, apply_time):
+        self.apply_time = apply_time if self.apply_time == 0.0 else 0.8 * self.apply_time + 0.2 * apply_time
+
+    def ack_packet(self):
+        if self.apply_time * 1000.0 > ACK_FRAME_BUDGET_MS:
+            self.window = max(1, self.window // 2)
+        elif self.window < ACK_WINDOW_MAX:
+            self.window += 1
+        self.ack_pending = False
+        return {JSON_KEY_TYPE: "JointsStreamAck", JSON_KEY_SEQUENCE: self.highest_sequence, JSON_KEY_WINDOW: self.window}
+
+
+class OutboundQueue(object):
+    """
+    What is sent to Mosketch during one event loop turn, written at once by take() at its end.
+    Acknowledgements and commands keep their order and go first. Pose uploads go last and only the newest
+    one is kept, an older pose would be overwritten by Mosketch anyway.
+    Also counts the writes and bytes sent, and their rates over the last second.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.packets = []
+        self.pose = None
+        self.writes = 0
+        self.bytes_written = 0
+        self.writes_per_second = 0.0
+        self.bytes_per_second = 0.0
+        self._rate_start = _clock()
+        self._rate_writes = 0
+        self._rate_bytes = 0
+
+    def put(self, data, pose=False):
+        if not isinstance(data, bytes):
+            data = data.encode("utf-8")
+        if pose:
+            self.pose = data
+        else:
+            self.packets.append(data)
+
+    def take(self):
+        """
+        Returns everything queued as one buffer, None if nothing is.
+        """
+        if self.pose is not None:
+            self.packets.append(self.pose)
+            self.pose = None
+        if not self.packets:
+            return None
+        data = b"".join(self.packets)
+        del self.packets[:]
+
+        self.writes += 1
+        self.bytes_written += len(data)
+        self._rate_writes += 1
+        self._rate_bytes += len(data)
+        self.update_rates()
+        return data
+
+    def update_rates(self):
+        elapsed = _clock() - self._rate_start
+        if elapsed >= 1.0:
+            self.writes_per_second = self._rate_writes / elapsed
+            self.bytes_per_second = self._rate_bytes / elapsed
+            self._rate_start += elapsed
+            self._rate_writes = 0
+            self._rate_bytes = 0
+
+
+PROTOCOL = MosketchProtocol()
 
-                _map_joint(joint_name, maya_joints[0])
 
-        # If no mapping close connection
-        if (len(JOINTS_BUFFER) == 0):
-            _close_connection()
-            _print_error("Couldn't map joints. Check Maya's namespaces maybe.")
-            return
+################################################################################
+##########          JOINT BINDINGS
+################################################################################
+class JointBinding(object):
+    """
+    A Mosketch joint bound to a Maya joint (or controller).
+    Rotate axis and joint orient are kept along with their inverse so that they are computed once.
+    """
+    __slots__ = ("index", "name", "maya_node", "rotate_axis", "rotate_axis_inv", "joint_orient", "joint_orient_inv", "joint_type",
+                 "plugs", "rotate_order", "last_rotation", "last_translation")
+
+    def __init__(self, index, name, maya_node, rotate_axis, joint_orient):
+        self.index = index
+        self.name = name
+        self.maya_node = maya_node
+        self.rotate_axis = rotate_axis
+        self.rotate_axis_inv = rotate_axis.inverse()
+        self.joint_orient = joint_orient
+        self.joint_orient_inv = joint_orient.inverse()
+        self.joint_type = None # Anatomic type, known once the joint is streamed
+        self.plugs = None # OpenMaya rotate and translate plugs, see _cache_openmaya_handles()
+        self.rotate_order = None
+        self.last_rotation = None # Last values written in Maya, see _skip_unchanged_values()
+        self.last_translation = None
+
+
+class StreamResolution(object):
+    """
+    How the joints of a stream map onto the bindings: positions in the stream of the mapped
+    joints and their bindings. Computed once per joints order.
+    """
+    __slots__ = ("names", "positions", "bindings", "six_dofs", "six_dofs_indices", "_arrays")
+
+    def __init__(self, names, positions, bindings):
+        self.names = names
+        self.positions = positions
+        self.bindings = bindings
+        self.six_dofs = None # Whether each mapped joint has 6 DoFs, known once anatomic types are
+        self.six_dofs_indices = None # Indices in bindings of 6 DoFs joints
+        self._arrays = None
+
+    def set_joint_types(self, joint_types):
+        """
+        joint_types: anatomic type of each joint of the stream
+        """
+        for position, binding in zip(self.positions, self.bindings):
+            if binding.joint_type is None:
+                binding.joint_type = joint_types[position]
+        self.six_dofs_indices = [index for index, binding in enumerate(self.bindings) if binding.joint_type == 7]
+        self.six_dofs = [binding.joint_type == 7 for binding in self.bindings]
+
+    def numpy_arrays(self):
+        """
+        Returns (positions, binding indices, positions of 6 DoFs joints) as NumPy index arrays.
+        """
+        if self._arrays is None:
+            positions = numpy.array(self.positions, dtype=numpy.intp)
+            binding_indices = numpy.array([binding.index for binding in self.bindings], dtype=numpy.intp)
+            self._arrays = (positions, binding_indices, positions[numpy.array(self.six_dofs, dtype=bool)])
+        return self._arrays
+
+
+class BindingTable(object):
+    """
+    Bindings of one streaming target (joints or controllers), built for each Hierarchy.
+    Incoming joints are resolved to binding indices once, then addressed positionally
+    as long as Mosketch keeps streaming the same joints in the same order.
+    """
+    def __init__(self, rotate_translation):
+        self.bindings = []
+        self.indices_by_name = {}
+        # Translations are expressed in the rotate axis frame for joints, not for controllers
+        self.rotate_translation = rotate_translation
+        self._resolution = StreamResolution([], [], [])
+        self._inverse_tuples = None
+        self._inverse_arrays = None
+
+    def __len__(self):
+        return len(self.bindings)
+
+    def add(self, name, maya_node, rotate_axis, joint_orient):
+        index = len(self.bindings)
+        self.indices_by_name[name] = index
+        self.bindings.append(JointBinding(index, name, maya_node, rotate_axis, joint_orient))
+
+    def resolve(self, names):
+        """
+        Returns the StreamResolution of a stream made of the given joints names.
+        """
+        resolution = self._resolution
+        if names is resolution.names or names == resolution.names:
+            return resolution
+        positions = []
+        bindings = []
+        for position, name in enumerate(names):
+            index = self.indices_by_name.get(name)
+            if index is not None:
+                positions.append(position)
+                bindings.append(self.bindings[index])
+        resolution = StreamResolution(names, positions, bindings)
+        self._resolution = resolution # Single assignment: the network thread may resolve too
+        return resolution
+
+    def inverse_tuples(self):
+        """
+        Returns (inverse rotate axis, inverse joint orient) of all bindings as lists of (x, y, z, w) tuples.
+        """
+        if self._inverse_tuples is None:
+            self._inverse_tuples = ([_quat_as_tuple(binding.rotate_axis_inv) for binding in self.bindings],
+                                    [_quat_as_tuple(binding.joint_orient_inv) for binding in self.bindings])
+        return self._inverse_tuples
+
+    def inverse_arrays(self):
+        """
+        Same as inverse_tuples() as (N, 4) NumPy arrays.
+        """
+        if self._inverse_arrays is None:
+            rotate_axis_inv, joint_orient_inv = self.inverse_tuples()
+            self._inverse_arrays = (numpy.array(rotate_axis_inv, dtype=numpy.float64).reshape(-1, 4),
+                                    numpy.array(joint_orient_inv, dtype=numpy.float64).reshape(-1, 4))
+        return self._inverse_arrays
+
+
+def _resolve_joints_stream(binding_table, joints_stream_data):
+    """
+    Returns the StreamResolution of a Json or binary JointsStream, with anatomic types known.
+    """
+    if isinstance(joints_stream_data, BinaryJointsStream):
+        resolution = binding_table.resolve(joints_stream_data.names)
+        if resolution.six_dofs is None:
+            resolution.set_joint_types(joints_stream_data.anatomic_types)
+        return resolution
 
-        # Print nb joints in Maya and nb joints in BUFFER for information purposes
-        _print_success("mapped " + str(len(JOINTS_BUFFER)) + " maya joints out of " + str(len(all_maya_transform)))
-        _print_success("Buffers size: " + str(len(JOINTS_BUFFER)) + " / " + str(len(JOINTS_ROTATE_AXIS_INV_BUFFER)) + " / " + str(len(JOINTS_INIT_ORIENT_INV_BUFFER)))
-        _print_verbose('Joints buffer = ' + str(len(JOINTS_BUFFER)) + ', controllers buffer = ' + str(len(JOINTS_BUFFER)), 1)
+    joints_data = joints_stream_data[JSON_KEY_JOINTS]
+    resolution = binding_table.resolve([joint_data[JSON_KEY_NAME] for joint_data in joints_data])
+    if resolution.six_dofs is None:
+        resolution.set_joint_types([joint_data[JSON_KEY_ANATOMIC] for joint_data in joints_data])
+    return resolution
 
-    except Exception as e:
-        _print_error("cannot process hierarchy data (" + type(e).__name__ + ": " + str(e) +")")
-    
 
-def _map_joint(mosketch_name, maya_joint):
-    global JOINTS_BUFFER
-    global JOINTS_ROTATE_AXIS_INV_BUFFER
-    global JOINTS_INIT_ORIENT_INV_BUFFER
+def _iter_bound_joints(joints_stream_data, resolution):
+    """
+    Yields (binding, rotation, translation) for each mapped joint of a Json or binary JointsStream.
+    translation is None unless the joint has 6 DoFs.
+    """
+    mapped_joints = zip(resolution.positions, resolution.bindings, resolution.six_dofs)
+
+    if isinstance(joints_stream_data, BinaryJointsStream):
+        rotations = joints_stream_data.rotations
+        translations = joints_stream_data.translations
+        for position, binding, six_dofs in mapped_joints:
+            translation = None
+            if six_dofs:
+                translation = translations[3 * position:3 * position + 3]
+            yield (binding, rotations[4 * position:4 * position + 4], translation)
+        return
 
-    JOINTS_BUFFER[mosketch_name] = maya_joint
-    vRO = maya_joint.getRotateAxis()
-    RO = pmc.datatypes.EulerRotation(vRO[0], vRO[1], vRO[2]).asQuaternion()
-    JOINTS_ROTATE_AXIS_INV_BUFFER[mosketch_name] = RO.inverse()
-    try:
-        # We have a Joint => Get joint_orient into account
-        JO = maya_joint.getOrientation().inverse()
-        JOINTS_INIT_ORIENT_INV_BUFFER[mosketch_name] = JO
-    except Exception:
-        # We have a Transform => Do NOT get joint_orient into account but the initial transform instead
-        JO = maya_joint.getRotation(space='transform', quaternion=True).inverse()
-        JOINTS_INIT_ORIENT_INV_BUFFER[mosketch_name] = JO
+    joints_data = joints_stream_data[JSON_KEY_JOINTS]
+    for position, binding, six_dofs in mapped_joints:
+        joint_data = joints_data[position]
+        translation = None
+        if six_dofs:
+            translation = joint_data[JSON_KEY_TRANSLATION]
+        yield (binding, joint_data[JSON_KEY_ROTATION], translation)
 
 
-def _send_hierarchy_initialized_ack():
-    '''
-    We send an acknowlegment to let Mosketch know that hierarchy is correctly initialized on our side.
-    '''
-    if CONNECTION is None:
-        _print_error("Mosketch is not connected!")
-        return
+################################################################################
+##########          RETARGET
+################################################################################
+def _retarget_joints_stream(binding_table, joints_stream_data, backend):
+    """
+    We receive "full" local rotations and local translations.
+    So we need to substract rotate axis and joint orient, and convert translations of
+    6 DoFs joints to Maya's frame and units.
+    Returns a list of (binding, rotation, translation or None) computed with the given backend (see RETARGET_BACKENDS).
+    """
+    if binding_table is None:
+        return []
+    lookup_start = _clock()
+    resolution = _resolve_joints_stream(binding_table, joints_stream_data)
+    retarget_start = _clock()
+    if LATENCY_STATS:
+        STAGE_LATENCIES["lookup"].add(retarget_start - lookup_start)
+
+    if backend == "numpy" and numpy is not None and len(binding_table) >= NUMPY_MIN_JOINTS:
+        values = _retarget_numpy(binding_table, joints_stream_data, resolution)
+    elif backend == "pymel":
+        values = _retarget_pymel(binding_table, joints_stream_data, resolution)
+    else:
+        values = _retarget_python(binding_table, joints_stream_data, resolution)
+    _record_latency("retarget", retarget_start)
+    return values
+
+
+def _retarget_pymel(binding_table, joints_stream_data, resolution):
+    values = []
+    for binding, rotation, translation in _iter_bound_joints(joints_stream_data, resolution):
+        # W = [S] * [RO] * [R] * [JO] * [IS] * [T]
+        quat = pmc.datatypes.Quaternion(rotation)
+        quat = binding.rotate_axis_inv * quat * binding.joint_orient_inv
+
+        trans = None
+        if translation is not None: # This is a 6 DoFs joint so consider translation part too
+            trans = pmc.datatypes.Vector(translation)
+            if binding_table.rotate_translation:
+                trans = trans.rotateBy(binding.rotate_axis_inv)
+            # Mosketch uses meters. Maya uses centimeters
+            trans *= 100
+        values.append((binding, quat, trans))
+    return values
+
+
+def _retarget_python(binding_table, joints_stream_data, resolution):
+    rotate_axis_inv_values, joint_orient_inv_values = binding_table.inverse_tuples()
+    values = []
+    for binding, rotation, translation in _iter_bound_joints(joints_stream_data, resolution):
+        rotate_axis_inv = rotate_axis_inv_values[binding.index]
+
+        # W = [S] * [RO] * [R] * [JO] * [IS] * [T]
+        quat = _quat_mul(_quat_mul(rotate_axis_inv, rotation), joint_orient_inv_values[binding.index])
+
+        trans = None
+        if translation is not None: # This is a 6 DoFs joint so consider translation part too
+            trans = translation
+            if binding_table.rotate_translation:
+                trans = _quat_rotate_vector(trans, rotate_axis_inv)
+            # Mosketch uses meters. Maya uses centimeters
+            trans = (trans[0] * 100, trans[1] * 100, trans[2] * 100)
+        values.append((binding, quat, trans))
+    return values
+
+
+def _retarget_numpy(binding_table, joints_stream_data, resolution):
+    """
+    Same maths as _retarget_python on the whole frame at once.
+    """
+    positions, binding_indices, six_dofs_positions = resolution.numpy_arrays()
+
+    if isinstance(joints_stream_data, BinaryJointsStream):
+        rotations = numpy.asarray(joints_stream_data.rotations, dtype=numpy.float64).reshape(-1, 4)[positions]
+        translations = numpy.asarray(joints_stream_data.translations, dtype=numpy.float64).reshape(-1, 3)[six_dofs_positions]
+    else:
+        joints_data = joints_stream_data[JSON_KEY_JOINTS]
+        rotations = numpy.array([joints_data[position][JSON_KEY_ROTATION] for position in resolution.positions], dtype=numpy.float64).reshape(-1, 4)
+        translations = numpy.array([joints_data[position][JSON_KEY_TRANSLATION] for position in six_dofs_positions], dtype=numpy.float64).reshape(-1, 3)
+
+    rotate_axis_inv_values, joint_orient_inv_values = binding_table.inverse_arrays()
+    rotate_axis_inv = rotate_axis_inv_values[binding_indices]
+
+    # W = [S] * [RO] * [R] * [JO] * [IS] * [T]
+    quats = _quat_mul_arrays(_quat_mul_arrays(rotate_axis_inv, rotations), joint_orient_inv_values[binding_indices])
+    if binding_table.rotate_translation:
+        translations = _quat_rotate_vectors(translations, rotate_axis_inv[resolution.six_dofs_indices])
+    # Mosketch uses meters. Maya uses centimeters
+    translations = translations * 100
+
+    trans_values = [None] * len(resolution.bindings)
+    for index, trans in zip(resolution.six_dofs_indices, translations.tolist()):
+        trans_values[index] = trans
+    return list(zip(resolution.bindings, quats.tolist(), trans_values))
+
+
+def _quat_mul_arrays(a, b):
+    """
+    Same as _quat_mul on (N, 4) arrays of quaternions
+    """
+    ax, ay, az, aw = a[:, 0], a[:, 1], a[:, 2], a[:, 3]
+    bx, by, bz, bw = b[:, 0], b[:, 1], b[:, 2], b[:, 3]
+    result = numpy.empty(a.shape)
+    result[:, 0] = bw * ax + bx * aw + by * az - bz * ay
+    result[:, 1] = bw * ay - bx * az + by * aw + bz * ax
+    result[:, 2] = bw * az + bx * ay - by * ax + bz * aw
+    result[:, 3] = bw * aw - bx * ax - by * ay - bz * az
+    return result
+
+
+def _quat_rotate_vectors(vectors, quats):
+    """
+    Same as _quat_rotate_vector on (N, 3) vectors and (N, 4) quaternions
+    """
+    quats_xyz = quats[:, :3]
+    t = 2.0 * numpy.cross(quats_xyz, vectors)
+    return vectors + quats[:, 3:] * t + numpy.cross(quats_xyz, t)
+
+
+def _apply_retargeted_values(values):
+    """
+    Write (binding, rotation, translation or None) values computed by _retarget_joints_stream onto Maya nodes
+    with APPLY_BACKEND, APPLY_CHUNK_SIZE joints per chunk (a generator).
+    The chunks only prepare the writes (an MDGModifier with OpenMaya, pymel datatypes otherwise): the pose is
+    written at once after the last one, so Maya never evaluates a half-written pose.
+    """
+    global LIVE_UPDATE_APPLYING
+
+    write_start = _clock()
+    if RECORDING:
+        _record_values(values)
+    if SKIP_UNCHANGED_WRITES:
+        values = _skip_unchanged_values(values)
+    modifier = om2.MDGModifier() if APPLY_BACKEND == "openmaya" and om2 is not None else None
+    pymel_values = []
+    write_time = 0.0
+    for start in range(0, len(values), APPLY_CHUNK_SIZE):
+        if start > 0:
+            write_time += _clock() - write_start
+            yield
+            write_start = _clock()
+        chunk = values[start:start + APPLY_CHUNK_SIZE]
+        if modifier is not None:
+            _add_values_openmaya(modifier, chunk)
+        else:
+            pymel_values.extend(_to_pymel_values(chunk))
+
+    # What Mosketch streams must not be sent back to it by the live update
+    LIVE_UPDATE_APPLYING = True
     try:
-        ack_packet = {}
-        ack_packet[JSON_KEY_TYPE] = "HierarchyInitializedAck"
-        json_data = json.dumps([ack_packet])
-        CONNECTION.write(json_data)
-        CONNECTION.flush()
-        _print_verbose("HierarchyInitializedAck sent", 1)
+        if modifier is not None:
+            modifier.doIt()
+        else:
+            _apply_values_pymel(pymel_values)
+    finally:
+        LIVE_UPDATE_APPLYING = False
+    if SKIP_UNCHANGED_WRITES:
+        _remember_written_values(values)
+    if LATENCY_STATS:
+        STAGE_LATENCIES["write"].add(write_time + _clock() - write_start)
+
 
-    except Exception, e:
-        _print_error("cannot send HierarchyInitializedAck (" + str(e) + ")")
+def _skip_unchanged_values(values):
+    """
+    Replace by None the rotations and translations that are within ROTATION_WRITE_EPSILON/TRANSLATION_WRITE_EPSILON
+    of the last written ones. Joints with nothing left to write are removed.
+    The last written values are only updated once written (see _remember_written_values()).
+    """
+    # Angle between two quaternions is 2 * acos(|q1.q2| / (|q1| * |q2|)). Streamed ones are not exactly normalized
+    min_rotation_dot_2 = math.cos(ROTATION_WRITE_EPSILON * 0.5) ** 2
+    max_translation_distance_2 = TRANSLATION_WRITE_EPSILON * TRANSLATION_WRITE_EPSILON
+    changed_values = []
+    skipped = 0
+    for binding, quat, trans in values:
+        last_rotation = binding.last_rotation
+        x, y, z, w = quat[0], quat[1], quat[2], quat[3]
+        norm_2 = x * x + y * y + z * z + w * w
+        if last_rotation is not None:
+            last_x, last_y, last_z, last_w, last_norm_2 = last_rotation
+            dot = last_x * x + last_y * y + last_z * z + last_w * w
+            if dot * dot >= min_rotation_dot_2 * last_norm_2 * norm_2:
+                quat = None
+                skipped += 1
+
+        if trans is not None:
+            last_translation = binding.last_translation
+            if last_translation is not None and ((last_translation[0] - trans[0]) ** 2 + (last_translation[1] - trans[1]) ** 2
+                                                 + (last_translation[2] - trans[2]) ** 2) <= max_translation_distance_2:
+                trans = None
+                skipped += 1
+
+        if quat is not None or trans is not None:
+            changed_values.append((binding, quat, trans))
+
+    STREAM_STATS["writes_skipped"] += skipped
+    STREAM_STATS["writes_skipped_last_frame"] = skipped
+    return changed_values
+
+
+def _remember_written_values(values):
+    """
+    Store the values just written, for _skip_unchanged_values(). Not before: a joint whose write failed would
+    be taken as written and skipped until Mosketch moves it past the epsilons.
+    """
+    for binding, quat, trans in values:
+        if quat is not None:
+            x, y, z, w = quat[0], quat[1], quat[2], quat[3]
+            binding.last_rotation = (x, y, z, w, x * x + y * y + z * z + w * w)
+        if trans is not None:
+            binding.last_translation = (trans[0], trans[1], trans[2])
 
 
-def _send_joint_uuids_received_ack():
-    '''
-    We send an acknowlegment to let Mosketch know that from that joint uuids are stored and that it can send the JointsStream.
-    '''
-    if CONNECTION is None:
-        _print_error("Mosketch is not connected!")
+def _to_pymel_values(values):
+    """
+    Convert (binding, rotation, translation) values into pymel datatypes, ready for _apply_values_pymel()
+    """
+    pymel_values = []
+    for binding, quat, trans in values:
+        if quat is not None and not isinstance(quat, pmc.datatypes.Quaternion):
+            quat = pmc.datatypes.Quaternion(quat)
+        if trans is not None and not isinstance(trans, pmc.datatypes.Vector):
+            trans = pmc.datatypes.Vector(trans)
+        pymel_values.append((binding, quat, trans))
+    return pymel_values
+
+
+def _apply_values_pymel(values):
+    for binding, quat, trans in values:
+        maya_node = binding.maya_node
+        if quat is not None:
+            if not isinstance(quat, pmc.datatypes.Quaternion):
+                quat = pmc.datatypes.Quaternion(quat)
+            maya_node.setRotation(quat, space='transform')
+        if trans is not None:
+            if not isinstance(trans, pmc.datatypes.Vector):
+                trans = pmc.datatypes.Vector(trans)
+            maya_node.setTranslation(trans, space='transform')
+
+
+def _add_values_openmaya(modifier, values):
+    """
+    All plugs of the frame are set by a single MDGModifier so the DG is dirtied once per frame.
+    """
+    for binding, quat, trans in values:
+        if binding.plugs is None:
+            _cache_openmaya_handles([binding])
+        rotate_x, rotate_y, rotate_z, translate_x, translate_y, translate_z = binding.plugs
+
+        if quat is not None:
+            # Same as setRotation(quat, space='transform'): Euler angles in the node's rotate order
+            euler = om2.MQuaternion(quat[0], quat[1], quat[2], quat[3]).asEulerRotation().reorderIt(binding.rotate_order)
+            modifier.newPlugValueDouble(rotate_x, euler.x)
+            modifier.newPlugValueDouble(rotate_y, euler.y)
+            modifier.newPlugValueDouble(rotate_z, euler.z)
+        if trans is not None:
+            modifier.newPlugValueDouble(translate_x, trans[0])
+            modifier.newPlugValueDouble(translate_y, trans[1])
+            modifier.newPlugValueDouble(translate_z, trans[2])
+
+
+def _cache_openmaya_handles(bindings):
+    """
+    Find rotate/translate plugs and rotate order of the bindings' Maya nodes once.
+    """
+    for binding in bindings:
+        dag_path = om2.MGlobal.getSelectionListByName(binding.maya_node.longName()).getDagPath(0)
+        transform = om2.MFnTransform(dag_path)
+        binding.rotate_order = transform.findPlug("rotateOrder", False).asInt() # Same values as MEulerRotation orders
+        binding.plugs = tuple(transform.findPlug(attribute, False)
+                              for attribute in ("rotateX", "rotateY", "rotateZ", "translateX", "translateY", "translateZ"))
+
+
+def _cache_openmaya_handles_in_chunks(bindings):
+    """
+    _cache_openmaya_handles() on MAPPING_CHUNK_SIZE bindings per chunk (a generator), when APPLY_BACKEND uses them.
+    """
+    if APPLY_BACKEND != "openmaya" or om2 is None:
+        return
+    for start in range(0, len(bindings), MAPPING_CHUNK_SIZE):
+        yield
+        _cache_openmaya_handles(bindings[start:start + MAPPING_CHUNK_SIZE])
+
+
+################################################################################
+##########          SCHEDULER
+################################################################################
+class ScheduledTask(object):
+    """
+    An operation run by the TaskScheduler: a generator that yields after each chunk of work.
+    done(task) is called once it is over, with ticks and elapsed (seconds spent in its chunks) known.
+    """
+    __slots__ = ("operation", "steps", "payload", "done", "started", "ticks", "elapsed", "last_tick")
+
+    def __init__(self, operation, steps, payload, done):
+        self.operation = operation
+        self.steps = steps
+        self.payload = payload
+        self.done = done
+        self.started = False
+        self.ticks = 0
+        self.elapsed = 0.0
+        self.last_tick = None
+
+
+class TaskScheduler(object):
+    """
+    Cooperative scheduler on Maya's main thread. Tasks run one after the other, in the order they were
+    added so that protocol events keep their order. Each call of run() is a tick: chunks are run until
+    the budget is spent, then Maya's event loop gets to redraw and process the UI before the next tick.
+    """
+    def __init__(self):
+        self.tasks = deque()
+        self.stats = OrderedDict() # operation -> {"count", "ticks", "max_ticks", "ms"}
+        self._tick = 0
+        self._running = None
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def add(self, operation, steps, payload=None, done=None):
+        task = ScheduledTask(operation, steps, payload, done)
+        self.tasks.append(task)
+        return task
+
+    def drop_pending(self, operation):
+        """
+        Remove the tasks of operation that have not started yet, and return them.
+        """
+        if not self.tasks:
+            return []
+        dropped = [task for task in self.tasks if task.operation == operation and not task.started]
+        for task in dropped:
+            self.tasks.remove(task)
+            task.steps.close()
+        return dropped
+
+    def clear(self):
+        for task in self.tasks:
+            if task is not self._running: # A generator cannot be closed from inside
+                task.steps.close()
+        self.tasks.clear()
+
+    def run(self, budget_ms=None):
+        """
+        Run chunks for about budget_ms milliseconds (at least one), or everything with None.
+        Returns True if tasks are left for the next tick.
+        """
+        self._tick += 1
+        deadline = None if budget_ms is None else _clock() + budget_ms / 1000.0
+        while self.tasks:
+            task = self.tasks[0]
+            if task.last_tick != self._tick:
+                task.last_tick = self._tick
+                task.ticks += 1
+            task.started = True
+            self._running = task
+            step_start = _clock()
+            try:
+                next(task.steps)
+                finished = False
+            except StopIteration:
+                finished = True
+            except Exception as e:
+                _print_error("cannot run " + task.operation + " (" + type(e).__name__ + ": " + str(e) +")")
+                finished = True
+            finally:
+                self._running = None
+            step_end = _clock()
+            task.elapsed += step_end - step_start
+
+            if finished:
+                if self.tasks and self.tasks[0] is task: # Not cleared meanwhile (connection closed)
+                    self.tasks.popleft()
+                self._finish(task)
+            if deadline is not None and step_end >= deadline:
+                break
+        return len(self.tasks) > 0
+
+    def _finish(self, task):
+        stats = self.stats.get(task.operation)
+        if stats is None:
+            stats = self.stats[task.operation] = {"count": 0, "ticks": 0, "max_ticks": 0, "ms": 0.0}
+        stats["count"] += 1
+        stats["ticks"] = task.ticks
+        stats["max_ticks"] = max(stats["max_ticks"], task.ticks)
+        stats["ms"] = task.elapsed * 1000.0
+        if task.ticks > 1 and VERBOSE >= 2:
+            _print_verbose("%s spread over %d ticks (%.1f ms)", 2, task.operation, task.ticks, task.elapsed * 1000.0)
+        if task.done is not None:
+            task.done(task)
+
+
+SCHEDULER = TaskScheduler()
+
+
+def _run_scheduler():
+    """
+    Run the scheduled tasks for SCHEDULER_BUDGET_MS and, if some are left, again on the next turns of
+    Maya's event loop. Without a window there is no UI to keep responsive (and maybe no event loop to
+    come back): tasks are run to completion, unless the asyncio client runs the next ticks itself.
+    """
+    global SCHEDULER_TIMER
+
+    if SCHEDULER_TICKED_BY_CLIENT:
+        SCHEDULER.run(SCHEDULER_BUDGET_MS)
         return
+    budget_ms = SCHEDULER_BUDGET_MS if MAIN_WINDOW is not None else None
+    if not SCHEDULER.run(budget_ms):
+        if SCHEDULER_TIMER is not None:
+            SCHEDULER_TIMER.stop()
+        return
+    if SCHEDULER_TIMER is None:
+        SCHEDULER_TIMER = QtCore.QTimer(MAIN_WINDOW)
+        SCHEDULER_TIMER.timeout.connect(_scheduler_tick)
+    if not SCHEDULER_TIMER.isActive():
+        SCHEDULER_TIMER.start(0) # As soon as the events waiting in Maya's event loop are processed
+
+
+def _scheduler_tick():
+    _run_scheduler()
+    _flush_outbound()
+
+
+def _stop_scheduler():
+    """
+    Forget the tasks of a closed connection.
+    """
+    global SCHEDULER_TIMER
+
+    SCHEDULER.clear()
+    if SCHEDULER_TIMER is not None:
+        SCHEDULER_TIMER.stop()
+        SCHEDULER_TIMER = None
+
+
+def _steps_of(function, *args):
+    """
+    A task of a single chunk: function(*args).
+    """
+    function(*args)
+    return
+    yield # Makes it a generator
+
+
+################################################################################
+##########          RECEIVE
+################################################################################
+def _got_data():
+    """
+    Data is ready to read in the socket.
+    Drain it and process every complete packet.
+    """
     try:
-        ack_packet = {}
-        ack_packet[JSON_KEY_TYPE] = "JointsUuidsAck"
-        json_data = json.dumps([ack_packet])
-        CONNECTION.write(json_data)
-        CONNECTION.flush()
-        _print_verbose("JointsUuidsAck sent", 1)
+        read_start = _clock()
+        raw_data = CONNECTION.readAll()
 
-    except Exception, e:
-        _print_error("cannot send JointsUuidsAck (" + str(e) + ")")
+        if raw_data.isEmpty() is True:
+            _print_verbose("Raw data from CONNECTION is empty", 1)
+            return
+        data = raw_data.data()
+    except Exception as e:
+        _print_error("cannot read received data (" + type(e).__name__ + ": " + str(e) +")")
+        return
 
+    _receive_data(data, read_start)
 
-def _send_ack_jointstream_received():
-    '''
-    We send an acknowlegment to let Mosketch know that we received JointsStream.
-    '''
-    if CONNECTION is None:
-        _print_error("Mosketch is not connected!")
+
+def _receive_data(data, read_start):
+    """
+    Process bytes received from Mosketch, whatever the connection: every complete packet,
+    then send what they produced. read_start is the _clock() when reading them started.
+    """
+    try:
+        frames = PROTOCOL.decoder.feed(data)
+        _record_latency("read", read_start)
+        if CAPTURE is not None:
+            CAPTURE.write_frames(frames, time.time())
+
+    except Exception as e:
+        _print_error("cannot read received data (" + type(e).__name__ + ": " + str(e) +")")
         return
+
+    _process_frames(frames)
+    _flush_outbound()
+
+
+def _peek_packet_type(json_data):
+    """
+    Returns the packet type (as bytes) without decoding the Json document, None if not found.
+    """
+    if json_data.startswith(BINARY_STREAM_MAGIC):
+        return b"JointsStream"
+    match = _JSON_TYPE_PEEK.search(json_data)
+    if match is None:
+        return None
+    return match.group(1)
+
+
+def _process_frames(frames):
+    """
+    Feed complete frames to PROTOCOL and act on its events.
+    """
+    for event, payload in PROTOCOL.receive_frames(frames):
+        _process_event(event, payload)
+    _run_scheduler()
+
+
+def _process_event(event, payload):
+    """
+    Act on an event of PROTOCOL (see MosketchProtocol). This is where the protocol meets Maya.
+    What touches the scene is scheduled (see TaskScheduler), call _run_scheduler() afterwards.
+    """
+    if event == "joints_stream":
+        _schedule_joints_stream(payload)
+    elif event == "hierarchy":
+        # Always map joints as we need them when sending values back to Mosketch
+        SCHEDULER.add("hierarchy", _map_hierarchy(payload), CONNECTION, _hierarchy_mapped)
+    elif event == "joints_uuids":
+        SCHEDULER.add("joints_uuids", _steps_of(_process_joints_uuids, payload), done=_joints_uuids_stored)
+    elif event == "dropped":
+        STREAM_STATS["joints_stream_dropped"] += payload
+        if VERBOSE >= 3:
+            _print_verbose("Dropped %d stale JointsStream", 3, payload)
+    elif event == "ack_mode":
+        _print_verbose("Windowed acknowledgements " + ("enabled" if payload else "refused"), 1)
+    elif event == "transport":
+        _start_shared_memory(payload)
+    elif event == "invalid":
+        _print_verbose(payload, 1)
+    else:
+        _print_error(payload)
+
+
+def _hierarchy_mapped(task):
+    if task.payload is not CONNECTION:
+        return # Closed while mapping: nobody to acknowledge
+    PROTOCOL.hierarchy_mapped(STREAMING_MODE)
+    if NETWORK_THREAD is not None:
+        NETWORK_THREAD.binding_table = _current_binding_table()
+
+
+def _joints_uuids_stored(task):
+    PROTOCOL.joints_uuids_stored(_open_shared_memory())
+
+
+def _schedule_joints_stream(joints_stream_data):
+    if PROTOCOL.coalesce:
+        # Still waiting behind a long operation: only the newest pose is worth applying
+        for task in SCHEDULER.drop_pending("joints_stream"):
+            STREAM_STATS["joints_stream_dropped"] += 1
+            PROTOCOL.joints_stream_applied(task.payload)
+    SCHEDULER.add("joints_stream", _process_joints_stream(joints_stream_data), joints_stream_data, _joints_stream_applied)
+
+
+def _joints_stream_applied(task):
+    STREAM_STATS["joints_stream_applied"] += 1
+    PROTOCOL.joints_stream_applied(task.payload, task.elapsed)
+
+
+def _map_hierarchy(hierarchy_data):
+    """
+    Map joints (and controllers) of the hierarchy, or reuse the bindings of a previous connection to the same rig.
+    A generator, run in chunks by the scheduler. Stops as soon as the connection is closed between two chunks.
+    """
+    global JOINTS_BINDINGS
+    global CONTROLLERS_BINDINGS
+
+    connection = CONNECTION
     try:
-        ack_packet = {}
-        ack_packet[JSON_KEY_TYPE] = "JointsStreamAck"
-        json_data = json.dumps(ack_packet)
-        CONNECTION.write(json_data)
+        cache_key = _mapping_cache_key(hierarchy_data)
+    except Exception as e:
+        _print_error("cannot compute mapping cache key (" + type(e).__name__ + ": " + str(e) +")")
+        cache_key = None
+    yield
+    if CONNECTION is not connection:
+        return
+
+    if cache_key in MAPPING_CACHE and not _bindings_exist(MAPPING_CACHE[cache_key]):
+        # Deleted meanwhile, though the scene has the same paths and uuids (reloaded without a callback)
+        del MAPPING_CACHE[cache_key]
+    if cache_key in MAPPING_CACHE:
+        JOINTS_BINDINGS, CONTROLLERS_BINDINGS = MAPPING_CACHE[cache_key]
+        # Joints may have been moved in Maya meanwhile: write everything again
+        for binding_table in (JOINTS_BINDINGS, CONTROLLERS_BINDINGS):
+            if binding_table is not None:
+                for binding in binding_table.bindings:
+                    binding.last_rotation = None
+                    binding.last_translation = None
+        _print_success("reusing mapping of " + str(len(JOINTS_BINDINGS)) + " maya joints")
+        return
+
+    for _ in _process_hierarchy(hierarchy_data):
+        yield
+        if CONNECTION is not connection:
+            return
+    if CONNECTION is not connection: # Nothing mapped
+        return
+    if STREAMING_MODE == "Controllers":
+        for _ in _process_hierarchy_HIK(hierarchy_data):
+            yield
+            if CONNECTION is not connection:
+                return
 
-    except Exception, e:
-        _print_error("cannot send JointsStreamAck (" + str(e) + ")")
+    if cache_key is not None and JOINTS_BINDINGS is not None and len(JOINTS_BINDINGS) > 0:
+        _watch_scene_changes()
+        MAPPING_CACHE[cache_key] = (JOINTS_BINDINGS, CONTROLLERS_BINDINGS)
+        while len(MAPPING_CACHE) > MAPPING_CACHE_SIZE:
+            MAPPING_CACHE.popitem(last=False)
 
 
-def _process_joints_stream_HIK(joints_stream_data):
+def _mapping_cache_key(hierarchy_data):
+    """
+    Hash of the Hierarchy joints, of the streaming mode, of the paths and uuids of the scene nodes we map to
+    and of the joint orient and rotate axis of the joints (the bindings keep their inverses).
+    Opening another scene, renaming, reparenting, adding, deleting or reorienting joints changes it.
+    """
+    key = hashlib.sha1()
+    key.update(STREAMING_MODE.encode("utf-8"))
+    key.update(b"\0" + (HIK_CHARACTER or "").encode("utf-8"))
+    for joint_name in hierarchy_data[JSON_KEY_JOINTS]:
+        key.update(b"\0" + joint_name.encode("utf-8"))
+    key.update(b"\1")
+    for node in cmds.ls(type=MAPPING_CACHE_NODE_TYPES, long=True) or []:
+        key.update(b"\0" + node.encode("utf-8"))
+    for uuid in cmds.ls(type=MAPPING_CACHE_NODE_TYPES, uuid=True) or []:
+        key.update(b"\0" + uuid.encode("utf-8"))
+    key.update(b"\1")
+    for joint in cmds.ls(type="joint", long=True) or []:
+        orientation = cmds.getAttr(joint + ".jointOrient") + cmds.getAttr(joint + ".rotateAxis")
+        key.update(repr(orientation).encode("utf-8"))
+    return key.hexdigest()
+
+
+def _bindings_exist(binding_tables):
+    """
+    Whether the Maya nodes of all the bindings still exist. Reopening a scene gives its nodes the same paths
+    and uuids: the cache key does not change but the cached nodes and plugs are deleted ones.
+    """
+    for binding_table in binding_tables:
+        if binding_table is None:
+            continue
+        for binding in binding_table.bindings:
+            if binding.plugs is not None:
+                if not om2.MObjectHandle(binding.plugs[0].node()).isValid():
+                    return False
+            elif not binding.maya_node.exists():
+                return False
+    return True
+
+
+def _watch_scene_changes():
+    """
+    Clear the mapping cache whenever a scene is opened, created or (un)referenced, once something is cached.
+    """
+    if SCENE_CALLBACK_IDS or om2 is None:
+        return
+    for message in (om2.MSceneMessage.kAfterOpen, om2.MSceneMessage.kAfterNew, om2.MSceneMessage.kAfterReference,
+                    om2.MSceneMessage.kAfterRemoveReference, om2.MSceneMessage.kAfterLoadReference,
+                    om2.MSceneMessage.kAfterUnloadReference):
+        SCENE_CALLBACK_IDS.append(om2.MSceneMessage.addCallback(message, _scene_changed))
+
+
+def _unwatch_scene_changes():
+    if SCENE_CALLBACK_IDS:
+        om2.MMessage.removeCallbacks(SCENE_CALLBACK_IDS)
+    del SCENE_CALLBACK_IDS[:]
+
+
+def _scene_changed(client_data=None):
+    clear_mapping_cache()
+
+
+def _process_hierarchy_HIK(data):
     '''
-    We receive "full" local rotations and local translations.
-    So we need to substract rotate axis and joint orient.
+    We suppose that joints name in Mosketch and Maya are the same name.
+    Find the associated controllers, MAPPING_CHUNK_SIZE per chunk (a generator).
+    NOTE: data is not used for the moment
     '''
+    global CONTROLLERS_BINDINGS
+
+    # Only published once complete (empty when there is nothing to map)
+    binding_table = BindingTable(rotate_translation=False)
+    CONTROLLERS_BINDINGS = None
     try:
-        joints_data = joints_stream_data[JSON_KEY_JOINTS]
+        # HIKCharacterNode gives HIK => joints mapping
+        hik_character = _get_hik_character()
+        # HIKControlSetNode gives HIK => FK Controllers mapping
+        hik_control_set = None if hik_character is None else _get_hik_control_set(hik_character)
+
+        if hik_character is None:
+            _print_error("There is no HIKCharacterNode in the scene")
+        elif hik_control_set is None:
+            _print_error("There is no HIKControlSetNode for " + hik_character)
+        else:
+            for index, (joint_name, fk_controller) in enumerate(_get_hik_slots(hik_character, hik_control_set)):
+                if index % MAPPING_CHUNK_SIZE == 0:
+                    yield
+                _map_controller(binding_table, joint_name, pmc.PyNode(fk_controller))
 
-        for joint_data in joints_data:
-            joint_name = joint_data[JSON_KEY_NAME]
-            try:
-                maya_controller = CONTROLLERS_BUFFER[joint_name]
-            except KeyError:
-                continue
+            for _ in _cache_openmaya_handles_in_chunks(binding_table.bindings):
+                yield
 
-            # W = [S] * [RO] * [R] * [JO] * [IS] * [T]
-            quat = pmc.datatypes.Quaternion(joint_data[JSON_KEY_ROTATION])
-            rotate_axis_inv = CONTROLLERS_ROTATE_AXIS_INV_BUFFER[joint_name]
-            joint_orient_inv = CONTROLLERS_INIT_ORIENT_INV_BUFFER[joint_name]
-            quat = rotate_axis_inv * quat * joint_orient_inv
-            maya_controller.setRotation(quat, space='transform')
-
-            joint_type = joint_data[JSON_KEY_ANATOMIC]
-            if joint_type == 7: # This is a 6 DoFs joint so consider translation part too
-                trans = pmc.datatypes.Vector(joint_data[JSON_KEY_TRANSLATION])
-                # Mosketch uses meters. Maya uses centimeters
-                trans *= 100
-                maya_controller.setTranslation(trans, space='transform')
+            # Print nb controllers mapped for information purposes
+            _print_success("Controllers bindings: " + str(len(binding_table)))
+    except Exception as e:
+        _print_error("cannot process hierarchy data (" + type(e).__name__ + ": " + str(e) +")")
+    CONTROLLERS_BINDINGS = binding_table
+
+
+def _get_hik_character():
+    """
+    Returns HIK_CHARACTER, HumanIK's current character or the first HIKCharacterNode of the scene.
+    """
+    hik_characters = cmds.ls(type="HIKCharacterNode") or []
+    if not hik_characters:
+        return None
+    if HIK_CHARACTER is not None:
+        if HIK_CHARACTER not in hik_characters:
+            raise ValueError("HIKCharacterNode " + HIK_CHARACTER + " does not exist")
+        return HIK_CHARACTER
+    if len(hik_characters) > 1:
+        try:
+            current_character = mel.eval("hikGetCurrentCharacter()")
+        except Exception: # HumanIK's scripts are not loaded
+            current_character = None
+        if current_character in hik_characters:
+            return current_character
+        _print_verbose("Several HIKCharacterNodes in the scene (" + ", ".join(hik_characters) + "). Using "
+                       + hik_characters[0] + ", see set_hik_character()", 1)
+    return hik_characters[0]
+
+
+def _get_hik_control_set(hik_character):
+    """
+    Returns the HIKControlSetNode connected to hik_character, or the only one of the scene.
+    """
+    hik_control_sets = cmds.listConnections(hik_character, type="HIKControlSetNode") or []
+    if not hik_control_sets:
+        hik_control_sets = cmds.ls(type="HIKControlSetNode") or []
+        if len(hik_control_sets) > 1:
+            _print_verbose("No HIKControlSetNode connected to " + hik_character + ", using " + hik_control_sets[0], 1)
+    return hik_control_sets[0] if hik_control_sets else None
+
+
+def _get_hik_slots(hik_character, hik_control_set):
+    """
+    (joint name, FK controller name) of every HIK slot that is both characterized and controlled: the attributes
+    that connect a joint to the character and a controller to the control set. Whatever slots this Maya version has.
+    One connections query on each node. Not cached: it only runs when the mapping cache misses, which is when
+    the scene or the characterization changed.
+    """
+    # With connections=True, listConnections returns [node.attribute, connected node, ...]
+    joints_connections = cmds.listConnections(hik_character, source=True, destination=False,
+                                              connections=True, type="joint") or []
+    controllers_connections = cmds.listConnections(hik_control_set, source=True, destination=False,
+                                                   connections=True) or []
+
+    controllers_by_slot = {}
+    for index in range(0, len(controllers_connections) - 1, 2):
+        controllers_by_slot[controllers_connections[index].rsplit(".", 1)[-1]] = controllers_connections[index + 1]
+
+    slots = []
+    for index in range(0, len(joints_connections) - 1, 2):
+        slot_name = joints_connections[index].rsplit(".", 1)[-1]
+        if slot_name in controllers_by_slot:
+            # Joints are mapped by their name, without path
+            slots.append((joints_connections[index + 1].rsplit("|", 1)[-1], controllers_by_slot[slot_name]))
+    return slots
+
+
+def _map_controller(binding_table, mosketch_name, maya_controller):
+    global CONTROLLERS_TO_JOINTS_NAME
+
+    CONTROLLERS_TO_JOINTS_NAME[maya_controller] = mosketch_name
+
+    vRO = maya_controller.getRotateAxis()
+    RO = pmc.datatypes.EulerRotation(vRO[0], vRO[1], vRO[2]).asQuaternion()
+    JO = maya_controller.getOrientation()
+    binding_table.add(mosketch_name, maya_controller, RO, JO)
+
+
+def _process_hierarchy(hierarchy_data):
+    """
+    Map the joints of the Hierarchy onto the Maya joints of the same name, MAPPING_CHUNK_SIZE per chunk (a generator).
+    """
+    global JOINTS_BINDINGS
+
+    # Only published once complete: UPDATE MOSKETCH or the live update may run between chunks
+    binding_table = BindingTable(rotate_translation=True)
+    JOINTS_BINDINGS = None
+    try:
+        # Retrieve all joints from Maya once, as full paths (PyNodes are only built for mapped joints)
+        all_maya_joints = cmds.ls(type="joint", long=True) or []
+        maya_joints_index = MayaNamesIndex(all_maya_joints)
+
+        # Then from all joints in the hierarchy, lookup in maya joints
+        joints_name = hierarchy_data[JSON_KEY_JOINTS]
+
+        ambiguous_names = []
+        for index, joint_name in enumerate(joints_name):
+            if index % MAPPING_CHUNK_SIZE == 0:
+                yield
+            maya_joints = maya_joints_index.find(joint_name)
+            if maya_joints:
+                # We should have one Maya joint mapped anyways
+                if len(maya_joints) != 1:
+                    ambiguous_names.append(joint_name)
+
+                _map_joint(binding_table, joint_name, pmc.PyNode(maya_joints[0]))
+
+        if ambiguous_names:
+            _print_error("We should have 1 Maya joint mapped only. Taking the first one only for: " + ", ".join(ambiguous_names))
+
+        # If no mapping close connection
+        if (len(binding_table) == 0):
+            _close_connection()
+            _print_error("Couldn't map joints. Check Maya's namespaces maybe.")
+            return
+
+        for _ in _cache_openmaya_handles_in_chunks(binding_table.bindings):
+            yield
+
+        # Print nb joints in Maya and nb joints in bindings for information purposes
+        _print_success("mapped " + str(len(binding_table)) + " maya joints out of " + str(len(all_maya_joints)))
+        _print_verbose('Joints bindings = ' + str(len(binding_table)), 1)
 
-    except KeyError as e:
-        _print_error("cannot find " + joint_name + " in maya")
-        return
     except Exception as e:
-        _print_error("cannot process joints stream (" + type(e).__name__ + ": " + str(e) +")")
+        _print_error("cannot process hierarchy data (" + type(e).__name__ + ": " + str(e) +")")
+    JOINTS_BINDINGS = binding_table
+    
+
+class MayaNamesIndex(object):
+    """
+    Maya nodes full paths indexed by full path, short name ("ns:Hips") and name without namespace ("Hips").
+    """
+    def __init__(self, full_paths):
+        self.by_full_path = {}
+        self.by_short_name = {}
+        self.by_stripped_name = {}
+        for full_path in full_paths:
+            short_name = full_path.rsplit("|", 1)[-1]
+            self.by_full_path[full_path] = [full_path]
+            self.by_short_name.setdefault(short_name, []).append(full_path)
+            self.by_stripped_name.setdefault(short_name.rsplit(":", 1)[-1], []).append(full_path)
+
+    def find(self, name):
+        """
+        Returns the full paths matching name, an exact match is preferred over a match ignoring namespaces.
+        """
+        if name.startswith("|"):
+            return self.by_full_path.get(name, [])
+        full_paths = self.by_short_name.get(name)
+        if full_paths:
+            return full_paths
+        return self.by_stripped_name.get(name.rsplit(":", 1)[-1], [])
+
+
+def _map_joint(binding_table, mosketch_name, maya_joint):
+    vRO = maya_joint.getRotateAxis()
+    RO = pmc.datatypes.EulerRotation(vRO[0], vRO[1], vRO[2]).asQuaternion()
+    try:
+        # We have a Joint => Get joint_orient into account
+        JO = maya_joint.getOrientation()
+    except Exception:
+        # We have a Transform => Do NOT get joint_orient into account but the initial transform instead
+        JO = maya_joint.getRotation(space='transform', quaternion=True)
+    binding_table.add(mosketch_name, maya_joint, RO, JO)
 
 
 def _process_joints_stream(joints_stream_data):
-    '''
-    We receive "full" local rotations and local translations.
-    So we need to substract rotate axis and joint orient.
-    '''
+    """
+    Retarget a JointsStream onto the joints (or the controllers) and write it, APPLY_CHUNK_SIZE joints
+    per chunk (a generator).
+    """
     try:
-        joints_data = joints_stream_data[JSON_KEY_JOINTS]
-        _print_verbose(joints_data, 3)
+        if VERBOSE >= 3:
+            _print_verbose(joints_stream_data, 3)
 
-        for joint_data in joints_data:
-            # We select all joints having the given name
-            joint_name = joint_data[JSON_KEY_NAME]
-            try:
-                maya_joint = JOINTS_BUFFER[joint_name]
-            except KeyError:
-                continue
-
-            if maya_joint:
-                # W = [S] * [RO] * [R] * [JO] * [IS] * [T]
-                quat = pmc.datatypes.Quaternion(joint_data[JSON_KEY_ROTATION])
-                rotate_axis_inv = JOINTS_ROTATE_AXIS_INV_BUFFER[joint_name]
-                joint_orient_inv = JOINTS_INIT_ORIENT_INV_BUFFER[joint_name]
-                quat = rotate_axis_inv * quat * joint_orient_inv
-                maya_joint.setRotation(quat, space='transform')
-                
-                joint_type = joint_data[JSON_KEY_ANATOMIC]                
-                if joint_type == 7: # This is a 6 DoFs joint so consider translation part too
-                    trans = pmc.datatypes.Vector(joint_data[JSON_KEY_TRANSLATION])
-                    trans = trans.rotateBy(rotate_axis_inv)
-                    # Mosketch uses meters. Maya uses centimeters
-                    trans *= 100
-                    maya_joint.setTranslation(trans, space='transform')
+        values = _retarget_joints_stream(_current_binding_table(), joints_stream_data, RETARGET_BACKEND)
+        yield
+        for _ in _apply_retargeted_values(values):
+            yield
 
     except KeyError as e:
-        _print_error("cannot find " + joint_name + " in maya")
+        _print_error("cannot find " + str(e) + " in joints stream")
         return
     except Exception as e:
         _print_error("cannot process joints stream (" + type(e).__name__ + ": " + str(e) +")")
@@ -771,22 +2675,927 @@ def _process_joints_stream(joints_stream_data):
 def _process_joints_uuids(data):
     _print_verbose("_process_joints_uuids", 2)
     global JOINTS_UUIDS
+    global JOINTS_UUIDS_ORDER
 
     try:
         joints_data = data[JSON_KEY_JOINTS]
         _print_verbose(joints_data, 3)
 
+        JOINTS_UUIDS_ORDER = []
         for joint_data in joints_data:
             for name in joint_data:
                 JOINTS_UUIDS[name] = joint_data[name]
+                JOINTS_UUIDS_ORDER.append(name)
 
     except Exception as e:
         _print_error("cannot process joints uuids (" + type(e).__name__ + ": " + str(e) +")")
 
 
+################################################################################
+##########          NETWORK THREAD
+################################################################################
+class PoseSlot(object):
+    """
+    Latest pose handed over from the network thread to Maya's main thread.
+    The network thread builds each pose in its own buffer and swaps it in under the lock,
+    so neither side waits for the other. Poses never taken are counted as dropped.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pose = None
+        self._published = 0
+        self._taken = 0
+
+    def publish(self, pose):
+        """
+        Returns the pose replaced (never taken) or None.
+        """
+        with self._lock:
+            replaced = self._pose
+            self._pose = pose
+            self._published += 1
+        return replaced
+
+    def take(self):
+        """
+        Returns (latest pose or None, number of poses dropped since last take).
+        """
+        with self._lock:
+            pose = self._pose
+            self._pose = None
+            dropped = self._published - self._taken - (1 if pose is not None else 0)
+            self._taken = self._published
+        return pose, dropped
+
+
+class NetworkThread(threading.Thread):
+    """
+    Read and decode the Mosketch stream outside of Maya's main thread.
+    JointsStreams are retargeted here (without pymel) and published into a PoseSlot, other protocol events
+    are queued for the main thread which is the only one allowed to touch Maya.
+    For sending it behaves like the QTcpSocket (write/flush/close/errorString).
+    """
+    def __init__(self, ip, port, protocol):
+        super(NetworkThread, self).__init__(name="MosketchNetworkThread")
+        self.daemon = True
+        self.ip = ip
+        self.port = port
+        self.protocol = protocol
+        self.pose_slot = PoseSlot()
+        self.events = queue.Queue() # (event name, payload) to be processed by the main thread
+        self.binding_table = None # Set by the main thread once the hierarchy is mapped
+        self._connection = None
+        self._stop_event = threading.Event()
+        self._error = ""
+
+    def run(self):
+        try:
+            self._connection = _BlockingConnection(self.ip, self.port)
+        except Exception as e:
+            self._error = str(e)
+            self.events.put(("error", None))
+            return
+        self.events.put(("connected", None))
+
+        while not self._stop_event.is_set():
+            data = self._connection.read() # Times out so that we regularly check if we have to stop
+            if data is None:
+                continue
+            if not data:
+                if not self._stop_event.is_set():
+                    self.events.put(("error" if self._connection.errorString() else "disconnected", None))
+                return
+
+            read_start = _clock()
+            frames = self.protocol.decoder.feed(data)
+            _record_latency("read", read_start)
+            capture = CAPTURE
+            if capture is not None:
+                capture.write_frames(frames, time.time())
+            for event in self.protocol.receive_frames(frames):
+                if event[0] == "joints_stream":
+                    self._publish_pose(event[1])
+                else:
+                    self.events.put(("protocol", event))
+            # The acks of the whole read in one write
+            data = self.protocol.data_to_send()
+            if data is not None:
+                ack_start = _clock()
+                self.write(data)
+                _record_latency("ack", ack_start)
+
+    def _publish_pose(self, data):
+        try:
+            binding_table = self.binding_table
+            values = None
+            if binding_table is not None:
+                # pymel stays on the main thread
+                backend = "python" if RETARGET_BACKEND == "pymel" else RETARGET_BACKEND
+                values = _retarget_joints_stream(binding_table, data, backend)
+            replaced = self.pose_slot.publish((data, binding_table, values))
+            if replaced is not None:
+                # Dropped: acknowledged now, the published one once applied by the main thread (see _pose_applied())
+                self.protocol.joints_stream_applied(replaced[0])
+        except Exception as e:
+            self.events.put(("log", "cannot process joints stream (" + type(e).__name__ + ": " + str(e) +")"))
+
+    def write(self, data):
+        self._connection.write(data)
+
+    def flush(self):
+        pass # write() is synchronous
+
+    def close(self):
+        self._stop_event.set()
+        if self._connection is not None:
+            self._connection.shutdown()
+            if self is not threading.current_thread():
+                self.join(1.0)
+            self._connection.close()
+
+    def errorString(self):
+        if self._connection is not None and self._connection.errorString():
+            return self._connection.errorString()
+        return self._error
+
+
+def _start_network_thread():
+    global CONNECTION
+    global NETWORK_THREAD
+    global NETWORK_THREAD_TIMER
+
+    NETWORK_THREAD = NetworkThread(IP, PORT, PROTOCOL)
+    # Send functions only need write() and flush()
+    CONNECTION = NETWORK_THREAD
+
+    NETWORK_THREAD_TIMER = QtCore.QTimer(MAIN_WINDOW)
+    NETWORK_THREAD_TIMER.timeout.connect(_consume_network_thread)
+    NETWORK_THREAD_TIMER.start(NETWORK_THREAD_POLL_MS)
+
+    _set_status("CONNECTING...", "orange")
+
+    print("Trying to connect to " + _get_connection_name() + " (network thread)")
+    NETWORK_THREAD.start()
+
+
+def _stop_network_thread():
+    global NETWORK_THREAD
+    global NETWORK_THREAD_TIMER
+
+    if NETWORK_THREAD_TIMER is not None:
+        NETWORK_THREAD_TIMER.stop()
+        NETWORK_THREAD_TIMER = None
+    if NETWORK_THREAD is not None:
+        NETWORK_THREAD.close()
+        NETWORK_THREAD = None
+
+
+def _consume_network_thread():
+    """
+    Called on Maya's main thread by a timer: process the packets queued by the network thread
+    then apply the latest pose. This is the only place where the network thread mode touches Maya.
+    """
+    thread = NETWORK_THREAD
+    while thread is NETWORK_THREAD:
+        try:
+            event, payload = thread.events.get_nowait()
+        except queue.Empty:
+            break
+
+        if event == "protocol":
+            _process_event(*payload)
+        elif event == "log":
+            _print_error(payload)
+        elif event == "connected":
+            _connected()
+        elif event == "disconnected":
+            _disconnected()
+        elif event == "error":
+            _got_error(None)
+
+    if thread is not NETWORK_THREAD:
+        return # Connection closed while processing events
+
+    pose, dropped = thread.pose_slot.take()
+    STREAM_STATS["joints_stream_dropped"] += dropped
+    if pose is not None:
+        # The previous one is still waiting for a long operation: replaced as in the PoseSlot
+        for task in SCHEDULER.drop_pending("pose"):
+            STREAM_STATS["joints_stream_dropped"] += 1
+            PROTOCOL.joints_stream_applied(task.payload[0])
+        SCHEDULER.add("pose", _apply_pose(pose), pose, _pose_applied)
+    _run_scheduler()
+    _flush_outbound()
+
+
+def _current_binding_table():
+    if STREAMING_MODE == "Controllers":
+        return CONTROLLERS_BINDINGS
+    return JOINTS_BINDINGS
+
+
+def _apply_pose(pose):
+    """
+    Write a pose retargeted by the network thread (a generator, see _apply_retargeted_values()).
+    """
+    data, binding_table, values = pose
+    if values is None or binding_table is not _current_binding_table():
+        # Decoded before the hierarchy was (re)mapped: do it the usual way
+        for _ in _process_joints_stream(data):
+            yield
+        return
+
+    try:
+        for _ in _apply_retargeted_values(values):
+            yield
+    except Exception as e:
+        _print_error("cannot apply joints stream (" + type(e).__name__ + ": " + str(e) +")")
+
+
+def _pose_applied(task):
+    STREAM_STATS["joints_stream_applied"] += 1
+    PROTOCOL.joints_stream_applied(task.payload[0], task.elapsed)
+
+
+################################################################################
+##########          SHARED MEMORY
+################################################################################
+# A shared memory file starts with a header (magic, version, joints count, slots count, reserved, slot size)
+# followed by the number of the last frame completely written, 0 until there is one. Then come the slots:
+# frame n (numbered from 1) is written in slot (n - 1) % slots count, as its number followed by a binary
+# JointsStream. The writer sets the number of the slot to 0, writes the JointsStream, sets the number of
+# the slot to n and then the last frame number of the header. A frame whose slot number is not n anymore
+# was written over while it was read (a torn read).
+_SHARED_MEMORY_HEADER = struct.Struct(str("<4sHHHHI"))
+_SHARED_MEMORY_FRAME_NUMBER = struct.Struct(str("<Q"))
+_SHARED_MEMORY_SLOTS_OFFSET = _SHARED_MEMORY_HEADER.size + _SHARED_MEMORY_FRAME_NUMBER.size
+
+
+class SharedPoseBuffer(object):
+    """
+    Reading side of the shared memory transport: a zeroed file sized for the joints of names, that Mosketch
+    maps and writes the JointsStreams into. latest() reads the newest one in place, without any decoding.
+    The file is removed by close().
+    """
+    def __init__(self, path, names, slots=None):
+        self.path = path
+        self.names = names
+        self.slots = slots or SHARED_MEMORY_SLOTS
+        frame_size = _BINARY_HEADER.size + len(names) * _BINARY_BYTES_PER_JOINT
+        self.slot_size = (_SHARED_MEMORY_FRAME_NUMBER.size + frame_size + 7) // 8 * 8
+        self.frame_number = 0 # Last one read
+        with io.open(path, "wb") as shared_file:
+            shared_file.write(_SHARED_MEMORY_HEADER.pack(SHARED_MEMORY_MAGIC, SHARED_MEMORY_VERSION, len(names), self.slots, 0, self.slot_size))
+            shared_file.write(b"\0" * (_SHARED_MEMORY_FRAME_NUMBER.size + self.slots * self.slot_size))
+        with io.open(path, "rb") as shared_file:
+            self._map = mmap.mmap(shared_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def latest(self, views=False):
+        """
+        Returns (frame number, BinaryJointsStream) of the newest frame if it was not read yet, None otherwise.
+        The stream is None if the frame was written over while it was read. With views, its rotations and
+        translations are the mapped memory itself: check is_current() once they are used.
+        """
+        frame_number = _SHARED_MEMORY_FRAME_NUMBER.unpack_from(self._map, _SHARED_MEMORY_HEADER.size)[0]
+        if frame_number == self.frame_number:
+            return None
+        self.frame_number = frame_number
+        joints_stream = None
+        if self.is_current(frame_number):
+            joints_stream = BinaryJointsStream(self._map, self.names, self._frame_offset(frame_number), views)
+            if not self.is_current(frame_number):
+                joints_stream = None
+        return frame_number, joints_stream
+
+    def is_current(self, frame_number):
+        """
+        Whether the slot of frame_number still holds that frame.
+        """
+        if self._map is None:
+            return False
+        offset = self._frame_offset(frame_number) - _SHARED_MEMORY_FRAME_NUMBER.size
+        return _SHARED_MEMORY_FRAME_NUMBER.unpack_from(self._map, offset)[0] == frame_number
+
+    def frame(self, frame_number):
+        """
+        Returns a copy of the binary JointsStream of frame_number, None if it was written over.
+        """
+        offset = self._frame_offset(frame_number)
+        frame = self._map[offset:offset + _binary_frame_size(self._map, offset)]
+        return frame if self.is_current(frame_number) else None
+
+    def close(self):
+        if self._map is None:
+            return
+        try:
+            self._map.close()
+        except BufferError:
+            pass # NumPy views of a frame are still alive, the mapping is released with them
+        self._map = None
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass # Still mapped by Mosketch (Windows)
+
+    def _frame_offset(self, frame_number):
+        slot = (frame_number - 1) % self.slots
+        return _SHARED_MEMORY_SLOTS_OFFSET + slot * self.slot_size + _SHARED_MEMORY_FRAME_NUMBER.size
+
+
+def _open_shared_memory():
+    """
+    Returns a new SharedPoseBuffer for the joints of the last JointsUuids when the shared memory transport
+    can be used, None otherwise.
+    """
+    global SHARED_MEMORY
+
+    _close_shared_memory()
+    if not SHARED_MEMORY_MODE or not IP.startswith("127.") or isinstance(CONNECTION, _ReplayConnection):
+        return None
+
+    path = SHARED_MEMORY_PATH
+    try:
+        if path is None:
+            # A new file each time: Mosketch may still have the previous one mapped
+            shared_file, path = tempfile.mkstemp(".mkshm", "mosketch_for_maya_")
+            os.close(shared_file)
+        SHARED_MEMORY = SharedPoseBuffer(path, PROTOCOL.joints_uuids_order, SHARED_MEMORY_SLOTS)
+    except Exception as e:
+        _print_error("cannot create shared memory " + str(path) + " (" + type(e).__name__ + ": " + str(e) +")")
+        return None
+    return SHARED_MEMORY
+
+
+def _start_shared_memory(accepted):
+    """
+    Mosketch answered setStreamingTransport: poll the shared memory, or forget it if it was refused.
+    """
+    global SHARED_MEMORY_TIMER
+
+    if SHARED_MEMORY is None:
+        return
+    if not accepted:
+        _print_verbose("Shared memory refused, JointsStreams come through the socket", 1)
+        _close_shared_memory()
+        return
+
+    _print_verbose("JointsStreams read from shared memory %s", 1, SHARED_MEMORY.path)
+    if MAIN_WINDOW is None:
+        return # run_headless() and mosketch_asyncio poll it themselves
+    if SHARED_MEMORY_TIMER is None:
+        SHARED_MEMORY_TIMER = QtCore.QTimer(MAIN_WINDOW)
+        SHARED_MEMORY_TIMER.timeout.connect(_shared_memory_tick)
+    SHARED_MEMORY_TIMER.start(SHARED_MEMORY_POLL_MS)
+
+
+def _close_shared_memory():
+    global SHARED_MEMORY
+    global SHARED_MEMORY_TIMER
+
+    if SHARED_MEMORY_TIMER is not None:
+        SHARED_MEMORY_TIMER.stop()
+        SHARED_MEMORY_TIMER = None
+    if SHARED_MEMORY is not None:
+        SHARED_MEMORY.close()
+        SHARED_MEMORY = None
+
+
+def _shared_memory_tick():
+    """
+    Called by a timer (or by the loops of run_headless() and mosketch_asyncio): schedule the newest pose
+    written into the shared memory since the last call, if any.
+    """
+    shared_memory = SHARED_MEMORY
+    if shared_memory is None:
+        return
+    binding_table = _current_binding_table()
+    # The NumPy retarget converts the whole frame at once: it may as well read it in place
+    views = (RETARGET_BACKEND == "numpy" and numpy is not None and binding_table is not None
+             and len(binding_table) >= NUMPY_MIN_JOINTS)
+
+    read_start = _clock()
+    previous_frame_number = shared_memory.frame_number
+    try:
+        pose = shared_memory.latest(views)
+    except Exception as e:
+        _print_error("cannot read shared memory (" + type(e).__name__ + ": " + str(e) +")")
+        return
+    if pose is None:
+        return
+    _record_latency("read", read_start)
+
+    frame_number, joints_stream = pose
+    if previous_frame_number:
+        STREAM_STATS["joints_stream_dropped"] += max(frame_number - previous_frame_number - 1, 0)
+    if joints_stream is None:
+        STREAM_STATS["shared_memory_torn_reads"] += 1
+        return
+    if CAPTURE is not None:
+        frame = shared_memory.frame(frame_number)
+        if frame is not None:
+            CAPTURE.write_frames([frame], time.time())
+
+    STREAM_STATS["joints_stream_dropped"] += len(SCHEDULER.drop_pending("shared_pose"))
+    SCHEDULER.add("shared_pose", _apply_shared_pose(shared_memory, frame_number, joints_stream, views))
+    _run_scheduler()
+
+
+def _apply_shared_pose(shared_memory, frame_number, joints_stream, views):
+    """
+    Retarget and write a pose of the shared memory (a generator, see _apply_retargeted_values()).
+    Nothing is acknowledged: Mosketch writes at its own pace and the newest pose is always the one read.
+    """
+    try:
+        values = _retarget_joints_stream(_current_binding_table(), joints_stream, RETARGET_BACKEND)
+        if views and not shared_memory.is_current(frame_number):
+            # Written over while it was retargeted: the next tick reads a newer pose
+            STREAM_STATS["shared_memory_torn_reads"] += 1
+            return
+        yield
+        for _ in _apply_retargeted_values(values):
+            yield
+        STREAM_STATS["joints_stream_applied"] += 1
+
+    except Exception as e:
+        _print_error("cannot apply joints stream (" + type(e).__name__ + ": " + str(e) +")")
+
+
+################################################################################
+##########          RECORD
+################################################################################
+class PoseRecorder(object):
+    """
+    Applied frames of a binding table. Each frame is a row of doubles: its time in seconds, then the
+    rotation (x, y, z, w) and translation (x, y, z) of every binding, NaN when it was not streamed.
+    Rows are stored in one flat array whose capacity doubles when full.
+    """
+    VALUES_PER_BINDING = 7
+
+    def __init__(self, binding_table, capacity=None):
+        if capacity is None:
+            capacity = RECORD_INITIAL_FRAMES
+        self.binding_table = binding_table
+        self.start_frame = cmds.currentTime(query=True)
+        self.start_time = None
+        self.row_size = 1 + self.VALUES_PER_BINDING * len(binding_table)
+        self.rows = array.array(str("d"), [0.0]) * (max(capacity, 1) * self.row_size)
+        self.frames_count = 0
+        self._empty_row = array.array(str("d"), [float("nan")]) * self.row_size
+
+    def append(self, values, timestamp):
+        if self.start_time is None:
+            self.start_time = timestamp
+        start = self.frames_count * self.row_size
+        if start == len(self.rows):
+            self.rows.extend(self.rows)
+
+        row = self._empty_row[:]
+        row[0] = timestamp - self.start_time
+        for binding, quat, trans in values:
+            offset = 1 + binding.index * self.VALUES_PER_BINDING
+            row[offset] = quat[0]
+            row[offset + 1] = quat[1]
+            row[offset + 2] = quat[2]
+            row[offset + 3] = quat[3]
+            if trans is not None:
+                row[offset + 4] = trans[0]
+                row[offset + 5] = trans[1]
+                row[offset + 6] = trans[2]
+        self.rows[start:start + self.row_size] = row
+        self.frames_count += 1
+
+    def duration(self):
+        if self.frames_count == 0:
+            return 0.0
+        return self.rows[(self.frames_count - 1) * self.row_size]
+
+    def memory_size(self):
+        """
+        Bytes used by the recorded frames
+        """
+        return self.frames_count * self.row_size * self.rows.itemsize
+
+
+def _record_values(values):
+    global RECORDER
+
+    binding_table = _current_binding_table()
+    if binding_table is None or not values:
+        return
+    first_binding = values[0][0]
+    if first_binding.index >= len(binding_table) or first_binding is not binding_table.bindings[first_binding.index]:
+        return # Retargeted on the bindings of a previous hierarchy (a pose of the network thread)
+    if RECORDER is not None and RECORDER.binding_table is not binding_table:
+        # Hierarchy was mapped again: keep what was recorded so far and go on with the new bindings
+        _bake_recorder(RECORDER)
+        RECORDER = None
+    if RECORDER is None:
+        RECORDER = PoseRecorder(binding_table)
+    RECORDER.append(values, time.time())
+
+
+def _bake_recorder(recorder):
+    """
+    Key the recorded frames on the rotate and translate plugs of the bindings, with one addKeys() per plug.
+    Frames are snapped to the scene frame rate, the last one received during a scene frame wins.
+    """
+    if recorder.frames_count == 0:
+        return
+    try:
+        bake_start = time.time()
+        time_unit = om2.MTime.uiUnit()
+        frames_per_second = om2.MTime(1.0, om2.MTime.kSeconds).asUnits(time_unit)
+
+        rows_by_frame = OrderedDict()
+        for frame_index in range(recorder.frames_count):
+            seconds = recorder.rows[frame_index * recorder.row_size]
+            rows_by_frame[int(round(recorder.start_frame + seconds * frames_per_second))] = frame_index * recorder.row_size
+
+        keys_count = 0
+        rows = recorder.rows
+        for binding in recorder.binding_table.bindings:
+            if binding.plugs is None:
+                _cache_openmaya_handles([binding])
+            offset = 1 + binding.index * PoseRecorder.VALUES_PER_BINDING
+            rotation_times, rotation_values = om2.MTimeArray(), ([], [], [])
+            translation_times, translation_values = om2.MTimeArray(), ([], [], [])
+            euler = None
+            for frame, row_start in rows_by_frame.items():
+                start = row_start + offset
+                if not math.isnan(rows[start]): # The joint was streamed in that frame
+                    new_euler = om2.MQuaternion(rows[start], rows[start + 1], rows[start + 2], rows[start + 3]).asEulerRotation()
+                    new_euler.reorderIt(binding.rotate_order)
+                    if euler is not None:
+                        # Avoid flips between consecutive keys
+                        new_euler.setToClosestSolution(euler)
+                    euler = new_euler
+                    rotation_times.append(om2.MTime(frame, time_unit))
+                    rotation_values[0].append(euler.x)
+                    rotation_values[1].append(euler.y)
+                    rotation_values[2].append(euler.z)
+                if not math.isnan(rows[start + 4]):
+                    translation_times.append(om2.MTime(frame, time_unit))
+                    for axis in range(3):
+                        translation_values[axis].append(rows[start + 4 + axis])
+
+            for plugs, times, channels in ((binding.plugs[:3], rotation_times, rotation_values),
+                                           (binding.plugs[3:], translation_times, translation_values)):
+                if len(times) == 0:
+                    continue
+                for plug, channel_values in zip(plugs, channels):
+                    # Existing keys in the recorded range are replaced
+                    _get_anim_curve(plug).addKeys(times, channel_values, oma2.MFnAnimCurve.kTangentGlobal,
+                                                  oma2.MFnAnimCurve.kTangentGlobal, False)
+                    keys_count += len(channel_values)
+
+        bake_duration = time.time() - bake_start
+        duration = recorder.duration()
+        _print_success("baked " + str(keys_count) + " keys from " + str(recorder.frames_count) + " frames in "
+                       + "%.2fs (%.3fs per 10k keys)" % (bake_duration, bake_duration * 10000.0 / max(keys_count, 1)))
+        _print_verbose("recorded %.1fs, %.1f MB per recorded minute" % (
+            duration, recorder.memory_size() / 1048576.0 * 60.0 / max(duration, 1.0 / 60.0)), 1)
+
+    except Exception as e:
+        _print_error("cannot bake recording (" + type(e).__name__ + ": " + str(e) +")")
+
+
+def _get_anim_curve(plug):
+    """
+    Animation curve driving plug, created if there is none.
+    """
+    try:
+        return oma2.MFnAnimCurve(plug)
+    except Exception: # Plug is not animated yet
+        anim_curve = oma2.MFnAnimCurve()
+        anim_curve.create(plug)
+        return anim_curve
+
+
+################################################################################
+##########          CAPTURE
+################################################################################
+# A capture file starts with a header (magic, version) followed by records: arrival time in seconds since
+# the beginning of the capture, flags, payload size then the packet (zlib compressed if flags has
+# _CAPTURE_COMPRESSED). Its ".idx" side file has one entry per record: arrival time, record offset and kind.
+_CAPTURE_MAGIC = b"MKCAP"
+_CAPTURE_VERSION = 1
+_CAPTURE_HEADER = struct.Struct(str("<5sH"))
+_CAPTURE_RECORD = struct.Struct(str("<dBI"))
+_CAPTURE_INDEX_ENTRY = struct.Struct(str("<dQB"))
+_CAPTURE_COMPRESSED = 1
+_CAPTURE_KIND_JOINTS_STREAM = 0
+_CAPTURE_KIND_CONTROL = 1 # Hierarchy, JointsUuids...
+
+
+class StreamCapture(object):
+    """
+    Append-only writer of a capture file and its index.
+    Called from the thread reading the stream, close() may be called from another one.
+    """
+    def __init__(self, path, compress=False):
+        self.path = path
+        self.compress = compress
+        self.frames_count = 0
+        self._lock = threading.Lock()
+        self._start_time = None
+        self._data_file = io.open(path, "wb")
+        self._index_file = io.open(path + ".idx", "wb")
+        self._data_file.write(_CAPTURE_HEADER.pack(_CAPTURE_MAGIC, _CAPTURE_VERSION))
+        self._offset = _CAPTURE_HEADER.size
+
+    def write_frames(self, frames, timestamp):
+        with self._lock:
+            if self._data_file is None:
+                return
+            if self._start_time is None:
+                self._start_time = timestamp
+            timestamp -= self._start_time
+            for frame in frames:
+                kind = _CAPTURE_KIND_JOINTS_STREAM if _peek_packet_type(frame) == b"JointsStream" else _CAPTURE_KIND_CONTROL
+                flags = 0
+                if self.compress:
+                    frame = zlib.compress(bytes(frame), 1)
+                    flags |= _CAPTURE_COMPRESSED
+                self._data_file.write(_CAPTURE_RECORD.pack(timestamp, flags, len(frame)))
+                self._data_file.write(frame)
+                self._index_file.write(_CAPTURE_INDEX_ENTRY.pack(timestamp, self._offset, kind))
+                self._offset += _CAPTURE_RECORD.size + len(frame)
+                self.frames_count += 1
+
+    def close(self):
+        with self._lock:
+            if self._data_file is not None:
+                self._data_file.close()
+                self._index_file.close()
+                self._data_file = None
+                self._index_file = None
+
+
+class CaptureReader(object):
+    """
+    Random access to the packets of a capture file. Both the file and its index are memory mapped:
+    opening or seeking a long session does not read it.
+    """
+    def __init__(self, path):
+        self._data_file = io.open(path, "rb")
+        self._data = mmap.mmap(self._data_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = _CAPTURE_HEADER.unpack_from(self._data, 0)
+        if magic != _CAPTURE_MAGIC or version != _CAPTURE_VERSION:
+            self.close()
+            raise ValueError(path + " is not a capture file (version " + str(_CAPTURE_VERSION) + ")")
+
+        self._index_file = io.open(path + ".idx", "rb")
+        # A capture interrupted in the middle of an entry only loses that entry
+        self._count = os.fstat(self._index_file.fileno()).st_size // _CAPTURE_INDEX_ENTRY.size
+        self._index = mmap.mmap(self._index_file.fileno(), 0, access=mmap.ACCESS_READ) if self._count else b""
+        self.timestamps = _CaptureTimestamps(self)
+
+    def __len__(self):
+        return self._count
+
+    def entry(self, position):
+        """
+        Returns (timestamp, offset, kind) of the packet at position.
+        """
+        return _CAPTURE_INDEX_ENTRY.unpack_from(self._index, position * _CAPTURE_INDEX_ENTRY.size)
+
+    def packet(self, position):
+        offset = self.entry(position)[1]
+        _, flags, size = _CAPTURE_RECORD.unpack_from(self._data, offset)
+        start = offset + _CAPTURE_RECORD.size
+        payload = self._data[start:start + size]
+        if flags & _CAPTURE_COMPRESSED:
+            payload = zlib.decompress(payload)
+        return payload
+
+    def find(self, timestamp):
+        """
+        Position of the first packet received at or after timestamp.
+        """
+        return bisect.bisect_left(self.timestamps, timestamp)
+
+    def close(self):
+        if self._data is not None:
+            self._data.close()
+            self._data_file.close()
+            self._data = None
+        if getattr(self, "_index_file", None) is not None:
+            if self._count:
+                self._index.close()
+            self._index_file.close()
+            self._index_file = None
+
+
+class _CaptureTimestamps(object):
+    """
+    Read-only sequence of the packets timestamps, for bisect.
+    """
+    def __init__(self, reader):
+        self._reader = reader
+
+    def __len__(self):
+        return len(self._reader)
+
+    def __getitem__(self, position):
+        return self._reader.entry(position)[0]
+
+
+class CaptureReplay(object):
+    """
+    Feeds the packets of a CaptureReader to _process_frames(), following their timestamps scaled by speed.
+    """
+    def __init__(self, reader):
+        self.reader = reader
+        self.position = 0
+        self.speed = 1.0
+        self._clock_start = None # (wall clock, capture timestamp) when playing started
+
+    def set_speed(self, speed):
+        self.speed = speed
+        self._clock_start = None
+
+    def seek(self, timestamp):
+        """
+        Jump to timestamp. The last Hierarchy and JointsUuids received before it are processed first.
+        """
+        position = self.reader.find(timestamp)
+        controls = []
+        seen_types = set()
+        for previous in range(position - 1, -1, -1):
+            if self.reader.entry(previous)[2] == _CAPTURE_KIND_CONTROL:
+                packet = self.reader.packet(previous)
+                packet_type = _peek_packet_type(packet)
+                if packet_type not in seen_types:
+                    seen_types.add(packet_type)
+                    controls.append(packet)
+                    if b"Hierarchy" in seen_types and b"JointsUuids" in seen_types:
+                        break
+        _process_frames(controls[::-1])
+        self.position = position
+        self._clock_start = None
+
+    def process(self, count):
+        """
+        Process the next count packets, returns False at the end of the capture.
+        """
+        end = min(self.position + count, len(self.reader))
+        for position in range(self.position, end):
+            _process_frames([self.reader.packet(position)])
+        self.position = end
+        return self.position < len(self.reader)
+
+    def due_count(self):
+        """
+        Number of packets that should have been processed by now.
+        """
+        if self.position >= len(self.reader):
+            return 0
+        if self.speed is None:
+            return 1
+        now = time.time()
+        if self._clock_start is None:
+            self._clock_start = (now, self.reader.entry(self.position)[0])
+        clock_start, capture_start = self._clock_start
+        timestamp = capture_start + (now - clock_start) * self.speed
+        return bisect.bisect_right(self.reader.timestamps, timestamp, self.position) - self.position
+
+    def next_delay_ms(self):
+        """
+        Milliseconds until the next packet is due.
+        """
+        if self.speed is None or self._clock_start is None:
+            return 0
+        clock_start, capture_start = self._clock_start
+        next_time = clock_start + (self.reader.entry(self.position)[0] - capture_start) / self.speed
+        return max(0, int((next_time - time.time()) * 1000))
+
+
+class _ReplayConnection(object):
+    """
+    Stands for the connection during a replay: what would be sent to Mosketch is dropped.
+    """
+    def write(self, data):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        stop_replay()
+
+
+def _schedule_replay():
+    global REPLAY_TIMER
+
+    if REPLAY_TIMER is None:
+        REPLAY_TIMER = QtCore.QTimer()
+        REPLAY_TIMER.setSingleShot(True)
+        REPLAY_TIMER.timeout.connect(_replay_tick)
+    REPLAY_TIMER.stop()
+    if REPLAY is not None and REPLAY.speed != 0:
+        REPLAY_TIMER.start(0)
+
+
+def _replay_tick():
+    if REPLAY is None or REPLAY.speed == 0:
+        return
+    replay = REPLAY
+    due_count = replay.due_count()
+    if due_count > 0:
+        # Several packets due at once (faster than real time): only the newest JointsStream is applied
+        frames = [replay.reader.packet(position) for position in range(replay.position, replay.position + due_count)]
+        replay.position += due_count
+        _process_frames(frames)
+        _flush_outbound()
+    if REPLAY is None:
+        return # Stopped while processing
+    if REPLAY.position >= len(REPLAY.reader):
+        _print_success("replay finished")
+        stop_replay()
+        return
+    REPLAY_TIMER.start(REPLAY.next_delay_ms())
+
+
+################################################################################
+##########          LIVE UPDATE
+################################################################################
+class LiveUpdate(object):
+    """
+    Attribute changed callbacks on the Maya joints of a binding table, marking their bindings dirty
+    when their rotation or translation is set.
+    """
+    ATTRIBUTES = frozenset(["rotate", "rotateX", "rotateY", "rotateZ", "translate", "translateX", "translateY", "translateZ"])
+
+    def __init__(self):
+        self.binding_table = None
+        self.callback_ids = []
+        self.dirty = set() # Binding indices
+
+    def register(self, binding_table):
+        self.unregister()
+        self.binding_table = binding_table
+        for binding in binding_table.bindings:
+            node = om2.MGlobal.getSelectionListByName(binding.maya_node.longName()).getDependNode(0)
+            self.callback_ids.append(om2.MNodeMessage.addAttributeChangedCallback(node, self._attribute_changed, binding.index))
+
+    def unregister(self):
+        if self.callback_ids:
+            om2.MMessage.removeCallbacks(self.callback_ids)
+        self.callback_ids = []
+        self.binding_table = None
+        self.dirty.clear()
+
+    def _attribute_changed(self, message, plug, other_plug, binding_index):
+        if LIVE_UPDATE_APPLYING or not message & om2.MNodeMessage.kAttributeSet:
+            return
+        if plug.partialName(useLongNames=True) in self.ATTRIBUTES:
+            self.dirty.add(binding_index)
+
+    def take_dirty_bindings(self):
+        bindings = [self.binding_table.bindings[index] for index in sorted(self.dirty)]
+        self.dirty.clear()
+        return bindings
+
+
+def _live_update_tick():
+    live_update = LIVE_UPDATE
+    if live_update is None:
+        return
+    if live_update.binding_table is not JOINTS_BINDINGS:
+        # Not mapped yet, or mapped again: the callbacks follow the current joints
+        if JOINTS_BINDINGS is None:
+            live_update.unregister()
+        else:
+            live_update.register(JOINTS_BINDINGS)
+        return
+    if not live_update.dirty or CONNECTION is None:
+        return
+
+    # Sent right away: a pending pose upload would be replaced by the next one (see OutboundQueue)
+    _send_joints_stream(live_update.take_dirty_bindings())
+    _flush_outbound()
+
+
 ################################################################################
 ##########          SEND
 ################################################################################
+def _flush_outbound():
+    """
+    Write everything PROTOCOL queued since the last call in one write.
+    """
+    data = PROTOCOL.data_to_send()
+    if data is None or CONNECTION is None:
+        return
+    try:
+        write_start = _clock()
+        CONNECTION.write(data)
+        CONNECTION.flush()
+        _record_latency("ack", write_start)
+
+    except Exception as e:
+        _print_error("cannot send data (" + type(e).__name__ + ": " + str(e) +")")
+
+
 def _update_mosketch():
     '''
     Either we stream onto joints or controllers, we always send "final" joints orientation to Mosketch.
@@ -795,29 +3604,37 @@ def _update_mosketch():
     if CONNECTION is None:
         _print_error("Mosketch is not connected!")
         return
+    if JOINTS_BINDINGS is None:
+        _print_error("joints are not mapped yet")
+        return
 
     # Still split it into a function to make it explicit that we actually update Mosketch from actual Maya joints (and not cotnrollers)
     _update_mosketch_from_joints()
+    _flush_outbound()
 
 
 def _update_mosketch_from_joints():
+    _send_joints_stream(JOINTS_BINDINGS.bindings)
+
+
+def _send_joints_stream(bindings):
+    """
+    Queue a JointsStream of the current transforms of the given bindings' Maya joints.
+    """
     try:
         quat = pmc.datatypes.Quaternion()
-        joints_buffer_values = JOINTS_BUFFER.values()
         joints_stream = {}
         joints_stream[JSON_KEY_TYPE] = "JointsStream"
         joints_stream[JSON_KEY_JOINTS] = []
-        for maya_joint in joints_buffer_values:
+        for binding in bindings:
             joint_data = {}
-            joint_name = maya_joint.name()
+            maya_joint = binding.maya_node
 
-            joint_data[JSON_KEY_NAME] = joint_name
+            joint_data[JSON_KEY_NAME] = binding.name
 
             # W = [S] * [RO] * [R] * [JO] * [IS] * [T]
-            RO = JOINTS_ROTATE_AXIS_INV_BUFFER[joint_name].inverse()
-            JO = JOINTS_INIT_ORIENT_INV_BUFFER[joint_name].inverse()
             quat = maya_joint.getRotation(space='transform', quaternion=True)
-            quat = RO * quat * JO
+            quat = binding.rotate_axis * quat * binding.joint_orient
             joint_data[JSON_KEY_ROTATION] = [quat[0], quat[1], quat[2], quat[3]]
 
             translation = maya_joint.getTranslation(space='transform')
@@ -825,74 +3642,69 @@ def _update_mosketch_from_joints():
             translation *= 0.01
             joint_data[JSON_KEY_TRANSLATION] = [translation[0], translation[1], translation[2]]
             joints_stream[JSON_KEY_JOINTS].append(joint_data)
-        json_data = json.dumps(joints_stream)
-        CONNECTION.write(json_data)
-    except Exception, e:
+        PROTOCOL.send_joints_stream(joints_stream)
+    except Exception as e:
         _print_error("cannot send joint value (" + str(e) + ")")
 
 
-def _send_command_orientMode(orient_mode):
-    global CONNECTION
-    packet = {}
-    packet[JSON_KEY_TYPE] = PACKET_TYPE_COMMAND
-    packet[JSON_KEY_OBJECT] = 'scene'
-    packet[JSON_KEY_COMMAND] = 'setStreamingJointOrientMode'
-
-    jsonObj = {}
-    jsonObj['jointOrientMode'] = str(orient_mode)
-    packet[JSON_KEY_PARAMETERS] = jsonObj # we need parameters to be a json object
-
-    json_data = json.dumps([packet]) # [] specific for commands that could be buffered
-    CONNECTION.write(json_data)
-    CONNECTION.flush()
-    _print_verbose("_send_command_orientMode", 1)
-      
-
-def _send_command_jointSpace(space_mode):
-    global CONNECTION
-
-    packet = {}
-    packet[JSON_KEY_TYPE] = PACKET_TYPE_COMMAND
-    packet['object'] = 'scene'
-    packet['command'] = 'setStreamingJointSpace'
-
-    jsonObj = {}
-    jsonObj['jointSpace'] = str(space_mode)
-    packet[JSON_KEY_PARAMETERS] = jsonObj # we need parameters to be a json object
-
-    json_data = json.dumps([packet]) # [] specific for commands that could be buffered
-    CONNECTION.write(json_data)
-    CONNECTION.flush()
-    _print_verbose("_send_command_jointSpace", 1)
-
-
 ################################################################################
 ##########          HELPERS
 ################################################################################
 def _print_error(error):
-    error_msg = "ERROR: " + error
-    print error_msg
-    MAIN_WINDOW.log_text.setText(error_msg)
+    _log("ERROR: " + error)
 
 
 def _print_success(success):
-    success_msg = "SUCCESS: " + success
-    print success_msg
-    MAIN_WINDOW.log_text.setText(success_msg)
+    _log("SUCCESS: " + success)
+
+
+def _set_status(text, color):
+    """
+    Show the connection status in the window, if any (headless, the messages printed are enough).
+    """
+    if MAIN_WINDOW is None:
+        return
+    MAIN_WINDOW.status_text.setText(text)
+    MAIN_WINDOW.status_text.setStyleSheet("QLabel { background-color : " + color + ";color:white;font-weight: bold;}")
 
 
 def _print_encoding(string):
     if isinstance(string, str):
-        print "ordinary string"
-    elif isinstance(string, unicode):
-        print "unicode string"
+        print("ordinary string")
+    elif isinstance(string, type("")): # unicode in Python 2 (unicode_literals)
+        print("unicode string")
     else:
-        print "not a recognized string encoding"
+        print("not a recognized string encoding")
 
-def _print_verbose(msg, verbose_level):
-    global VERBOSE
+def _print_verbose(msg, verbose_level, *args):
+    """
+    msg is only formatted (msg % args) if verbose_level is enabled. In the stream processing
+    check VERBOSE before calling so that not even the arguments are built.
+    """
     if verbose_level <= VERBOSE:
-        print(msg)
+        _log(msg % args if args else "%s" % (msg,))
+
+
+def _log(message):
+    if MAIN_WINDOW is None:
+        print(message)
+    else:
+        LOG_QUEUE.append(message)
+
+
+def _flush_log():
+    """
+    Print the queued messages and append them to the log panel, at most every LOG_REFRESH_MS.
+    """
+    if not LOG_QUEUE:
+        return
+    messages = []
+    while LOG_QUEUE:
+        messages.append(LOG_QUEUE.popleft())
+    text = "\n".join(messages)
+    print(text)
+    if MAIN_WINDOW is not None:
+        MAIN_WINDOW.log_text.appendPlainText(text)
 
 
 def _quat_as_euler_angles(quat):
@@ -906,7 +3718,39 @@ def _quat_as_euler_angles(quat):
 
 def _print_quat_as_euler_angles(name, quat):
     vec = _quat_as_euler_angles(quat)
-    print name + '= ' + str(vec[0]) + ' ' + str(vec[1]) + ' ' + str(vec[2])
+    print(name + '= ' + str(vec[0]) + ' ' + str(vec[1]) + ' ' + str(vec[2]))
+
+
+def _quat_as_tuple(quat):
+    return (quat[0], quat[1], quat[2], quat[3])
+
+
+def _quat_mul(a, b):
+    """
+    Product of (x, y, z, w) tuples, same convention as pmc.datatypes.Quaternion: a * b
+    """
+    ax, ay, az, aw = a
+    bx, by, bz, bw = b
+    return (bw * ax + bx * aw + by * az - bz * ay,
+            bw * ay - bx * az + by * aw + bz * ax,
+            bw * az + bx * ay - by * ax + bz * aw,
+            bw * aw - bx * ax - by * ay - bz * az)
+
+
+def _quat_rotate_vector(vec, quat):
+    """
+    Same as pmc.datatypes.Vector(vec).rotateBy(quat) on tuples
+    """
+    qx, qy, qz, qw = quat
+    vx, vy, vz = vec
+    # t = 2 * cross(q.xyz, v)
+    tx = 2.0 * (qy * vz - qz * vy)
+    ty = 2.0 * (qz * vx - qx * vz)
+    tz = 2.0 * (qx * vy - qy * vx)
+    # v + w * t + cross(q.xyz, t)
+    return (vx + qw * tx + qy * tz - qz * ty,
+            vy + qw * ty + qz * tx - qx * tz,
+            vz + qw * tz + qx * ty - qy * tx)
 
 
 def _is_valid_ipv4_address(address):
@@ -0,0 +1,85 @@
+# coding: utf-8
+"""
+Unit tests of the capture files of mosketch_for_maya: what StreamCapture writes, CaptureReader reads back.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tools"))
+import maya_mocks
+maya_mocks.install()
+import mosketch_for_maya
+
+mosketch_for_maya.VERBOSE = 0
+
+HIERARCHY = b'{"Type": "Hierarchy", "Joints": ["Hips", "Spine"]}'
+JOINTS_STREAM = b'{"Type": "JointsStream", "Seq": %d, "Joints": []}'
+
+
+class CaptureTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "session.mkcap")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _write_session(self, compress):
+        capture = mosketch_for_maya.StreamCapture(self.path, compress)
+        capture.write_frames([HIERARCHY], 100.0)
+        capture.write_frames([JOINTS_STREAM % 1, JOINTS_STREAM % 2], 100.5)
+        capture.write_frames([JOINTS_STREAM % 3], 101.25)
+        capture.close()
+        capture.write_frames([JOINTS_STREAM % 4], 102.0) # Ignored once closed
+        self.assertEqual(capture.frames_count, 4)
+
+    def _check_session(self):
+        reader = mosketch_for_maya.CaptureReader(self.path)
+        try:
+            self.assertEqual(len(reader), 4)
+            self.assertEqual([reader.packet(position) for position in range(4)],
+                             [HIERARCHY, JOINTS_STREAM % 1, JOINTS_STREAM % 2, JOINTS_STREAM % 3])
+            self.assertEqual([reader.entry(position)[0] for position in range(4)], [0.0, 0.5, 0.5, 1.25])
+            self.assertEqual([reader.entry(position)[2] for position in range(4)],
+                             [mosketch_for_maya._CAPTURE_KIND_CONTROL] + [mosketch_for_maya._CAPTURE_KIND_JOINTS_STREAM] * 3)
+            self.assertEqual(reader.find(0.0), 0)
+            self.assertEqual(reader.find(0.25), 1)
+            self.assertEqual(reader.find(1.0), 3)
+            self.assertEqual(reader.find(2.0), 4)
+        finally:
+            reader.close()
+
+    def test_round_trip(self):
+        self._write_session(compress=False)
+        self._check_session()
+
+    def test_compressed_round_trip(self):
+        self._write_session(compress=True)
+        self._check_session()
+
+    def test_interrupted_index_entry(self):
+        self._write_session(compress=False)
+        with open(self.path + ".idx", "ab") as index_file:
+            index_file.write(b"\0" * 5)
+        self._check_session()
+
+    def test_empty_capture(self):
+        mosketch_for_maya.StreamCapture(self.path).close()
+        reader = mosketch_for_maya.CaptureReader(self.path)
+        try:
+            self.assertEqual(len(reader), 0)
+            self.assertEqual(reader.find(1.0), 0)
+        finally:
+            reader.close()
+
+    def test_not_a_capture(self):
+        with open(self.path, "wb") as data_file:
+            data_file.write(b"NOTACAPTURE")
+        self.assertRaises(ValueError, mosketch_for_maya.CaptureReader, self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
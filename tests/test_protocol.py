@@ -0,0 +1,229 @@
+# coding: utf-8
+"""
+Unit tests of the Sans-IO side of mosketch_for_maya: FrameDecoder, MosketchProtocol and FlowControl.
+Maya is mocked (see tools/maya_mocks.py):
+    python -m pytest -q tests
+    python -m unittest discover tests   # Python 2.7 or mayapy
+"""
+import json
+import os
+import struct
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tools"))
+import maya_mocks
+maya_mocks.install()
+import mosketch_for_maya
+
+mosketch_for_maya.VERBOSE = 0
+
+JOINTS_NAMES = ["Hips", "Spine", "Head"]
+
+
+def _json_frame(packet):
+    return json.dumps(packet).encode("utf-8")
+
+
+def _joints_stream(sequence):
+    return _json_frame({"Type": "JointsStream", "Seq": sequence, "Joints": [
+        {"Name": name, "R": [0.0, 0.0, 0.0, 1.0], "T": [0.0, 0.0, 0.0]} for name in JOINTS_NAMES]})
+
+
+def _binary_joints_stream(sequence, joints_count=len(JOINTS_NAMES)):
+    frame = mosketch_for_maya._BINARY_HEADER.pack(mosketch_for_maya.BINARY_STREAM_MAGIC,
+                                                  mosketch_for_maya.BINARY_STREAM_VERSION, joints_count, sequence)
+    frame += struct.pack(str("<%df") % (4 * joints_count), *([0.0, 0.0, 0.0, 1.0] * joints_count))
+    frame += struct.pack(str("<%df") % (3 * joints_count), *range(3 * joints_count))
+    frame += struct.pack(str("<%dB") % joints_count, *([0] * joints_count))
+    return frame
+
+
+def _sent_packets(protocol):
+    """
+    What the protocol queued for Mosketch, as decoded Json documents (commands are lists of one packet).
+    """
+    data = protocol.data_to_send()
+    if data is None:
+        return []
+    return [json.loads(frame.decode("utf-8")) for frame in mosketch_for_maya.FrameDecoder().feed(data)]
+
+
+def _sent_types(protocol):
+    """
+    Type of each packet queued for Mosketch, the command for commands.
+    """
+    types = []
+    for packet in _sent_packets(protocol):
+        if isinstance(packet, list):
+            packet = packet[0]
+        types.append(packet.get("command", packet["Type"]))
+    return types
+
+
+class FrameDecoderTest(unittest.TestCase):
+    def test_documents_of_one_read(self):
+        decoder = mosketch_for_maya.FrameDecoder()
+        frames = decoder.feed(b'{"Type": "A"}[{"Type": "B"}]  {"Type": "C"}')
+        self.assertEqual(frames, [b'{"Type": "A"}', b'[{"Type": "B"}]', b'{"Type": "C"}'])
+        self.assertEqual(decoder.frames_decoded, 3)
+        self.assertEqual(decoder.bytes_buffered, 0)
+
+    def test_document_split_over_reads(self):
+        decoder = mosketch_for_maya.FrameDecoder()
+        data = _joints_stream(1) + _joints_stream(2)
+        frames = []
+        for index in range(len(data)):
+            frames += decoder.feed(data[index:index + 1])
+        self.assertEqual(frames, [_joints_stream(1), _joints_stream(2)])
+        self.assertGreater(decoder.partial_reads, 0)
+        self.assertEqual(decoder.bytes_buffered, 0)
+
+    def test_brackets_and_escapes_in_strings(self):
+        decoder = mosketch_for_maya.FrameDecoder()
+        document = b'{"Name": "a}]\\"{b", "Other": "\\\\"}'
+        self.assertEqual(decoder.feed(document[:15]), [])
+        self.assertEqual(decoder.feed(document[15:] + b'{}'), [document, b'{}'])
+
+    def test_binary_frame_split_over_reads(self):
+        decoder = mosketch_for_maya.FrameDecoder()
+        frame = _binary_joints_stream(7)
+        self.assertEqual(decoder.feed(frame[:2]), [])
+        self.assertEqual(decoder.feed(frame[2:20]), [])
+        self.assertEqual(decoder.feed(frame[20:] + b'{"Type": "A"}'), [frame, b'{"Type": "A"}'])
+
+    def test_reset_drops_partial_frame(self):
+        decoder = mosketch_for_maya.FrameDecoder()
+        decoder.feed(b'{"Type": "A", "Joints": [')
+        decoder.reset()
+        self.assertEqual(decoder.bytes_buffered, 0)
+        self.assertEqual(decoder.feed(b'{"Type": "B"}'), [b'{"Type": "B"}'])
+
+
+class MosketchProtocolTest(unittest.TestCase):
+    def _streaming_protocol(self, binary=False, windowed_acks=False, coalesce=True):
+        protocol = mosketch_for_maya.MosketchProtocol(binary, windowed_acks, coalesce)
+        protocol.receive_data(_json_frame({"Type": "Hierarchy", "Joints": JOINTS_NAMES}))
+        protocol.hierarchy_mapped("Joints")
+        protocol.receive_data(_json_frame({"Type": "JointsUuids", "Joints": [{name: "{uuid}"} for name in JOINTS_NAMES]}))
+        protocol.joints_uuids_stored()
+        protocol.data_to_send()
+        return protocol
+
+    def test_handshake(self):
+        protocol = mosketch_for_maya.MosketchProtocol(binary=True, windowed_acks=True, coalesce=True)
+        self.assertEqual(protocol.state, protocol.STATE_WAITING_HIERARCHY)
+
+        events = protocol.receive_data(_json_frame({"Type": "Hierarchy", "Joints": JOINTS_NAMES}))
+        self.assertEqual([event[0] for event in events], ["hierarchy"])
+        self.assertEqual(events[0][1]["Joints"], JOINTS_NAMES)
+        self.assertEqual(protocol.state, protocol.STATE_MAPPING_HIERARCHY)
+        self.assertIsNone(protocol.data_to_send())
+
+        protocol.hierarchy_mapped("Joints")
+        self.assertEqual(protocol.state, protocol.STATE_WAITING_JOINTS_UUIDS)
+        self.assertEqual(_sent_types(protocol), ["setStreamingJointOrientMode", "setStreamingJointSpace",
+                                                 "HierarchyInitializedAck"])
+
+        events = protocol.receive_data(_json_frame({"Type": "JointsUuids", "Joints": [{name: "{uuid}"} for name in JOINTS_NAMES]}))
+        self.assertEqual([event[0] for event in events], ["joints_uuids"])
+        self.assertEqual(protocol.joints_uuids_order, JOINTS_NAMES)
+        self.assertEqual(protocol.state, protocol.STATE_STORING_JOINTS_UUIDS)
+
+        protocol.joints_uuids_stored()
+        self.assertEqual(protocol.state, protocol.STATE_STREAMING)
+        self.assertEqual(_sent_types(protocol), ["setStreamingFormat", "setStreamingAckMode", "JointsUuidsAck"])
+
+        events = protocol.receive_data(_json_frame({"Type": "JointsStreamAckMode", "Mode": "windowed"}))
+        self.assertEqual(events, [("ack_mode", True)])
+        self.assertTrue(protocol.flow_control.enabled)
+
+    def test_hierarchy_restarts_handshake(self):
+        protocol = self._streaming_protocol()
+        protocol.receive_data(_json_frame({"Type": "Hierarchy", "Joints": JOINTS_NAMES}))
+        self.assertEqual(protocol.state, protocol.STATE_MAPPING_HIERARCHY)
+
+    def test_binary_joints_stream(self):
+        protocol = self._streaming_protocol(binary=True)
+        events = protocol.receive_data(_binary_joints_stream(42))
+        self.assertEqual(len(events), 1)
+        event, joints_stream = events[0]
+        self.assertEqual(event, "joints_stream")
+        self.assertEqual(joints_stream.sequence, 42)
+        self.assertEqual(joints_stream.names, JOINTS_NAMES)
+        self.assertEqual(tuple(joints_stream.translations), tuple(float(value) for value in range(9)))
+
+    def test_malformed_binary_joints_stream(self):
+        protocol = self._streaming_protocol(binary=True)
+        events = protocol.receive_data(_binary_joints_stream(1, joints_count=2))
+        self.assertEqual([event[0] for event in events], ["error"])
+
+    def test_invalid_json(self):
+        protocol = self._streaming_protocol()
+        events = protocol.receive_data(b'{"Type": }')
+        self.assertEqual([event[0] for event in events], ["invalid"])
+
+    def test_coalescing_keeps_newest_joints_stream(self):
+        protocol = self._streaming_protocol()
+        events = protocol.receive_data(_joints_stream(1) + _joints_stream(2) + _joints_stream(3))
+        self.assertEqual([event[0] for event in events], ["dropped", "joints_stream"])
+        self.assertEqual(events[0][1], 2)
+        self.assertEqual(events[1][1]["Seq"], 3)
+        # Dropped JointsStreams are acknowledged right away, the newest one once applied
+        self.assertEqual(_sent_types(protocol), ["JointsStreamAck", "JointsStreamAck"])
+        protocol.joints_stream_applied(events[1][1])
+        self.assertEqual(_sent_types(protocol), ["JointsStreamAck"])
+
+    def test_coalescing_keeps_other_packets_in_order(self):
+        protocol = self._streaming_protocol()
+        events = protocol.receive_data(_joints_stream(1) + _json_frame({"Type": "Hierarchy", "Joints": JOINTS_NAMES})
+                                       + _joints_stream(2))
+        self.assertEqual([event[0] for event in events], ["dropped", "hierarchy", "joints_stream"])
+
+    def test_no_coalescing(self):
+        protocol = self._streaming_protocol(coalesce=False)
+        events = protocol.receive_data(_joints_stream(1) + _joints_stream(2))
+        self.assertEqual([event[0] for event in events], ["joints_stream", "joints_stream"])
+        self.assertIsNone(protocol.data_to_send())
+
+
+class FlowControlTest(unittest.TestCase):
+    def test_window_grows_while_frames_are_fast(self):
+        flow_control = mosketch_for_maya.FlowControl()
+        for sequence in range(1, mosketch_for_maya.ACK_WINDOW_MAX + 5):
+            flow_control.frame_applied(sequence, 0.001)
+            packet = flow_control.ack_packet()
+            self.assertEqual(packet["Seq"], sequence)
+            self.assertEqual(packet["Window"], min(sequence + 1, mosketch_for_maya.ACK_WINDOW_MAX))
+        self.assertFalse(flow_control.ack_pending)
+
+    def test_window_halves_when_frames_are_slow(self):
+        flow_control = mosketch_for_maya.FlowControl()
+        flow_control.window = 8
+        flow_control.frame_applied(1, 2.0 * mosketch_for_maya.ACK_FRAME_BUDGET_MS / 1000.0)
+        self.assertEqual(flow_control.ack_packet()["Window"], 4)
+        self.assertEqual(flow_control.ack_packet()["Window"], 2)
+        self.assertEqual(flow_control.ack_packet()["Window"], 1)
+        self.assertEqual(flow_control.ack_packet()["Window"], 1)
+
+    def test_one_windowed_ack_per_read(self):
+        protocol = mosketch_for_maya.MosketchProtocol(binary=False, windowed_acks=True, coalesce=False)
+        protocol.flow_control.enabled = True
+        for sequence in (5, 6, 7):
+            protocol.joints_stream_applied({"Type": "JointsStream", "Seq": sequence}, 0.001)
+        packets = _sent_packets(protocol)
+        self.assertEqual(len(packets), 1)
+        self.assertEqual(packets[0]["Type"], "JointsStreamAck")
+        self.assertEqual(packets[0]["Seq"], 7)
+        self.assertIsNone(protocol.data_to_send())
+
+    def test_joints_streams_without_sequence_are_acknowledged_one_by_one(self):
+        protocol = mosketch_for_maya.MosketchProtocol(binary=False, windowed_acks=True, coalesce=False)
+        protocol.flow_control.enabled = True
+        protocol.joints_stream_applied({"Type": "JointsStream"})
+        protocol.joints_stream_applied({"Type": "JointsStream"})
+        self.assertEqual(_sent_packets(protocol), [{"Type": "JointsStreamAck"}] * 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,239 @@
+# coding: utf-8
+"""
+End to end cost of mosketch_for_maya's receive path (socket read, decoding, mapping, retarget, scene writes
+on mocked joints, acknowledgements) against tools/fake_mosketch.py running in its own process.
+
+For each joints count it reports the JointsStreams processed per second, the latency between a JointsStream
+being sent and its acknowledgement being received (percentiles in milliseconds) and the CPU time spent by
+this process per frame.
+
+Usage (with mayapy or a Python 2.7 interpreter, Maya is mocked):
+    python tools/bench_end_to_end.py                             # 20 to 5000 joints, Json and binary
+    python tools/bench_end_to_end.py --joints 150 --fps 60 --frames 600
+    python tools/bench_end_to_end.py --thread                    # Read the stream in the network thread
+    python3 tools/bench_end_to_end.py --asyncio                  # Read the stream with mosketch_asyncio
+    python tools/bench_end_to_end.py --headless                  # Read the stream with run_headless()
+    python tools/bench_end_to_end.py --capture session.mkcap     # Recorded traffic instead of a synthetic skeleton
+    python tools/bench_end_to_end.py --shared-memory --fps 60    # Binary poses through the shared memory
+With --shared-memory nothing is acknowledged: there are no latencies, and as fast as possible (--fps 0) most
+poses are written over before being read.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import select
+import socket
+import subprocess
+import sys
+import time
+
+import fake_mosketch
+import maya_mocks
+maya_mocks.install()
+import mosketch_for_maya
+
+FAKE_MOSKETCH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_mosketch.py")
+
+
+class _ReceivedData(object):
+    """
+    What QTcpSocket.readAll() returns (a QByteArray).
+    """
+    def __init__(self, data):
+        self._data = data
+
+    def isEmpty(self):
+        return not self._data
+
+    def data(self):
+        return self._data
+
+
+class SocketConnection(object):
+    """
+    Plain socket behaving like the QTcpSocket used by mosketch_for_maya.
+    """
+    def __init__(self, ip, port):
+        self.socket = socket.create_connection((ip, port), 5.0)
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.closed = False
+
+    def readAll(self):
+        data = self.socket.recv(1 << 20)
+        if not data:
+            self.closed = True
+        return _ReceivedData(data)
+
+    def write(self, data):
+        if not isinstance(data, bytes):
+            data = data.encode("utf-8")
+        self.socket.sendall(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.socket.close()
+
+
+def free_port():
+    probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    probe.bind(("127.0.0.1", 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    return port
+
+
+def start_fake_mosketch(joints_count, fps, frames, port, capture=None):
+    command = [sys.executable, FAKE_MOSKETCH, "--joints", str(joints_count), "--fps", str(fps),
+               "--frames", str(frames), "--port", str(port), "--once", "--quiet"]
+    if capture is not None:
+        command += ["--capture", capture]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, universal_newlines=True)
+    process.stdout.readline() # Listening
+    return process
+
+
+def receive_qt_like(port):
+    """
+    Same as the QTcpSocket path: _got_data() each time the socket is readable.
+    """
+    mosketch_for_maya.IP = "127.0.0.1"
+    mosketch_for_maya.PORT = port
+    mosketch_for_maya.PROTOCOL = mosketch_for_maya.MosketchProtocol()
+    connection = SocketConnection("127.0.0.1", port)
+    mosketch_for_maya.CONNECTION = connection
+    while not connection.closed:
+        shared_memory = mosketch_for_maya.SHARED_MEMORY is not None
+        if shared_memory:
+            mosketch_for_maya._shared_memory_tick() # What the shared memory timer does
+        scheduled = len(mosketch_for_maya.SCHEDULER) > 0
+        timeout = 0.0 if scheduled else mosketch_for_maya.SHARED_MEMORY_POLL_MS / 1000.0 if shared_memory else 5.0
+        if select.select([connection.socket], [], [], timeout)[0]:
+            mosketch_for_maya._got_data()
+        elif scheduled:
+            mosketch_for_maya._scheduler_tick() # What Maya's event loop does between reads
+        elif not shared_memory:
+            break
+    connection.close()
+    mosketch_for_maya._close_shared_memory()
+    mosketch_for_maya.CONNECTION = None
+
+
+def receive_network_thread(port, process):
+    """
+    Network thread path: the main thread only consumes what the thread decoded.
+    """
+    mosketch_for_maya.IP = "127.0.0.1"
+    mosketch_for_maya.PORT = port
+    mosketch_for_maya.PROTOCOL = mosketch_for_maya.MosketchProtocol()
+    mosketch_for_maya._start_network_thread()
+    while process.poll() is None and mosketch_for_maya.NETWORK_THREAD is not None:
+        mosketch_for_maya._consume_network_thread()
+        mosketch_for_maya._shared_memory_tick()
+        time.sleep(mosketch_for_maya.NETWORK_THREAD_POLL_MS / 1000.0)
+    if mosketch_for_maya.NETWORK_THREAD is not None:
+        mosketch_for_maya._stop_network_thread()
+    mosketch_for_maya._close_shared_memory()
+    mosketch_for_maya.CONNECTION = None
+
+
+def receive_asyncio(port):
+    """
+    mosketch_asyncio client: reader, processor and writer coroutines (Python 3 only).
+    """
+    import asyncio
+    import mosketch_asyncio
+    mosketch_for_maya.IP = "127.0.0.1"
+    mosketch_for_maya.PORT = port
+    asyncio.run(mosketch_asyncio.run_client("127.0.0.1", port))
+
+
+def receive_headless(port):
+    """
+    run_headless(): blocking socket, no window.
+    """
+    main_window = mosketch_for_maya.MAIN_WINDOW
+    mosketch_for_maya.MAIN_WINDOW = None
+    try:
+        mosketch_for_maya.run_headless("127.0.0.1", port)
+    finally:
+        mosketch_for_maya.MAIN_WINDOW = main_window
+
+
+def percentile(sorted_values, ratio):
+    if not sorted_values:
+        return float("nan")
+    return sorted_values[min(len(sorted_values) - 1, int(ratio * len(sorted_values)))]
+
+
+def run(joints_count, binary, args):
+    if args.capture:
+        joints_count = len(maya_mocks.create_named_skeleton(fake_mosketch.RecordedSession(args.capture).hierarchy["Joints"]))
+    else:
+        maya_mocks.create_skeleton(joints_count)
+    mosketch_for_maya.BINARY_JOINTS_STREAM = binary
+    mosketch_for_maya.SHARED_MEMORY_MODE = args.shared_memory
+    mosketch_for_maya.clear_mapping_cache()
+    mosketch_for_maya._reset_stream_stats()
+
+    port = free_port()
+    process = start_fake_mosketch(joints_count, args.fps, args.frames, port, args.capture)
+    cpu_start = sum(os.times()[:2])
+    wall_start = time.time()
+    if args.thread:
+        receive_network_thread(port, process)
+    elif args.asyncio:
+        receive_asyncio(port)
+    elif args.headless:
+        receive_headless(port)
+    else:
+        receive_qt_like(port)
+    wall_time = time.time() - wall_start
+    cpu_time = sum(os.times()[:2]) - cpu_start
+
+    output = process.communicate()[0].strip().splitlines()
+    summary = json.loads(output[-1]) if output else {"frames_sent": 0, "latencies": []}
+    latencies = sorted(latency * 1000.0 for latency in summary["latencies"])
+    stats = mosketch_for_maya.get_stream_stats()
+    applied = stats["joints_stream_applied"]
+    print("%8d %8s %10.1f %8d %8d %8.2f %8.2f %8.2f %12.1f" % (
+        joints_count, "capture" if args.capture else "binary" if binary else "json", applied / wall_time, applied, stats["joints_stream_dropped"],
+        percentile(latencies, 0.5), percentile(latencies, 0.95), percentile(latencies, 0.99),
+        cpu_time / max(applied, 1) * 1e6))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--joints", type=int, nargs="+", default=[20, 150, 500, 1000, 5000])
+    parser.add_argument("--frames", type=int, default=300, help="JointsStreams per measure")
+    parser.add_argument("--fps", type=float, default=0.0, help="frame rate of the fake Mosketch, 0 for as fast as possible")
+    parser.add_argument("--format", choices=["json", "binary", "both"], default="both")
+    transport = parser.add_mutually_exclusive_group()
+    transport.add_argument("--thread", action="store_true", help="read the stream in the network thread")
+    transport.add_argument("--asyncio", action="store_true", help="read the stream with mosketch_asyncio (Python 3)")
+    transport.add_argument("--headless", action="store_true", help="read the stream with run_headless()")
+    parser.add_argument("--capture", help="stream the packets of this capture file, in its recorded format")
+    parser.add_argument("--shared-memory", action="store_true", help="ask for the shared memory transport (binary only)")
+    args = parser.parse_args()
+
+    # Only errors are printed
+    mosketch_for_maya.VERBOSE = 0
+    mosketch_for_maya._print_success = lambda success: None
+    mosketch_for_maya.MAIN_WINDOW = maya_mocks._Anything()
+
+    formats = {"json": [False], "binary": [True], "both": [False, True]}[args.format]
+    if args.capture:
+        args.joints = [0] # Given by the capture
+        formats = formats[-1:]
+    print("%8s %8s %10s %8s %8s %8s %8s %8s %12s" % ("joints", "format", "frames/s", "applied", "dropped",
+                                                    "p50 ms", "p95 ms", "p99 ms", "cpu us/frame"))
+    for joints_count in args.joints:
+        for binary in formats:
+            run(joints_count, binary, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# coding: utf-8
+"""
+Packets per second of each available Json backend (see mosketch_for_maya.JSON_BACKENDS)
+on JointsStream payloads.
+
+Usage (with mayapy or a Python 2.7 interpreter, Maya is mocked):
+    python tools/bench_json_backends.py                  # Synthetic JointsStreams of 150 joints
+    python tools/bench_json_backends.py --joints 500
+    python tools/bench_json_backends.py --payloads dump  # JointsStreams recorded from a raw socket dump
+"""
+from __future__ import print_function
+
+import argparse
+import io
+import json
+import random
+import timeit
+
+import maya_mocks
+maya_mocks.install()
+import mosketch_for_maya
+
+
+def synthetic_joints_stream(joints_count):
+    joints = []
+    for index in range(joints_count):
+        joints.append({
+            "Name": "joint_" + str(index),
+            "R": [random.uniform(-1.0, 1.0) for _ in range(4)],
+            "T": [random.uniform(-1.0, 1.0) for _ in range(3)],
+            "Anatom": 7 if index == 0 else 1,
+        })
+    return json.dumps({"Type": "JointsStream", "Joints": joints}).encode("utf-8")
+
+
+def recorded_joints_streams(path):
+    decoder = mosketch_for_maya.FrameDecoder()
+    with io.open(path, "rb") as dump_file:
+        frames = decoder.feed(dump_file.read())
+    return [frame for frame in frames if mosketch_for_maya._peek_packet_type(frame) == b"JointsStream"
+            and not frame.startswith(mosketch_for_maya.BINARY_STREAM_MAGIC)]
+
+
+def bench(payloads, repeat):
+    results = []
+    for backend_name in mosketch_for_maya.JSON_BACKENDS:
+        try:
+            mosketch_for_maya.set_json_backend(backend_name)
+        except ImportError:
+            print("%-12s not available" % backend_name)
+            continue
+        loads = mosketch_for_maya._json_loads
+        dumps = mosketch_for_maya._json_dumps
+        decoded = [loads(payload) for payload in payloads]
+
+        loads_time = min(timeit.repeat(lambda: [loads(payload) for payload in payloads], number=1, repeat=repeat))
+        dumps_time = min(timeit.repeat(lambda: [dumps(data) for data in decoded], number=1, repeat=repeat))
+        results.append((backend_name, len(payloads) / loads_time, len(payloads) / dumps_time))
+        print("%-12s loads: %10.0f packets/s   dumps: %10.0f packets/s" % results[-1])
+    mosketch_for_maya.set_json_backend()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--joints", type=int, default=150, help="joints per synthetic JointsStream")
+    parser.add_argument("--packets", type=int, default=500, help="number of synthetic JointsStreams")
+    parser.add_argument("--payloads", help="raw Mosketch stream dump to take JointsStreams from")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.payloads:
+        payloads = recorded_joints_streams(args.payloads)
+        if not payloads:
+            parser.error("no Json JointsStream found in " + args.payloads)
+    else:
+        payloads = [synthetic_joints_stream(args.joints) for _ in range(args.packets)]
+
+    print("%d JointsStreams, %d bytes on average" % (len(payloads), sum(len(payload) for payload in payloads) // len(payloads)))
+    bench(payloads, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
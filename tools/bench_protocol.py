@@ -0,0 +1,94 @@
+# coding: utf-8
+"""
+Throughput of mosketch_for_maya.MosketchProtocol alone: no socket and no scene, the bytes of a whole session
+(Hierarchy, JointsUuids then JointsStreams) are fed in reads of a given size and every event is acted on
+the way the plugin does, without touching Maya.
+
+It reports the megabytes and JointsStreams decoded per second, and the bytes sent back.
+
+Usage (with mayapy or a Python 2.7 interpreter, Maya is mocked):
+    python tools/bench_protocol.py                           # 20 to 1000 joints, Json and binary
+    python tools/bench_protocol.py --joints 150 --frames 2000 --read-size 1460
+    python tools/bench_protocol.py --no-coalesce             # Deliver every JointsStream
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import random
+import struct
+import time
+
+import maya_mocks
+maya_mocks.install()
+import mosketch_for_maya
+
+
+def session_bytes(joints_count, frames_count, binary):
+    names = ["joint_" + str(index) for index in range(joints_count)]
+    data = json.dumps({"Type": "Hierarchy", "Joints": names}).encode("utf-8")
+    data += json.dumps({"Type": "JointsUuids", "Joints": [{name: str(index)} for index, name in enumerate(names)]}).encode("utf-8")
+    rotations = [[random.uniform(-1.0, 1.0) for _ in range(4)] for _ in names]
+    translations = [[random.uniform(-1.0, 1.0) for _ in range(3)] for _ in names]
+    anatomic_types = [7 if index == 0 else 1 for index in range(joints_count)]
+    frames = []
+    for sequence in range(frames_count):
+        if binary:
+            frame = struct.pack(str("<4sHHI"), mosketch_for_maya.BINARY_STREAM_MAGIC, mosketch_for_maya.BINARY_STREAM_VERSION,
+                                joints_count, sequence)
+            frame += struct.pack(str("<%df") % (4 * joints_count), *[value for rotation in rotations for value in rotation])
+            frame += struct.pack(str("<%df") % (3 * joints_count), *[value for translation in translations for value in translation])
+            frame += struct.pack(str("<%dB") % joints_count, *anatomic_types)
+        else:
+            frame = json.dumps({"Type": "JointsStream", "Seq": sequence, "Joints": [
+                {"Name": name, "R": rotation, "T": translation, "Anatom": anatomic_type}
+                for name, rotation, translation, anatomic_type in zip(names, rotations, translations, anatomic_types)]}).encode("utf-8")
+        frames.append(frame)
+    return data + b"".join(frames)
+
+
+def run(data, binary, args):
+    protocol = mosketch_for_maya.MosketchProtocol(binary=binary, windowed_acks=False, coalesce=not args.no_coalesce)
+    streams = 0
+    sent = 0
+    start = time.time()
+    for offset in range(0, len(data), args.read_size):
+        for event, payload in protocol.receive_data(data[offset:offset + args.read_size]):
+            if event == "joints_stream":
+                streams += 1
+                protocol.joints_stream_applied(payload)
+            elif event == "hierarchy":
+                protocol.hierarchy_mapped("Joints")
+            elif event == "joints_uuids":
+                protocol.joints_uuids_stored()
+            elif event in ("invalid", "error"):
+                raise RuntimeError(payload)
+        outbound = protocol.data_to_send()
+        if outbound is not None:
+            sent += len(outbound)
+    elapsed = time.time() - start
+    return len(data) / elapsed / 1e6, streams / elapsed, streams, sent
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--joints", type=int, nargs="+", default=[20, 150, 500, 1000])
+    parser.add_argument("--frames", type=int, default=1000, help="JointsStreams per session")
+    parser.add_argument("--read-size", type=int, default=65536, help="bytes per read")
+    parser.add_argument("--format", choices=["json", "binary", "both"], default="both")
+    parser.add_argument("--no-coalesce", action="store_true", help="deliver every JointsStream")
+    args = parser.parse_args()
+
+    mosketch_for_maya.VERBOSE = 0
+    mosketch_for_maya.LATENCY_STATS = False
+
+    formats = {"json": [False], "binary": [True], "both": [False, True]}[args.format]
+    print("%8s %8s %10s %12s %10s %12s" % ("joints", "format", "MB/s", "streams/s", "delivered", "bytes sent"))
+    for joints_count in args.joints:
+        for binary in formats:
+            data = session_bytes(joints_count, args.frames, binary)
+            print("%8d %8s %10.1f %12.0f %10d %12d" % ((joints_count, "binary" if binary else "json") + run(data, binary, args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# coding: utf-8
+"""
+Per frame cost of the retarget maths (see mosketch_for_maya.RETARGET_BACKENDS) versus joints count,
+on Json and binary JointsStreams. Scene writes are not included.
+
+Usage:
+    python tools/bench_retarget.py                       # Maya is mocked, pymel backend is skipped
+    python tools/bench_retarget.py --joints 20 150 1000
+    mayapy tools/bench_retarget.py --mayapy              # Real pymel datatypes, all backends
+"""
+from __future__ import print_function
+
+import argparse
+import random
+import struct
+import sys
+import timeit
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--joints", type=int, nargs="+", default=[20, 50, 150, 500, 1000, 5000])
+parser.add_argument("--frames", type=int, default=20, help="frames timed per measure")
+parser.add_argument("--mayapy", action="store_true", help="use Maya's pymel instead of mocks")
+ARGS = parser.parse_args()
+
+if ARGS.mayapy:
+    import maya.standalone
+    maya.standalone.initialize()
+    import os
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+else:
+    import maya_mocks
+    maya_mocks.install()
+import mosketch_for_maya
+import pymel.core as pmc
+
+
+def random_quaternion():
+    values = [random.gauss(0.0, 1.0) for _ in range(4)]
+    norm = sum(value * value for value in values) ** 0.5
+    return [value / norm for value in values]
+
+
+def create_binding_table(joints_count):
+    binding_table = mosketch_for_maya.BindingTable(rotate_translation=True)
+    for index in range(joints_count):
+        rotate_axis = pmc.datatypes.EulerRotation(random.uniform(-3, 3), random.uniform(-3, 3), random.uniform(-3, 3)).asQuaternion()
+        joint_orient = pmc.datatypes.Quaternion(random_quaternion())
+        binding_table.add("joint_" + str(index), None, rotate_axis, joint_orient)
+    return binding_table
+
+
+def create_frames(joints_count):
+    """
+    Returns the same random frame as a decoded Json JointsStream and as a BinaryJointsStream.
+    """
+    names = ["joint_" + str(index) for index in range(joints_count)]
+    rotations = [random_quaternion() for _ in names]
+    translations = [[random.uniform(-1, 1) for _ in range(3)] for _ in names]
+    anatomic_types = [7 if index % 10 == 0 else 1 for index in range(joints_count)]
+
+    json_frame = {"Type": "JointsStream", "Joints": [
+        {"Name": name, "R": rotation, "T": translation, "Anatom": anatomic_type}
+        for name, rotation, translation, anatomic_type in zip(names, rotations, translations, anatomic_types)]}
+
+    binary_frame = struct.pack(str("<4sHHI"), mosketch_for_maya.BINARY_STREAM_MAGIC, mosketch_for_maya.BINARY_STREAM_VERSION, joints_count, 0)
+    binary_frame += struct.pack(str("<%df") % (4 * joints_count), *[value for rotation in rotations for value in rotation])
+    binary_frame += struct.pack(str("<%df") % (3 * joints_count), *[value for translation in translations for value in translation])
+    binary_frame += struct.pack(str("<%dB") % joints_count, *anatomic_types)
+    return json_frame, mosketch_for_maya.BinaryJointsStream(binary_frame, names)
+
+
+def main():
+    mosketch_for_maya.NUMPY_MIN_JOINTS = 0 # Measure NumPy even on small rigs
+    backends = [backend for backend in mosketch_for_maya.RETARGET_BACKENDS
+                if (backend != "numpy" or mosketch_for_maya.numpy is not None) and (backend != "pymel" or ARGS.mayapy)]
+    print("per frame cost in microseconds")
+    print("%8s %8s" % ("joints", "format") + "".join("%12s" % backend for backend in backends))
+    for joints_count in ARGS.joints:
+        binding_table = create_binding_table(joints_count)
+        json_frame, binary_frame = create_frames(joints_count)
+        for format_name, frame in (("json", json_frame), ("binary", binary_frame)):
+            costs = []
+            for backend in backends:
+                measure = lambda: mosketch_for_maya._retarget_joints_stream(binding_table, frame, backend)
+                measure() # Resolution and inverse arrays are built once per hierarchy
+                costs.append(min(timeit.repeat(measure, number=ARGS.frames, repeat=3)) / ARGS.frames * 1e6)
+            print("%8d %8s" % (joints_count, format_name) + "".join("%12.1f" % cost for cost in costs))
+
+
+if __name__ == "__main__":
+    main()
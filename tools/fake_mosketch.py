@@ -0,0 +1,409 @@
+# coding: utf-8
+"""
+Stand-in for Mosketch's streaming server, to use mosketch_for_maya without Mosketch.
+
+It listens on port 16094 and, for each client:
+    - sends a Hierarchy and waits for HierarchyInitializedAck
+    - sends the JointsUuids and waits for JointsUuidsAck
+    - streams JointsStreams of a synthetic skeleton at the requested frame rate, one at a time
+      (the next one is sent once the previous one is acknowledged) or without waiting (--no-wait-ack)
+MosketchCommands are logged, setStreamingFormat "binary" switches to binary JointsStreams and
+setStreamingAckMode "windowed" is accepted: up to the advertised window of frames are then sent past the
+highest acknowledged sequence. setStreamingTransport "sharedMemory" is accepted for binary JointsStreams:
+they are then written into the client's shared memory file (see mosketch_for_maya.SharedPoseBuffer) instead
+of the socket, and nothing is acknowledged.
+With --capture it sends the Hierarchy, JointsUuids and JointsStreams of a capture file instead (see
+mosketch_for_maya.start_capture()) in their recorded order, so that different clients get the same traffic.
+
+Usage (stand-alone, no dependency):
+    python tools/fake_mosketch.py                        # 150 joints at 60 fps until the client leaves
+    python tools/fake_mosketch.py --joints 1000 --fps 120 --frames 6000
+    python tools/fake_mosketch.py --capture session.mkcap --fps 0
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import math
+import mmap
+import select
+import socket
+import struct
+import sys
+import threading
+import time
+import zlib
+
+PORT = 16094
+
+BINARY_STREAM_MAGIC = b"MKJS"
+BINARY_STREAM_VERSION = 1
+_BINARY_HEADER = struct.Struct(str("<4sHHI"))
+
+# Same layout as mosketch_for_maya's capture files
+_CAPTURE_MAGIC = b"MKCAP"
+_CAPTURE_HEADER = struct.Struct(str("<5sH"))
+_CAPTURE_RECORD = struct.Struct(str("<dBI"))
+_CAPTURE_COMPRESSED = 1
+
+# Same layout as mosketch_for_maya's shared memory
+SHARED_MEMORY_MAGIC = b"MKSM"
+SHARED_MEMORY_VERSION = 1
+_SHARED_MEMORY_HEADER = struct.Struct(str("<4sHHHHI"))
+_SHARED_MEMORY_FRAME_NUMBER = struct.Struct(str("<Q"))
+
+
+def synthetic_joints_names(joints_count, prefix="joint_"):
+    return [prefix + str(index) for index in range(joints_count)]
+
+
+class RecordedSession(object):
+    """
+    Packets of a capture file: the first Hierarchy and JointsUuids, and every JointsStream.
+    """
+    def __init__(self, path):
+        with open(path, "rb") as capture_file:
+            data = capture_file.read()
+        magic, version = _CAPTURE_HEADER.unpack_from(data, 0)
+        if magic != _CAPTURE_MAGIC:
+            raise ValueError(path + " is not a capture file")
+        self.hierarchy = None
+        self.joints_uuids = None
+        self.joints_streams = []
+        offset = _CAPTURE_HEADER.size
+        while offset + _CAPTURE_RECORD.size <= len(data):
+            timestamp, flags, size = _CAPTURE_RECORD.unpack_from(data, offset)
+            offset += _CAPTURE_RECORD.size
+            packet = data[offset:offset + size]
+            offset += size
+            if flags & _CAPTURE_COMPRESSED:
+                packet = zlib.decompress(packet)
+            if packet.startswith(BINARY_STREAM_MAGIC):
+                self.joints_streams.append(packet)
+                continue
+            document = json.loads(packet.decode("utf-8"))
+            if document.get("Type") == "JointsStream":
+                self.joints_streams.append(document)
+            elif document.get("Type") == "Hierarchy" and self.hierarchy is None:
+                self.hierarchy = document
+            elif document.get("Type") == "JointsUuids" and self.joints_uuids is None:
+                self.joints_uuids = document
+        if self.hierarchy is None or self.joints_uuids is None or not self.joints_streams:
+            raise ValueError(path + " has no Hierarchy, JointsUuids or JointsStream")
+
+    def joints_stream(self, sequence):
+        """
+        Recorded JointsStream number sequence (looping), renumbered as sequence.
+        """
+        packet = self.joints_streams[sequence % len(self.joints_streams)]
+        if isinstance(packet, bytes):
+            return packet[:8] + struct.pack(str("<I"), sequence) + packet[_BINARY_HEADER.size:]
+        packet = dict(packet)
+        packet["Seq"] = sequence
+        return json.dumps(packet).encode("utf-8")
+
+
+class SharedPoseWriter(object):
+    """
+    Mosketch's side of the shared memory transport: writes binary JointsStreams into the file created by the client.
+    """
+    def __init__(self, path, joints_count):
+        self._file = open(path, "r+b")
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        magic, version, file_joints_count, self.slots, reserved, self.slot_size = _SHARED_MEMORY_HEADER.unpack_from(self._map, 0)
+        if magic != SHARED_MEMORY_MAGIC or version != SHARED_MEMORY_VERSION or file_joints_count != joints_count:
+            self.close()
+            raise ValueError(path + " is not a shared memory file for " + str(joints_count) + " joints")
+        self.frames_written = 0
+
+    def write(self, frame):
+        frame_number = self.frames_written + 1
+        offset = (_SHARED_MEMORY_HEADER.size + _SHARED_MEMORY_FRAME_NUMBER.size
+                  + (frame_number - 1) % self.slots * self.slot_size)
+        frame_offset = offset + _SHARED_MEMORY_FRAME_NUMBER.size
+        if frame_offset + len(frame) > offset + self.slot_size:
+            raise ValueError("JointsStream does not fit in a slot")
+        # The slot is marked as being written until the frame is complete, then the frame is published
+        _SHARED_MEMORY_FRAME_NUMBER.pack_into(self._map, offset, 0)
+        self._map[frame_offset:frame_offset + len(frame)] = frame
+        _SHARED_MEMORY_FRAME_NUMBER.pack_into(self._map, offset, frame_number)
+        _SHARED_MEMORY_FRAME_NUMBER.pack_into(self._map, _SHARED_MEMORY_HEADER.size, frame_number)
+        self.frames_written = frame_number
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+class JsonStreamReader(object):
+    """
+    Splits the bytes received from the client into Json documents.
+    """
+    def __init__(self):
+        self._buffer = ""
+        self._decoder = json.JSONDecoder()
+
+    def feed(self, data):
+        self._buffer += data.decode("utf-8")
+        documents = []
+        while True:
+            text = self._buffer.lstrip()
+            if not text:
+                self._buffer = ""
+                return documents
+            try:
+                document, end = self._decoder.raw_decode(text)
+            except ValueError: # Incomplete document
+                self._buffer = text
+                return documents
+            self._buffer = text[end:]
+            # Commands are sent in a list
+            documents.extend(document if isinstance(document, list) else [document])
+
+
+class FakeMosketchSession(object):
+    """
+    Protocol of one client connection. Latency of a JointsStream is the time between sending it and
+    receiving its JointsStreamAck.
+    """
+    def __init__(self, connection, joints_names, fps, frames_count=None, wait_ack=True, log=print, recorded=None):
+        self.connection = connection
+        self.joints_names = joints_names
+        self.recorded = recorded # RecordedSession replacing the synthetic skeleton
+        self.fps = fps
+        self.frames_count = frames_count
+        self.wait_ack = wait_ack
+        self.log = log
+        self.binary = False
+        self.windowed = False
+        self.window = 1
+        self.frames_sent = 0
+        self.latencies = [] # Seconds, in the order of the acknowledgements
+        self.shared = None # SharedPoseWriter once the client asked for the shared memory transport
+        self._reader = JsonStreamReader()
+        self._expected = None
+        self._sent_times = []
+        self._acks_count = 0
+
+    def run(self):
+        if self.recorded is not None:
+            self._send_json(self.recorded.hierarchy)
+            self._wait_for("HierarchyInitializedAck")
+            self._send_json(self.recorded.joints_uuids)
+        else:
+            self._send_json({"Type": "Hierarchy", "Joints": self.joints_names})
+            self._wait_for("HierarchyInitializedAck")
+            self._send_json({"Type": "JointsUuids", "Joints": [{name: "{%08d-fake}" % index}
+                                                                for index, name in enumerate(self.joints_names)]})
+        self._wait_for("JointsUuidsAck")
+
+        period = 1.0 / self.fps if self.fps else 0.0
+        next_time = time.time()
+        while self.frames_count is None or self.frames_sent < self.frames_count:
+            # Keep reading acknowledgements while waiting, so that their arrival time is accurate
+            while True:
+                can_send = not self.wait_ack or self._acks_count + (self.window if self.windowed else 0) >= self.frames_sent
+                delay = next_time - time.time()
+                if can_send and delay <= 0:
+                    break
+                if not self._receive(timeout=max(delay, 0.0) if can_send else None):
+                    return
+            next_time = max(next_time + period, time.time() - period)
+            if self.shared is not None and not self._receive(timeout=0.0):
+                return # Without acks, only reading tells that the client left
+            self._send_joints_stream()
+
+        # Remaining acknowledgements
+        while self._acks_count < self.frames_sent:
+            if not self._receive(timeout=2.0):
+                return
+
+    def close(self):
+        if self.shared is not None:
+            self.shared.close()
+            self.shared = None
+
+    def _send_json(self, packet):
+        self.connection.sendall(json.dumps(packet).encode("utf-8"))
+
+    def _send_joints_stream(self):
+        if self.recorded is not None:
+            self._write_joints_stream(self.recorded.joints_stream(self.frames_sent))
+            return
+
+        phase = 2.0 * math.pi * self.frames_sent / max(self.fps, 1.0)
+        joints_count = len(self.joints_names)
+        rotations = []
+        for index in range(joints_count):
+            angle = 0.25 * math.sin(phase + 0.1 * index)
+            rotations.append((0.0, 0.0, math.sin(angle), math.cos(angle)))
+        translations = [(0.0, 0.01 * math.sin(phase), 0.0)] * joints_count
+        anatomic_types = [7 if index == 0 else 1 for index in range(joints_count)]
+
+        if self.binary:
+            packet = _BINARY_HEADER.pack(BINARY_STREAM_MAGIC, BINARY_STREAM_VERSION, joints_count, self.frames_sent)
+            packet += struct.pack(str("<%df") % (4 * joints_count), *[value for rotation in rotations for value in rotation])
+            packet += struct.pack(str("<%df") % (3 * joints_count), *[value for translation in translations for value in translation])
+            packet += struct.pack(str("<%dB") % joints_count, *anatomic_types)
+        else:
+            packet = json.dumps({"Type": "JointsStream", "Seq": self.frames_sent, "Joints": [
+                {"Name": name, "R": rotation, "T": translation, "Anatom": anatomic_type}
+                for name, rotation, translation, anatomic_type in zip(self.joints_names, rotations, translations, anatomic_types)]}).encode("utf-8")
+        self._write_joints_stream(packet)
+
+    def _write_joints_stream(self, packet):
+        if self.shared is not None:
+            self.shared.write(packet)
+            self.frames_sent += 1
+            self._acks_count = self.frames_sent # Nothing to wait for
+            return
+        self._sent_times.append(time.time())
+        self.connection.sendall(packet)
+        self.frames_sent += 1
+
+    def _wait_for(self, packet_type):
+        self._expected = packet_type
+        while self._expected is not None:
+            if not self._receive():
+                raise IOError("client left before " + packet_type)
+
+    def _receive(self, timeout=None):
+        """
+        Handle what the client sent, waiting at most timeout seconds (forever if None).
+        Returns False once it is disconnected.
+        """
+        try:
+            if timeout is not None and not select.select([self.connection], [], [], timeout)[0]:
+                return True
+            data = self.connection.recv(65536)
+        except (select.error, socket.error):
+            return False
+        if not data:
+            return False
+        now = time.time()
+        for packet in self._reader.feed(data):
+            packet_type = packet.get("Type")
+            if packet_type == "JointsStreamAck":
+                # A windowed ack acknowledges every frame up to its sequence
+                acked_count = packet["Seq"] + 1 if "Seq" in packet else self._acks_count + 1
+                for sequence in range(self._acks_count, min(acked_count, len(self._sent_times))):
+                    self.latencies.append(now - self._sent_times[sequence])
+                self._acks_count = max(self._acks_count, acked_count)
+                self.window = packet.get("Window", self.window)
+            elif packet_type == "MosketchCommand":
+                self._process_command(packet)
+            elif packet_type == self._expected:
+                self._expected = None
+            else:
+                self.log("unexpected packet: " + json.dumps(packet))
+        return True
+
+    def _process_command(self, packet):
+        self.log("command " + packet.get("command", "?") + " " + json.dumps(packet.get("parameters", {})))
+        if packet.get("command") == "setStreamingFormat":
+            parameters = packet.get("parameters", {})
+            self.binary = parameters.get("format") == "binary" and parameters.get("version") == str(BINARY_STREAM_VERSION)
+        elif packet.get("command") == "setStreamingAckMode":
+            self.windowed = packet.get("parameters", {}).get("mode") == "windowed"
+            self._send_json({"Type": "JointsStreamAckMode", "Mode": "windowed" if self.windowed else "perFrame"})
+        elif packet.get("command") == "setStreamingTransport":
+            self._open_shared_memory(packet.get("parameters", {}))
+            self._send_json({"Type": "JointsStreamTransport", "Transport": "sharedMemory" if self.shared is not None else "tcp"})
+
+    def _open_shared_memory(self, parameters):
+        self.close()
+        # Only binary JointsStreams have a fixed size
+        binary = self.binary if self.recorded is None else isinstance(self.recorded.joints_streams[0], bytes)
+        if (parameters.get("transport") != "sharedMemory" or parameters.get("version") != str(SHARED_MEMORY_VERSION)
+                or not binary):
+            return
+        joints_count = len(self.recorded.joints_uuids["Joints"]) if self.recorded is not None else len(self.joints_names)
+        try:
+            self.shared = SharedPoseWriter(parameters["path"], joints_count)
+        except (KeyError, ValueError, IOError, OSError) as e:
+            self.log("cannot open shared memory: " + str(e))
+
+
+class FakeMosketchServer(threading.Thread):
+    """
+    Accepts clients one after the other and runs a FakeMosketchSession for each.
+    The last finished session is kept in last_session.
+    """
+    def __init__(self, joints_names, fps=60.0, frames_count=None, wait_ack=True, port=PORT, host="127.0.0.1", log=print,
+                 sessions_count=None, recorded=None):
+        super(FakeMosketchServer, self).__init__(name="FakeMosketch")
+        self.daemon = True
+        self.joints_names = joints_names
+        self.fps = fps
+        self.frames_count = frames_count
+        self.wait_ack = wait_ack
+        self.log = log
+        self.sessions_count = sessions_count
+        self.recorded = recorded
+        self.last_session = None
+        self.session_done = threading.Event()
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((host, port))
+        self._server.listen(1)
+        self.port = self._server.getsockname()[1]
+
+    def run(self):
+        sessions = 0
+        while self.sessions_count is None or sessions < self.sessions_count:
+            try:
+                connection, address = self._server.accept()
+            except socket.error:
+                return # Closed
+            self.log("client connected from " + str(address))
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            session = FakeMosketchSession(connection, self.joints_names, self.fps, self.frames_count, self.wait_ack, self.log,
+                                          self.recorded)
+            try:
+                session.run()
+            except (IOError, socket.error) as e:
+                self.log("session ended: " + str(e))
+            finally:
+                session.close()
+                connection.close()
+            self.log("client left after " + str(session.frames_sent) + " JointsStreams")
+            self.last_session = session
+            self.session_done.set()
+            sessions += 1
+        self.close()
+
+    def close(self):
+        self._server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--joints", type=int, default=150)
+    parser.add_argument("--fps", type=float, default=60.0, help="0 streams as fast as possible")
+    parser.add_argument("--frames", type=int, help="JointsStreams per session, unlimited by default")
+    parser.add_argument("--no-wait-ack", dest="wait_ack", action="store_false",
+                        help="do not wait for JointsStreamAck before sending the next JointsStream")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--once", action="store_true",
+                        help="exit after the first session and print its latencies as Json on the last line")
+    parser.add_argument("--quiet", action="store_true")
+    parser.add_argument("--capture", help="send the packets of this capture file instead of a synthetic skeleton")
+    args = parser.parse_args()
+
+    log = (lambda message: None) if args.quiet else print
+    recorded = RecordedSession(args.capture) if args.capture else None
+    server = FakeMosketchServer(synthetic_joints_names(args.joints), args.fps, args.frames, args.wait_ack, args.port, args.host,
+                                log, sessions_count=1 if args.once else None, recorded=recorded)
+    print("fake Mosketch listening on %s:%d" % (args.host, server.port))
+    sys.stdout.flush()
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        server.close()
+    if args.once and server.last_session is not None:
+        print(json.dumps({"frames_sent": server.last_session.frames_sent, "latencies": server.last_session.latencies}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+# coding: utf-8
+"""
+Minimal stand-ins for pymel, maya and Qt so that mosketch_for_maya can be imported
+outside of Maya (benchmarks, fake Mosketch sessions...):
+    import maya_mocks
+    maya_mocks.install()
+    import mosketch_for_maya
+
+Only what mosketch_for_maya uses is mocked. Joints are plain Python objects registered
+in MockJoint.scene, quaternions follow pymel's conventions.
+"""
+from __future__ import print_function
+
+import math
+import os
+import sys
+import types
+
+
+class _Anything(object):
+    """
+    Accepts any call and any attribute (widgets, signals, timers...).
+    """
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __call__(self, *args, **kwargs):
+        return _Anything()
+
+    def __getattr__(self, name):
+        return _Anything()
+
+
+class _AnythingModule(types.ModuleType):
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return _Anything
+
+
+################################################################################
+##########          PYMEL DATATYPES
+################################################################################
+class Quaternion(object):
+    def __init__(self, values=None):
+        if values is None:
+            values = (0.0, 0.0, 0.0, 1.0)
+        self.x, self.y, self.z, self.w = [float(value) for value in values]
+
+    def __getitem__(self, index):
+        return (self.x, self.y, self.z, self.w)[index]
+
+    def __mul__(self, other):
+        # Same as MQuaternion: a * b applies a then b
+        ax, ay, az, aw = other.x, other.y, other.z, other.w
+        bx, by, bz, bw = self.x, self.y, self.z, self.w
+        return Quaternion((aw * bx + ax * bw + ay * bz - az * by,
+                           aw * by - ax * bz + ay * bw + az * bx,
+                           aw * bz + ax * by - ay * bx + az * bw,
+                           aw * bw - ax * bx - ay * by - az * bz))
+
+    def inverse(self):
+        norm = self.x * self.x + self.y * self.y + self.z * self.z + self.w * self.w
+        return Quaternion((-self.x / norm, -self.y / norm, -self.z / norm, self.w / norm))
+
+
+class Vector(object):
+    def __init__(self, values=None):
+        if values is None:
+            values = (0.0, 0.0, 0.0)
+        self.values = [float(value) for value in values]
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+    def __imul__(self, scale):
+        self.values = [value * scale for value in self.values]
+        return self
+
+    def rotateBy(self, quat):
+        rotated = quat.inverse() * Quaternion(self.values + [0.0]) * quat
+        return Vector((rotated.x, rotated.y, rotated.z))
+
+
+class EulerRotation(object):
+    def __init__(self, x=0.0, y=0.0, z=0.0):
+        self.values = (x, y, z)
+
+    def asQuaternion(self):
+        quat = Quaternion()
+        for axis, angle in enumerate(self.values):
+            values = [0.0, 0.0, 0.0, math.cos(angle * 0.5)]
+            values[axis] = math.sin(angle * 0.5)
+            quat = quat * Quaternion(values)
+        return quat
+
+
+################################################################################
+##########          SCENE
+################################################################################
+class MockJoint(object):
+    """
+    A joint with a rotate axis and a joint orient. Counts the writes done on it.
+    """
+    scene = []
+
+    def __init__(self, name, rotate_axis=(0.0, 0.0, 0.0), orient=(0.0, 0.0, 0.0)):
+        self._name = name
+        self.rotate_axis = rotate_axis
+        self.orient_angles = orient
+        self.orient = EulerRotation(*orient).asQuaternion()
+        self.rotation = Quaternion()
+        self.translation = Vector()
+        self.writes = 0
+        self.deleted = False
+        MockJoint.scene.append(self)
+
+    def exists(self):
+        return not self.deleted
+
+    def name(self):
+        return self._name
+
+    def longName(self):
+        return "|" + self._name
+
+    def getRotateAxis(self):
+        return self.rotate_axis
+
+    def getOrientation(self):
+        return self.orient
+
+    def getRotation(self, space=None, quaternion=False):
+        return self.rotation
+
+    def setRotation(self, quat, space=None):
+        self.rotation = quat
+        self.writes += 1
+
+    def getTranslation(self, space=None):
+        return Vector(self.translation.values)
+
+    def setTranslation(self, translation, space=None):
+        self.translation = translation
+        self.writes += 1
+
+
+def create_skeleton(joints_count, prefix="joint_"):
+    """
+    Replace the mocked scene by joints_count joints with arbitrary rotate axis and joint orient.
+    Returns the joints names.
+    """
+    return create_named_skeleton([prefix + str(index) for index in range(joints_count)])
+
+
+def create_named_skeleton(names):
+    """
+    Same as create_skeleton() with the given joints names (of a captured Hierarchy for instance).
+    """
+    for joint in MockJoint.scene:
+        joint.deleted = True
+    del MockJoint.scene[:]
+    for index, name in enumerate(names):
+        angle = 0.01 * (index % 31)
+        MockJoint(name, rotate_axis=(angle, 0.0, 0.0), orient=(0.0, angle, 0.5 * angle))
+    return list(names)
+
+
+def _ls(*args, **kwargs):
+    if kwargs.get("type") == "joint":
+        return list(MockJoint.scene)
+    return []
+
+
+def _cmds_ls(*args, **kwargs):
+    node_types = kwargs.get("type")
+    if node_types == "joint" or (isinstance(node_types, list) and "joint" in node_types):
+        if kwargs.get("uuid"):
+            return ["%08X-MOCK" % index for index, joint in enumerate(MockJoint.scene)]
+        return [joint.longName() for joint in MockJoint.scene]
+    return []
+
+
+def _cmds_get_attr(plug):
+    node, attribute = plug.rsplit(".", 1)
+    joint = _py_node(node)
+    if attribute == "jointOrient":
+        return [tuple(joint.orient_angles)]
+    if attribute == "rotateAxis":
+        return [tuple(joint.rotate_axis)]
+    raise ValueError("No attribute matches name: " + plug)
+
+
+def _py_node(name):
+    for joint in MockJoint.scene:
+        if name in (joint.longName(), joint.name()):
+            return joint
+    raise RuntimeError("No object matches name: " + name)
+
+
+################################################################################
+##########          INSTALL
+################################################################################
+def _module(name, cls=types.ModuleType):
+    return cls(str(name))
+
+
+def install():
+    """
+    Register the mocked modules and make mosketch_for_maya importable.
+    """
+    core = _module("pymel.core")
+    core.datatypes = _module("pymel.core.datatypes")
+    core.datatypes.Quaternion = Quaternion
+    core.datatypes.Vector = Vector
+    core.datatypes.EulerRotation = EulerRotation
+    core.nodetypes = _module("pymel.core.nodetypes")
+    core.nodetypes.Joint = MockJoint
+    core.ls = _ls
+    core.PyNode = _py_node
+    pymel = _module("pymel")
+    pymel.core = core
+
+    maya = _module("maya")
+    maya.cmds = _module("maya.cmds", _AnythingModule)
+    maya.cmds.ls = _cmds_ls
+    maya.cmds.getAttr = _cmds_get_attr
+    maya.OpenMayaUI = _module("maya.OpenMayaUI", _AnythingModule)
+    maya.mel = _module("maya.mel", _AnythingModule)
+
+    qt = _module("Qt", _AnythingModule)
+    qt.__binding__ = "PySide2"
+    qt.__version__ = "mock"
+    for name in ("QtCore", "QtGui", "QtWidgets", "QtNetwork"):
+        setattr(qt, name, _module("Qt." + name, _AnythingModule))
+    qt.QtWidgets.QDialog = object
+
+    modules = {
+        "pymel": pymel,
+        "pymel.core": core,
+        "maya": maya,
+        "maya.cmds": maya.cmds,
+        "maya.OpenMayaUI": maya.OpenMayaUI,
+        "maya.mel": maya.mel,
+        "Qt": qt,
+        "shiboken2": _module("shiboken2", _AnythingModule),
+    }
+    for name in ("QtCore", "QtGui", "QtWidgets", "QtNetwork"):
+        modules["Qt." + name] = getattr(qt, name)
+    sys.modules.update(modules)
+
+    repository_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if repository_dir not in sys.path:
+        sys.path.insert(0, repository_dir)